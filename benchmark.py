@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Benchmark suite on synthetic sessions.
+#
+# For each scenario (participants x total waypoints) a synthetic data set is
+# generated once under BENCH_DIR and reused. Every stage of the pipeline is
+# then timed on it: cold and warm ingest, the waypoint frame, the track index,
+# level-of-detail importance, route metrics, map HTML generation, object
+# localization scoring, and the Dash app's startup and callback latency and the
+# cost of adding one more session to it while it runs (in a separate process,
+# since wayfinding.py loads its data at import). Results are
+# written as JSON with the commit and machine they came from; pass
+# `--compare old.json` to print the change per stage against an earlier run.
+#
+#   python benchmark.py --output results.json
+#   python benchmark.py --scenario 1000:10000000 --stages ingest_cold ingest_warm
+#   python benchmark.py --output new.json --compare results.json
+
+BENCH_DIR = os.environ.get(
+    'WAYFINDING_BENCH_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.wayfinding_bench'),
+)
+
+DEFAULT_SCENARIOS = [(1, 1000), (10, 10000), (100, 100000)]
+
+STAGES = ['ingest_cold', 'ingest_warm', 'waypoint_frame', 'smoothing', 'task_index', 'lod_importance',
+          'route_metrics', 'segmentation', 'density', 'similarity', 'map_html', 'object_scoring', 'dash']
+
+# Tracks rendered per map_html / callback measurement
+MAP_SAMPLES = 5
+
+# Slider positions per playback scrub
+PLAYBACK_STEPS = 50
+
+
+def _scenario(text):
+    participants, waypoints = text.split(':')
+    return int(participants), int(float(waypoints))
+
+
+def _timed(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+
+def _record(stage, scenario, seconds, items=None):
+    median = float(np.median(seconds))
+    record = {
+        'stage': stage,
+        'participants': scenario[0],
+        'waypoints': scenario[1],
+        'repeat': len(seconds),
+        'median_s': median,
+        'min_s': float(np.min(seconds)),
+        'max_s': float(np.max(seconds)),
+    }
+    if items is not None:
+        record['items'] = int(items)
+        record['items_per_s'] = items / median if median else None
+    return record
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _scenario_dirs(scenario, seed):
+    name = f'{scenario[0]}x{scenario[1]}-{seed}'
+    return os.path.join(BENCH_DIR, 'data', name), os.path.join(BENCH_DIR, 'cache', name)
+
+
+def run_scenario(scenario, stages, repeat=3, seed=0, workers=None):
+    """Time the selected stages on one generated data set; returns result records."""
+    from density_grid import ALL_TASKS, DensityGrid
+    from event_index import EventIndex
+    from ingest import ingest
+    from map_render import create_density_map, create_map
+    from metrics import route_metrics
+    from object_scoring import accuracy_table, score_clicks
+    from segmentation import detect_segments
+    from similarity import MATRIX_POINTS, nearest, similarity_table, square_matrix, task_routes, track_routes
+    from smoothing import smooth_tracks
+    from simplify import lod_importance
+    from synthetic_sessions import write_sessions
+    from task_index import TaskIndex
+    from waypoint_table import DASHBOARD_COLUMNS, frame_bytes
+
+    data_dir, cache_dir = _scenario_dirs(scenario, seed)
+    start = time.perf_counter()
+    write_sessions(data_dir, *scenario, seed=seed)
+    print(f"data {scenario[0]}x{scenario[1]} ready in {time.perf_counter() - start:.1f} s")
+
+    results = []
+    waypoints = scenario[1]
+
+    def cold_ingest():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return ingest(data_dir, workers=workers, cache_dir=cache_dir)
+
+    if 'ingest_cold' in stages:
+        _, seconds = _timed(cold_ingest, repeat)
+        results.append(_record('ingest_cold', scenario, seconds, waypoints))
+    elif not os.path.isdir(cache_dir):
+        cold_ingest()
+    store, seconds = _timed(lambda: ingest(data_dir, workers=workers, cache_dir=cache_dir), repeat)
+    if 'ingest_warm' in stages:
+        results.append(_record('ingest_warm', scenario, seconds, waypoints))
+
+    # The compact view the dashboard builds, plus its memory per million waypoints
+    frame, seconds = _timed(lambda: store.waypoint_frame(DASHBOARD_COLUMNS, compact=True), repeat)
+    if 'waypoint_frame' in stages:
+        results.append(_record('waypoint_frame', scenario, seconds, len(frame)))
+        results[-1]['MB_per_million'] = frame_bytes(frame) * 1e6 / max(len(frame), 1) / 2 ** 20
+
+    if 'smoothing' in stages:
+        smoothed, seconds = _timed(lambda: smooth_tracks(frame), repeat)
+        results.append(_record('smoothing', scenario, seconds, len(smoothed)))
+
+    if 'lod_importance' in stages or 'map_html' in stages:
+        importance, seconds = _timed(lambda: lod_importance(frame), repeat)
+        frame['lod_importance'] = importance
+        if 'lod_importance' in stages:
+            results.append(_record('lod_importance', scenario, seconds, len(frame)))
+
+    tracks, seconds = _timed(lambda: TaskIndex(frame), repeat)
+    if 'task_index' in stages:
+        results.append(_record('task_index', scenario, seconds, len(tracks)))
+
+    if 'route_metrics' in stages:
+        metrics, seconds = _timed(lambda: route_metrics(tracks.frame), repeat)
+        results.append(_record('route_metrics', scenario, seconds, len(metrics)))
+
+    if 'segmentation' in stages:
+        _, seconds = _timed(lambda: detect_segments(tracks.frame), repeat)
+        results.append(_record('segmentation', scenario, seconds, len(tracks.frame)))
+
+    # Group density: counting every waypoint into the grids, then one all-participant map
+    if 'density' in stages:
+        grid, seconds = _timed(lambda: DensityGrid(tracks.frame), repeat)
+        results.append(_record('density', scenario, seconds, len(tracks.frame)))
+        _, seconds = _timed(lambda: create_density_map(grid, ALL_TASKS, zoom=15), repeat)
+        results.append(_record('density_map', scenario, seconds, 1))
+
+    # Route similarity of one task's participants: the all-pairs matrix, then most-similar lookups
+    if 'similarity' in stages:
+        category, number = tracks.tasks()[0]
+        task = tracks.tracks(tracks.task_tracks(category, number))
+        table, seconds = _timed(
+            lambda: similarity_table(track_routes(task, (MATRIX_POINTS,)), workers=workers), repeat)
+        results.append(_record('similarity_matrix', scenario, seconds, len(table)))
+        keys, paths = task_routes(task)
+        matrix = square_matrix(table, keys)
+        rows = range(min(MAP_SAMPLES, len(keys)))
+
+        def lookups():
+            for row in rows:
+                others = np.flatnonzero(np.arange(len(keys)) != row)
+                nearest(paths[row], paths[others], prefilter=matrix[row, others])
+
+        _, seconds = _timed(lookups, repeat)
+        results.append(_record('similarity_lookup', scenario, [s / max(len(rows), 1) for s in seconds], 1))
+
+    if 'map_html' in stages:
+        keys = list(tracks.slices)[:MAP_SAMPLES]
+        _, seconds = _timed(lambda: [create_map(tracks.track(key)) for key in keys], repeat)
+        results.append(_record('map_html', scenario, [s / len(keys) for s in seconds], 1))
+
+    if 'object_scoring' in stages:
+        scores, seconds = _timed(lambda: score_clicks(EventIndex(store)), repeat)
+        accuracy_table(scores)
+        results.append(_record('object_scoring', scenario, seconds, len(scores)))
+
+    if 'dash' in stages:
+        results.extend(_run_callbacks(scenario, data_dir, cache_dir, repeat))
+    return results
+
+
+def _run_callbacks(scenario, data_dir, cache_dir, repeat):
+    # wayfinding.py loads its data at import, so it runs in a fresh process
+    env = dict(os.environ, WAYFINDING_DATA=data_dir, WAYFINDING_CACHE_DIR=cache_dir,
+               WAYFINDING_DROP_DIR=os.path.join(data_dir, 'incoming'), WAYFINDING_WATCH_INTERVAL='0')
+    command = [sys.executable, os.path.abspath(__file__), '--callbacks', f'{scenario[0]}:{scenario[1]}',
+               '--repeat', str(repeat)]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr[-2000:], file=sys.stderr)
+        return []
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def callback_latency(scenario, repeat):
+    """Dash startup (import, then data ready) and end-to-end callback latency through the Flask test client."""
+    from synthetic_sessions import GAME_TASKS, generate_session, write_session
+
+    start = time.perf_counter()
+    import wayfinding
+    startup = time.perf_counter() - start
+    while not wayfinding.data.ready.wait(0.01):
+        if wayfinding.data.error:
+            raise RuntimeError(wayfinding.data.error)
+    ready = time.perf_counter() - start
+    client = wayfinding.server.test_client()
+
+    def post(output, outputs, inputs, state=()):
+        response = client.post('/_dash-update-component', json={
+            'output': output,
+            'outputs': outputs if len(outputs) > 1 else outputs[0],
+            'inputs': [{'id': component, 'property': prop, 'value': value} for component, prop, value in inputs],
+            'state': [{'id': component, 'property': prop, 'value': value} for component, prop, value in state],
+            'changedPropIds': [f'{inputs[0][0]}.{inputs[0][1]}'],
+        })
+        assert response.status_code == 200, response.status_code
+
+    def participants(category, number):
+        post('..task-participant-dropdown.options...task-participant-dropdown.value..',
+             [{'id': 'task-participant-dropdown', 'property': 'options'},
+              {'id': 'task-participant-dropdown', 'property': 'value'}],
+             [('task-category-dropdown', 'value', category), ('task-number-dropdown', 'value', number)],
+             [('task-participant-dropdown', 'value', None)])
+
+    def update_map(participant, session, category, number, zoom):
+        # The participant dropdown's values are session ids
+        post('..map.srcDoc...map-token.data..', [{'id': 'map', 'property': 'srcDoc'},
+                                                  {'id': 'map-token', 'property': 'data'}],
+             [('task-participant-dropdown', 'value', session), ('task-category-dropdown', 'value', category),
+              ('task-number-dropdown', 'value', number), ('zoom-slider', 'value', zoom),
+              ('track-radio', 'value', 'smoothed'), ('map-view', 'value', 'track')])
+
+    keys = list(wayfinding.data.tracks.slices)[:MAP_SAMPLES]
+    tasks = wayfinding.data.tracks.tasks()
+    results = [_record('dash_startup', scenario, [startup]), _record('dash_ready', scenario, [ready])]
+    _, seconds = _timed(lambda: [participants(*task) for task in tasks], repeat)
+    results.append(_record('callback_participants', scenario, [s / len(tasks) for s in seconds], 1))
+    # Each repeat uses new zoom levels so every render misses the map cache
+    zooms = iter(range(12, 12 + repeat))
+
+    def render_round(zoom):
+        for key in keys:
+            update_map(*key, zoom)
+
+    _, seconds = _timed(lambda: render_round(next(zooms)), repeat)
+    results.append(_record('callback_map_cold', scenario, [s / len(keys) for s in seconds], 1))
+    _, seconds = _timed(lambda: render_round(12), repeat)
+    results.append(_record('callback_map_warm', scenario, [s / len(keys) for s in seconds], 1))
+
+    # Scrubbing the playback slider over one track, with the held rows threaded through as the browser does
+    _, session, category, number = keys[0]
+    duration = wayfinding.data.tracks.duration(keys[0])
+
+    def scrub():
+        state = None
+        for end in np.linspace(0, duration, PLAYBACK_STEPS):
+            response = client.post('/_dash-update-component', json={
+                'output': '..playback-message.data...playback-state.data..',
+                'outputs': [{'id': 'playback-message', 'property': 'data'},
+                            {'id': 'playback-state', 'property': 'data'}],
+                'inputs': [{'id': 'playback-window', 'property': 'value', 'value': [0, end]},
+                           {'id': 'map-token', 'property': 'data', 'value': 'benchmark'}],
+                'state': [{'id': component, 'property': 'value', 'value': value} for component, value in [
+                    ('task-participant-dropdown', session), ('task-category-dropdown', category),
+                    ('task-number-dropdown', number), ('track-radio', 'smoothed'), ('map-view', 'playback')]]
+                + [{'id': 'playback-state', 'property': 'data', 'value': state}],
+                'changedPropIds': ['playback-window.value'],
+            })
+            assert response.status_code == 200, response.status_code
+            state = response.json['response']['playback-state']['data']
+
+    _, seconds = _timed(scrub, repeat)
+    results.append(_record('callback_playback', scenario, [s / PLAYBACK_STEPS for s in seconds], 1))
+
+    # Adding one new participant's session (of the scenario's session size) to the running app;
+    # seeded per run so the session is new to the column cache as well
+    per_session = max(scenario[1] // scenario[0], len(GAME_TASKS))
+    drop_dir = tempfile.mkdtemp(prefix='wayfinding-drop-')
+    paths = []
+    for index in range(scenario[0], scenario[0] + repeat):
+        participant = f'P{index:04d}'
+        paths.append(os.path.join(drop_dir, f'{participant}-{per_session}.json'))
+        write_session(paths[-1], *generate_session(participant, per_session, seed=os.getpid() * 1000 + index))
+    new_paths = iter(paths)
+    try:
+        added, seconds = _timed(lambda: wayfinding.data.add_files([next(new_paths)]), repeat)
+    finally:
+        shutil.rmtree(drop_dir, ignore_errors=True)
+    results.append(_record('live_ingest', scenario, seconds, added['waypoints']))
+    return results
+
+
+def compare(results, baseline):
+    """Print median time per (scenario, stage) against an earlier results file."""
+    old = {(r['participants'], r['waypoints'], r['stage']): r['median_s'] for r in baseline['results']}
+    print(f"compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('created')})")
+    for record in results:
+        key = (record['participants'], record['waypoints'], record['stage'])
+        if key in old:
+            ratio = record['median_s'] / old[key] if old[key] else float('nan')
+            print(f"{key[0]:>5} x {key[1]:>9} {key[2]:<22} {old[key] * 1000:10.1f} ms -> "
+                  f"{record['median_s'] * 1000:10.1f} ms  ({ratio:.2f}x)")
+
+
+def print_results(results):
+    for record in results:
+        rate = f"{record['items_per_s']:,.0f}/s" if record.get('items_per_s') else ''
+        print(f"{record['participants']:>5} x {record['waypoints']:>9} {record['stage']:<22} "
+              f"{record['median_s'] * 1000:10.1f} ms  {rate}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the wayfinding pipeline on synthetic sessions")
+    parser.add_argument('--scenario', type=_scenario, action='append',
+                        help="PARTICIPANTS:WAYPOINTS (total), e.g. 1000:1e7; may be repeated")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="ingest worker processes")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--callbacks', type=_scenario, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.callbacks:
+        print(json.dumps(callback_latency(args.callbacks, args.repeat)))
+        sys.exit(0)
+
+    results = []
+    for scenario in args.scenario or DEFAULT_SCENARIOS:
+        results.extend(run_scenario(scenario, args.stages, args.repeat, args.seed, args.workers))
+    print_results(results)
+
+    report = {
+        'meta': {
+            'commit': _commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
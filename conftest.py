@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Set before the tests import the pipeline: the column and table caches of the
+# generated sessions go to a temporary directory instead of the working copy's
+# .wayfinding_cache, and the dashboard tests add sessions through /sessions only,
+# without the drop directory watcher.
+os.environ.setdefault('WAYFINDING_CACHE_DIR', tempfile.mkdtemp(prefix='wayfinding-test-cache-'))
+os.environ.setdefault('WAYFINDING_WATCH_INTERVAL', '0')
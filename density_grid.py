@@ -0,0 +1,183 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import local_lonlat, local_xy
+from simplify import metres_per_pixel
+from smoothing import MAX_ACCURACY
+
+# Where groups of participants walk: waypoint density on square grids.
+#
+# Every fix accurate enough to place in a cell (see smoothing.MAX_ACCURACY) is
+# binned into square cells of local metres around the study area, at
+# CELL_SIZES that double from level to level, so a coarse cell is exactly 2x2
+# cells of the level below and coarse counts are sums of finer ones. Counts
+# are kept per task and for all tasks together ("scopes"):
+#
+#   waypoints     fixes in the cell (grows with time spent there)
+#   participants  distinct participants with at least one fix in the cell
+#
+# Everything is counted once when the data is loaded. New sessions only add
+# fixes, so `extend` adds their counts (and participants not seen in a cell
+# before) without recounting. A map asks for one scope at one level, which is
+# a slice of a sorted index: its cost depends on the number of cells drawn,
+# bounded by MAX_CELLS, not on the number of participants or waypoints.
+
+CELL_SIZES = [10 * 2 ** level for level in range(7)]  # metres, 10 m .. 640 m
+
+# Cell size aimed for on screen, in pixels, and the most cells one map draws
+CELL_PIXELS = 12
+MAX_CELLS = 4000
+
+# Scope of all tasks together; task scopes are "<taskCategory>:<taskNo>"
+ALL_TASKS = 'all'
+
+VISIT_KEYS = ['scope', 'ix', 'iy', 'participant']
+
+
+def task_scope(category, number):
+    return f'{category}:{number}'
+
+
+def _fine_visits(frame, origin_lat):
+    # Fixes per (scope, finest cell, participant), for each task and for all tasks
+    lon = frame['longitude'].to_numpy(dtype=np.float64)
+    lat = frame['latitude'].to_numpy(dtype=np.float64)
+    keep = ~(np.isnan(lon) | np.isnan(lat))
+    if 'accuracy' in frame:
+        keep &= ~(frame['accuracy'].to_numpy(dtype=np.float64) > MAX_ACCURACY)
+    frame = frame[keep]
+    x, y = local_xy(lon[keep], lat[keep], origin_lat)
+    categories, category_labels = pd.factorize(frame['taskCategory'])
+    numbers, number_labels = pd.factorize(frame['taskNo'])
+    tasks, labels = pd.factorize(categories.astype(np.int64) * len(number_labels) + numbers)
+    scopes = [task_scope(category_labels[label // len(number_labels)], number_labels[label % len(number_labels)])
+              for label in labels] + [ALL_TASKS]
+    table = pd.DataFrame({
+        'scope': pd.Categorical.from_codes(tasks, scopes),
+        'ix': np.floor(x / CELL_SIZES[0]).astype(np.int64),
+        'iy': np.floor(y / CELL_SIZES[0]).astype(np.int64),
+        'participant': pd.Categorical(frame['participant']),
+    })
+    table = pd.concat([table, table.assign(scope=pd.Categorical.from_codes(
+        np.full(len(table), len(scopes) - 1), scopes))], ignore_index=True)
+    visits = table.groupby(VISIT_KEYS, observed=True, sort=False).size()
+    # Plain labels, so visits of later batches (other categories) line up with these
+    index = visits.index
+    return visits.set_axis(index.set_levels([index.levels[0].astype(str), index.levels[3].astype(str)],
+                                            level=['scope', 'participant']))
+
+
+def _coarsen(visits, level):
+    # Visits of the finest level summed into the cells of `level` (grouped on the
+    # integer codes of the scope and participant labels, not the labels)
+    if level == 0:
+        return visits
+    index = visits.index
+    coarse = visits.groupby([index.codes[0], index.get_level_values('ix').to_numpy() >> level,
+                             index.get_level_values('iy').to_numpy() >> level, index.codes[3]], sort=False).sum()
+    codes = coarse.index
+    return coarse.set_axis(pd.MultiIndex(
+        levels=[index.levels[0], codes.levels[1], codes.levels[2], index.levels[3]],
+        codes=[codes.levels[0][codes.codes[0]], codes.codes[1], codes.codes[2], codes.levels[3][codes.codes[3]]],
+        names=VISIT_KEYS))
+
+
+def _add_level(visited, cells, visits):
+    """(visited, cells) of one level with `visits` (fixes per (scope, cell, participant)) added."""
+    new = visits if visited is None else visits[~visits.index.isin(visited)]
+    counts = pd.DataFrame({
+        'waypoints': visits.groupby(level=['scope', 'ix', 'iy'], observed=True).sum(),
+        'participants': new.groupby(level=['scope', 'ix', 'iy'], observed=True).size(),
+    }).fillna(0).astype(np.int64)
+    if cells is not None:
+        counts = cells.add(counts, fill_value=0).astype(np.int64)
+        visited = visited.append(new.index)
+    else:
+        visited = new.index
+    return visited, counts.sort_index()
+
+
+class DensityGrid:
+
+    def __init__(self, frame, origin_lat=None):
+        """Density of the waypoints of `frame` (needs the key columns, longitude, latitude and,
+        optionally, accuracy)."""
+        if origin_lat is None:
+            lat = frame['latitude'].to_numpy(dtype=np.float64)
+            origin_lat = float(np.nanmean(lat)) if np.isfinite(lat).any() else 0.0
+        self.origin_lat = origin_lat
+        self.visited = [None] * len(CELL_SIZES)
+        self.cells = [None] * len(CELL_SIZES)
+        self.scope_participants = None
+        self._add(frame)
+
+    def _add(self, frame):
+        visits = _fine_visits(frame, self.origin_lat)
+        for level in range(len(CELL_SIZES)):
+            self.visited[level], self.cells[level] = _add_level(self.visited[level], self.cells[level],
+                                                                _coarsen(visits, level))
+        # Distinct participants per scope, from the (scope, participant) codes of the coarsest level
+        visited = self.visited[-1]
+        participants = len(visited.levels[3])
+        pairs = np.unique(visited.codes[0].astype(np.int64) * participants + visited.codes[3])
+        counts = pd.Series(np.bincount(pairs // participants, minlength=len(visited.levels[0])),
+                           index=visited.levels[0])
+        self.scope_participants = counts[counts > 0].sort_index()
+
+    def extend(self, frame):
+        """A new DensityGrid with the waypoints of `frame` (new fixes only) added."""
+        grid = DensityGrid.__new__(DensityGrid)
+        grid.origin_lat = self.origin_lat
+        grid.visited, grid.cells = list(self.visited), list(self.cells)
+        grid._add(frame)
+        return grid
+
+    def participants(self, scope=ALL_TASKS):
+        return int(self.scope_participants.get(scope, 0))
+
+    def level_for_zoom(self, zoom, scope=ALL_TASKS):
+        """Finest level whose cells are at least CELL_PIXELS wide at `zoom` and that has at most
+        MAX_CELLS cells in `scope`."""
+        target = CELL_PIXELS * metres_per_pixel(zoom, self.origin_lat)
+        level = max(int(np.searchsorted(CELL_SIZES, target, side='right')) - 1, 0)
+        while level < len(CELL_SIZES) - 1 and len(self.layer(scope, level)) > MAX_CELLS:
+            level += 1
+        return level
+
+    def layer(self, scope, level):
+        """Cells of one scope at one level: ix, iy, waypoints and participants."""
+        cells = self.cells[level]
+        if scope not in cells.index.levels[0]:
+            return pd.DataFrame({'ix': [], 'iy': [], 'waypoints': [], 'participants': []})
+        return cells.xs(scope, level='scope').reset_index()
+
+    def polygons(self, cells, level):
+        """Corner coordinates (lon, lat) of cells as an array of shape (cells, 5, 2)."""
+        size = CELL_SIZES[level]
+        x0 = cells['ix'].to_numpy(dtype=np.float64) * size
+        y0 = cells['iy'].to_numpy(dtype=np.float64) * size
+        x = np.stack([x0, x0 + size, x0 + size, x0, x0], axis=1)
+        y = np.stack([y0, y0, y0 + size, y0 + size, y0], axis=1)
+        return np.stack(local_lonlat(x, y, self.origin_lat), axis=2)
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+    from waypoint_table import DASHBOARD_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Count waypoints per grid cell at every level")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    args = parser.parse_args()
+
+    frame = ingest(args.source).waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+    start = time.perf_counter()
+    grid = DensityGrid(frame)
+    seconds = time.perf_counter() - start
+    for level, size in enumerate(CELL_SIZES):
+        cells = grid.layer(ALL_TASKS, level)
+        print(f"{size:>4} m: {len(cells):>7} cells, up to {cells['participants'].max():.0f} participants "
+              f"and {cells['waypoints'].max():.0f} waypoints in one")
+    print(f"{len(frame)} waypoints of {grid.participants()} participants counted in {seconds:.2f} s")
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from metrics import sort_tracks
+from task_index import _plain
+
+# (type, task_type, participant) -> contiguous row slice of the event table.
+#
+# The events of all ingested sessions are already typed columns (see
+# session_loader.py). Here they are sorted once by event type, task type,
+# participant and timestamp, so every combination of the three keys is one
+# contiguous block, and so is every event type on its own. A query is a dict
+# lookup plus an iloc slice; queries on task type or participant alone gather
+# the few matching blocks instead of scanning the rows. The frame keeps the
+# store's row numbers as its index, so `store.task_geometry[i]` still lines up.
+
+EVENT_KEYS = ['type', 'task_type', 'participant']
+
+
+class EventIndex:
+
+    def __init__(self, store, columns=None, keys=EVENT_KEYS):
+        self.keys = keys
+        self.store = store
+        frame = store.event_frame(columns)
+        for key in keys:
+            frame[key] = frame[key].astype('category')
+        order, starts = sort_tracks(frame, keys)
+        self.frame = frame.iloc[order]
+        ends = np.append(starts[1:], len(order))
+        first_rows = self.frame.iloc[starts][keys].itertuples(index=False, name=None)
+        self.slices = {
+            tuple(_plain(value) for value in key): slice(int(start), int(end))
+            for key, start, end in zip(first_rows, starts, ends)
+        }
+        # Event type is the leading sort key, so each type is one block too
+        self.type_slices = {}
+        for (event_type, _, _), rows in self.slices.items():
+            first = self.type_slices.get(event_type, rows)
+            self.type_slices[event_type] = slice(first.start, rows.stop)
+
+    def select(self, type=None, task_type=None, participant=None):
+        """Events matching every given key, ordered by key and timestamp."""
+        if task_type is None and participant is None:
+            if type is None:
+                return self.frame
+            return self.frame.iloc[self.type_slices.get(type, slice(0, 0))]
+        if type is not None and task_type is not None and participant is not None:
+            return self.frame.iloc[self.slices.get((type, task_type, participant), slice(0, 0))]
+        query = (type, task_type, participant)
+        blocks = [np.arange(rows.start, rows.stop) for key, rows in self.slices.items()
+                  if all(wanted is None or wanted == value for wanted, value in zip(query, key))]
+        return self.frame.iloc[np.concatenate(blocks) if blocks else []]
+
+    def task_geometry(self, events):
+        """Question geometry (GeoJSON or None) of each row of a selection."""
+        return [self.store.task_geometry[row] for row in events.index]
+
+    def types(self):
+        return sorted(self.type_slices)
+
+    def counts(self):
+        """Number of events per (type, task_type, participant)."""
+        return pd.Series({key: rows.stop - rows.start for key, rows in self.slices.items()},
+                         name='events').rename_axis(self.keys)
+
+    def __contains__(self, key):
+        return key in self.slices
+
+    def __len__(self):
+        return len(self.frame)
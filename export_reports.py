@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from event_index import EventIndex
+from ingest import DATA_SOURCE, ingest
+from map_render import create_map
+from metrics import METRICS_VERSION
+from object_location import localization_map
+from object_scoring import accuracy_table, score_clicks
+from segmentation import SEGMENTS_VERSION, SUMMARY_COLUMNS, detect_segments, track_segments
+from session_cache import CACHE_DIR, open_cached
+from session_store import SessionStore
+from smoothing import SMOOTHING_VERSION, smoothed_view
+from task_index import SESSION_LABEL, TaskIndex
+from track_tables import derive_columns, label_tracks, metrics_table, track_metrics
+from waypoint_table import DASHBOARD_COLUMNS
+
+# Offline export of a whole study: every participant x task map, the object
+# localization map, and the metrics tables and figures, as static files.
+#
+#   <out>/index.html
+#   <out>/maps/<participant>/<taskCategory>-<taskNo>[-<session>].html
+#   <out>/maps/<participant>/metrics.csv
+#   <out>/metrics.csv, accuracy.csv, object_scores.csv
+#   <out>/figures/<metric>.html
+#   <out>/object_localization.html
+#
+# Participants are the unit of work. Each one is exported in a worker process
+# that memory-maps only that participant's sessions from the column cache
+# (nothing large is pickled), derives the tracks as the dashboard does (see
+# track_tables.py) and writes its maps and metrics. The manifest records a
+# fingerprint of every output's inputs (source file hashes, export settings
+# and the versions of the computations), so a re-run only redoes participants
+# whose sessions changed, plus the study-wide files when anything did.
+
+REPORT_DIR = os.environ.get(
+    'WAYFINDING_REPORT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports'),
+)
+
+# Bump when the exported files change so existing exports are redone
+EXPORT_VERSION = 3
+
+# Zoom the maps open at; tracks are drawn at that level of detail
+EXPORT_ZOOM = 16
+
+FIGURE_COLUMNS = ['Route_length', 'Duration', 'Mean_speed', 'Tortuosity'] + SUMMARY_COLUMNS
+
+MANIFEST = 'manifest.json'
+
+
+def _fingerprint(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def _file_name(text):
+    # Names that had to be changed get a hash of the original, so 'a b' and 'a_b' stay apart
+    text = str(text)
+    name = re.sub(r'[^\w.-]+', '_', text) or '_'
+    if name != text:
+        name += '-' + hashlib.sha256(text.encode()).hexdigest()[:8]
+    return name
+
+
+def _write_text(path, text):
+    # Written next to the target and renamed, so readers never see half a file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.export-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def participant_sessions(store):
+    """participant -> sorted source hashes of the sessions holding their waypoints."""
+    participants = pd.Categorical(store.waypoint_frame(['participant'])['participant'])
+    sessions = len(store.sessions)
+    pairs = np.unique(participants.codes.astype(np.int64) * sessions + store.waypoint_session)
+    result = {}
+    for pair in pairs:
+        participant = participants.categories[pair // sessions]
+        result.setdefault(participant, set()).add(store.sessions[pair % sessions].source_hash)
+    return {participant: sorted(hashes) for participant, hashes in result.items()}
+
+
+def export_participant(participant, digests, out_dir=REPORT_DIR, cache_dir=CACHE_DIR, zoom=EXPORT_ZOOM,
+                       smoothed=True):
+    """Write the task maps and metrics of one participant; returns (participant, waypoints, files)."""
+    store = SessionStore(open_cached(digest, cache_dir) for digest in digests)
+    frame = store.waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+    frame = derive_columns(frame[frame['participant'] == participant].reset_index(drop=True))
+    tracks = TaskIndex(frame)
+    segments = detect_segments(tracks.frame)
+
+    directory = os.path.join(out_dir, 'maps', _file_name(participant))
+    files = []
+    sessions = Counter((category, number) for _, _, category, number in tracks.slices)
+    for key in tracks.slices:
+        _, session, category, number = key
+        track = tracks.track(key)
+        page = create_map(smoothed_view(track) if smoothed else track, zoom=zoom,
+                          segments=track_segments(segments, key))
+        # A task walked in several sessions gets one map per session
+        name = f'{_file_name(category)}-{number}'
+        if sessions[(category, number)] > 1:
+            name += f'-{session[:SESSION_LABEL]}'
+        files.append(os.path.join(directory, f'{name}.html'))
+        _write_text(files[-1], page)
+    files.append(os.path.join(directory, 'metrics.csv'))
+    _write_text(files[-1], metrics_table(track_metrics(tracks.frame), segments).to_csv(index=False))
+    return participant, len(frame), files
+
+
+def _figures(metrics, out_dir):
+    import plotly.express as px
+
+    # One bar per track: a participant with several sessions on a task gets one per session
+    metrics = label_tracks(metrics)
+    metrics = metrics.assign(task=metrics['taskCategory'].astype(str) + ' ' + metrics['taskNo'].astype(str))
+    paths = []
+    for column in FIGURE_COLUMNS:
+        figure = px.bar(metrics, x='label', y=column, color='track', barmode='group',
+                        facet_col='task', facet_col_wrap=4, title=column)
+        paths.append(os.path.join(out_dir, 'figures', f'{column}.html'))
+        _write_text(paths[-1], figure.to_html(include_plotlyjs='cdn'))
+    return paths
+
+
+def export_study(store, participants, out_dir=REPORT_DIR):
+    """Study-wide outputs: combined metrics, figures and the object localization map and scores."""
+    tables = [pd.read_csv(os.path.join(out_dir, 'maps', _file_name(participant), 'metrics.csv'),
+                          dtype={'participant': str, 'session_id': str})
+              for participant in participants]
+    # Sessions without an id are written as '' (see session_store.session_id)
+    metrics = pd.concat(tables, ignore_index=True).fillna({'session_id': ''})
+    files = [os.path.join(out_dir, 'metrics.csv')]
+    _write_text(files[-1], metrics.to_csv(index=False))
+    files += _figures(metrics, out_dir)
+
+    events = EventIndex(store)
+    scores = score_clicks(events)
+    files.append(os.path.join(out_dir, 'object_scores.csv'))
+    _write_text(files[-1], scores.to_csv(index=False))
+    files.append(os.path.join(out_dir, 'accuracy.csv'))
+    _write_text(files[-1], accuracy_table(scores).to_csv())
+    files.append(os.path.join(out_dir, 'object_localization.html'))
+    _write_text(files[-1], localization_map(events, scores).get_root().render())
+    return files
+
+
+def _index_page(out_dir, participants):
+    def links(paths):
+        return ' '.join(f'<a href="{html.escape(os.path.relpath(path, out_dir))}">'
+                        f'{html.escape(os.path.splitext(os.path.basename(path))[0])}</a>' for path in paths)
+
+    rows = []
+    for participant in participants:
+        directory = os.path.join(out_dir, 'maps', _file_name(participant))
+        maps = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.html'))
+        rows.append(f'<tr><td>{html.escape(participant)}</td><td>{links(maps)}</td>'
+                    f'<td>{links([os.path.join(directory, "metrics.csv")])}</td></tr>')
+    figures = [os.path.join(out_dir, 'figures', f'{column}.html') for column in FIGURE_COLUMNS]
+    return f'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Wayfinding report</title></head>
+<body>
+<h1>Wayfinding Performance among Different Users</h1>
+<p>{links([os.path.join(out_dir, name) for name in ['object_localization.html', 'metrics.csv', 'accuracy.csv',
+                                                     'object_scores.csv']])}</p>
+<h2>Figures</h2>
+<p>{links(figures)}</p>
+<h2>Participants</h2>
+<table>
+<tr><th>Participant</th><th>Task maps</th><th>Metrics</th></tr>
+{chr(10).join(rows)}
+</table>
+</body></html>
+'''
+
+
+def export_reports(source=DATA_SOURCE, out_dir=REPORT_DIR, workers=None, cache_dir=CACHE_DIR, zoom=EXPORT_ZOOM,
+                   smoothed=True, force=False):
+    """Export the whole study to `out_dir`, skipping outputs whose inputs are unchanged; returns a summary."""
+    start = time.perf_counter()
+    store = ingest(source, workers=workers, cache_dir=cache_dir)
+    units = participant_sessions(store)
+    params = (EXPORT_VERSION, METRICS_VERSION, SMOOTHING_VERSION, SEGMENTS_VERSION, zoom, smoothed)
+    manifest = {} if force else _read_manifest(out_dir)
+    fingerprints = {participant: _fingerprint(params, digests) for participant, digests in units.items()}
+    todo = [participant for participant, fingerprint in fingerprints.items()
+            if manifest.get(f'participant:{participant}') != fingerprint
+            or not os.path.exists(os.path.join(out_dir, 'maps', _file_name(participant), 'metrics.csv'))]
+
+    def finished(result):
+        # Recorded as each participant completes, so an interrupted export resumes
+        participant, waypoints, files = result
+        summary['waypoints'] += waypoints
+        summary['files'] += len(files)
+        summary['maps'] += len(files) - 1
+        manifest[f'participant:{participant}'] = fingerprints[participant]
+        _write_text(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True))
+
+    summary = {'participants': len(units), 'exported': len(todo), 'skipped': len(units) - len(todo),
+               'maps': 0, 'files': 0, 'waypoints': 0}
+    os.makedirs(out_dir, exist_ok=True)
+    render_start = time.perf_counter()
+    if len(todo) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(todo))) as pool:
+            futures = [pool.submit(export_participant, participant, units[participant], out_dir, cache_dir, zoom,
+                                   smoothed) for participant in todo]
+            for future in as_completed(futures):
+                finished(future.result())
+    else:
+        for participant in todo:
+            finished(export_participant(participant, units[participant], out_dir, cache_dir, zoom, smoothed))
+    summary['render_seconds'] = time.perf_counter() - render_start
+
+    # The study-wide files depend on every session
+    study = _fingerprint(params, sorted(fingerprints.items()))
+    summary['study'] = manifest.get('study') != study or not os.path.exists(os.path.join(out_dir, 'index.html'))
+    if summary['study']:
+        participants = sorted(units)
+        summary['files'] += len(export_study(store, participants, out_dir)) + 1
+        _write_text(os.path.join(out_dir, 'index.html'), _index_page(out_dir, participants))
+        manifest['study'] = study
+        _write_text(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True))
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def print_summary(summary, out_dir):
+    seconds, render = summary['seconds'], max(summary['render_seconds'], 1e-9)
+    print(f"{summary['exported']} of {summary['participants']} participants exported, "
+          f"{summary['skipped']} unchanged; study files {'rewritten' if summary['study'] else 'unchanged'}")
+    print(f"{summary['maps']} maps, {summary['files']} files in {seconds:.1f} s "
+          f"(maps: {summary['maps'] / render:.1f}/s, {summary['waypoints'] / render:,.0f} waypoints/s) -> {out_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export every participant map, the object localization map "
+                                                 "and the metrics tables and figures as static files")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    parser.add_argument('--out', default=REPORT_DIR, help="output directory")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--zoom', type=int, default=EXPORT_ZOOM, help="zoom (level of detail) of the maps")
+    parser.add_argument('--raw', action='store_true', help="draw the raw GPS fixes instead of the smoothed tracks")
+    parser.add_argument('--force', action='store_true', help="export everything, even unchanged outputs")
+    args = parser.parse_args()
+
+    summary = export_reports(args.source, args.out, args.workers, zoom=args.zoom, smoothed=not args.raw,
+                             force=args.force)
+    print_summary(summary, args.out)
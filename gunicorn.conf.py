@@ -0,0 +1,49 @@
+import gc
+import os
+import time
+
+from instrumentation import process_memory
+
+# gunicorn settings for `gunicorn wayfinding:server`, read automatically from
+# the working directory.
+#
+# By default every worker imports the app itself, binds at once and loads the
+# data in the background: /health answers right away and /ready reports the
+# loading progress. With WAYFINDING_PRELOAD=1 the app is preloaded instead:
+# the master imports wayfinding.py and loads the data once
+# (WAYFINDING_LOAD=eager) before binding, then forks the workers, which share
+# the loaded columns copy-on-write instead of each holding its own copy. That
+# saves memory with several workers, but nothing answers until loading is done.
+#
+# Each worker logs its boot time (fork to ready to serve) and its RSS, PSS
+# and shared memory; /ready and /metrics report the same per worker.
+
+preload_app = os.environ.get('WAYFINDING_PRELOAD', '0') == '1'
+if preload_app:
+    os.environ.setdefault('WAYFINDING_LOAD', 'eager')
+
+
+def _mb(value):
+    return value / 2 ** 20 if value is not None else float('nan')
+
+
+def when_ready(server):
+    memory = process_memory()
+    server.log.info("master ready: rss %.1f MB, pss %.1f MB", _mb(memory['rss']), _mb(memory['pss']))
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not write to (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    worker.wayfinding_forked = time.perf_counter()
+
+
+def post_worker_init(worker):
+    memory = process_memory()
+    worker.log.info("worker %s booted in %.1f ms: rss %.1f MB, pss %.1f MB, shared %.1f MB",
+                    worker.pid, (time.perf_counter() - worker.wayfinding_forked) * 1000,
+                    _mb(memory['rss']), _mb(memory['pss']), _mb(memory['shared']))
@@ -0,0 +1,91 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from instrumentation import count_lookup, timed
+from session_cache import CACHE_DIR, cached_digest, ensure_cached, open_cached, read_manifest, record_entries, report_load
+from session_store import SessionStore
+
+# Ingest every GeoGami session export found in a directory or matching a glob.
+#
+# Files whose extracted columns are already cached are matched by stat() in
+# the parent process. Only new or changed files are parsed, in a process pool;
+# the workers write their columns to the cache and return just the digest, so
+# nothing large is pickled back. The parent then memory-maps every session and
+# concatenates them into one SessionStore.
+
+# Directory or glob of session files; defaults to the group exports in the repo
+DATA_SOURCE = os.environ.get(
+    'WAYFINDING_DATA',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'group*.json'),
+)
+
+
+def discover(source):
+    if os.path.isdir(source):
+        source = os.path.join(source, '*.json')
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+
+
+def _extract(path, cache_dir):
+    return ensure_cached(path, cache_dir)
+
+
+def ingest(source=DATA_SOURCE, workers=None, cache_dir=CACHE_DIR):
+    start = time.perf_counter()
+    paths = source if isinstance(source, (list, tuple)) else discover(source)
+    if not paths:
+        raise FileNotFoundError(f"no session files found for {source!r}")
+
+    manifest = read_manifest(cache_dir)
+    digests = {}
+    entries = {}
+    missing = []
+    for path in paths:
+        digest = cached_digest(path, manifest, cache_dir)
+        if digest is None:
+            missing.append(path)
+        else:
+            digests[path] = digest
+
+    hits = len(digests)
+    with timed('extract') if missing else nullcontext():
+        if len(missing) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(missing))) as pool:
+                results = pool.map(_extract, missing, [cache_dir] * len(missing))
+                for path, (digest, hit, entry) in zip(missing, results):
+                    digests[path] = digest
+                    entries[os.path.abspath(path)] = entry
+                    hits += hit
+        else:
+            for path in missing:
+                digest, hit, entry = ensure_cached(path, cache_dir, manifest)
+                digests[path] = digest
+                entries[os.path.abspath(path)] = entry
+                hits += hit
+    record_entries(entries, cache_dir, manifest)
+
+    count_lookup('sessions', True, hits)
+    count_lookup('sessions', False, len(paths) - hits)
+
+    store = SessionStore(open_cached(digests[path], cache_dir) for path in paths)
+    report_load(len(paths), hits, time.perf_counter() - start)
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest GeoGami session exports into the column cache")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    parser.add_argument('--workers', type=int, default=None, help="size of the process pool (default: all cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = ingest(args.source, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print(store.session_table)
+    print(f"{len(store.sessions)} sessions, {len(store)} waypoints, "
+          f"{len(store.events['type'])} events in {elapsed:.2f} s "
+          f"({len(store) / max(elapsed, 1e-9):,.0f} waypoints/s)")
@@ -0,0 +1,284 @@
+import cProfile
+import io
+import os
+import pstats
+import resource
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Timing, payload and cache instrumentation, exposed in the Prometheus text
+# format on the Dash server.
+#
+# Pipeline stages are timed with `timed(stage)` (a context manager that also
+# works as a decorator); every Dash callback request is timed end to end and
+# its response size recorded by `instrument_server`. Caches report lookups
+# with `count_lookup` or through a stats() collector. Everything is kept in
+# process (no client library needed) and rendered on GET /metrics.
+#
+# With WAYFINDING_PROFILING=1 a single callback can be run under cProfile:
+# GET /debug/profile?arm=map.srcDoc profiles the next request for that
+# callback output (or any request sent with an X-Wayfinding-Profile header),
+# and GET /debug/profile returns the recent reports.
+
+PROFILING = os.environ.get('WAYFINDING_PROFILING', '') not in ('', '0')
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+CALLBACK_PATH = '/_dash-update-component'
+LAYOUT_PATH = '/_dash-layout'
+
+# Profile reports kept for /debug/profile
+PROFILE_REPORTS = 10
+PROFILE_LINES = 40
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Histogram:
+
+    def __init__(self, name, help, labelnames, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames + ["le"], labels + (bound,))} {bucket}')
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames + ["le"], labels + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+stage_seconds = Histogram('wayfinding_stage_seconds', 'Time spent in each pipeline stage.', ['stage'])
+callback_seconds = Histogram('wayfinding_callback_seconds', 'End-to-end latency of Dash callback requests.',
+                             ['callback'])
+payload_bytes = Histogram('wayfinding_payload_bytes', 'Size of generated payloads.', ['payload'], BYTES_BUCKETS)
+cache_lookups = Counter('wayfinding_cache_lookups_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+
+METRICS = [stage_seconds, callback_seconds, payload_bytes, cache_lookups]
+
+# name -> stats() callable of a cache with hits/misses/evictions/size counters
+_cache_collectors = {}
+
+# name -> (help, callable returning a number) rendered as gauges
+_gauges = {}
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage)
+
+
+def record_payload(payload, size):
+    payload_bytes.observe(size, payload)
+
+
+def count_lookup(cache, hit, amount=1):
+    cache_lookups.inc(cache, 'hit' if hit else 'miss', amount=amount)
+
+
+def register_cache(name, stats):
+    """Export a cache's stats() (hits, misses, evictions, size) on /metrics."""
+    _cache_collectors[name] = stats
+
+
+def register_gauge(name, help, collect):
+    _gauges[name] = (help, collect)
+
+
+def process_memory():
+    """Resident (rss), proportional (pss) and shared memory of this process in bytes.
+
+    PSS splits pages shared between forked workers (e.g. data loaded before
+    a gunicorn --preload fork, or the memory-mapped column cache) between the
+    processes sharing them; it is only available on Linux."""
+    memory = {'rss': None, 'pss': None, 'shared': None,
+              'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f if line.rstrip().endswith('kB')}
+        memory['rss'] = fields.get('Rss')
+        memory['pss'] = fields.get('Pss')
+        memory['shared'] = fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    except OSError:
+        pass
+    return memory
+
+
+for _key in ('rss', 'pss', 'shared'):
+    register_gauge(f'wayfinding_process_{_key}_bytes', f'Process memory ({_key}).',
+                   lambda key=_key: process_memory()[key])
+
+
+def _render_gauges():
+    lines = []
+    for name, (help, collect) in sorted(_gauges.items()):
+        value = collect()
+        if value is None:
+            continue
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {float(value)}']
+    return lines
+
+
+def _render_caches():
+    if not _cache_collectors:
+        return []
+    stats = {name: collect() for name, collect in sorted(_cache_collectors.items())}
+    lines = []
+    for key, kind in [('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                      ('size', 'gauge'), ('hit_rate', 'gauge')]:
+        name = f'wayfinding_cache_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} Cache {key.replace("_", " ")}.', f'# TYPE {name} {kind}']
+        lines += [f'{name}{_labels(["cache"], (cache,))} {values[key]}' for cache, values in stats.items()
+                  if key in values]
+    return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _render_caches()
+    lines += _render_gauges()
+    return '\n'.join(lines) + '\n'
+
+
+class _Profiler:
+    # Runs armed requests under cProfile, one at a time
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.armed = {}
+        self.active = False
+        self.reports = deque(maxlen=PROFILE_REPORTS)
+
+    def arm(self, callback, count=1):
+        with self._lock:
+            self.armed[callback] = self.armed.get(callback, 0) + count
+
+    def start(self, callback, wanted=False):
+        with self._lock:
+            if self.active:
+                return None
+            for key in (callback, '*'):
+                if self.armed.get(key):
+                    self.armed[key] -= 1
+                    wanted = True
+            if not wanted:
+                return None
+            self.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, callback, seconds):
+        profile.disable()
+        with self._lock:
+            self.active = False
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        self.reports.appendleft(f'=== {callback} {seconds * 1000:.1f} ms at {time.strftime("%H:%M:%S")}\n'
+                                + out.getvalue())
+
+
+profiler = _Profiler()
+
+
+def instrument_server(server):
+    """Time Dash callbacks, record response sizes and add /metrics (and /debug/profile) routes."""
+    from flask import g, request
+
+    @server.before_request
+    def _start_timer():
+        if request.path != CALLBACK_PATH:
+            return
+        body = request.get_json(silent=True) or {}
+        g.wayfinding_callback = body.get('output', 'unknown')
+        g.wayfinding_profile = (profiler.start(g.wayfinding_callback, 'X-Wayfinding-Profile' in request.headers)
+                                if PROFILING else None)
+        g.wayfinding_start = time.perf_counter()
+
+    @server.after_request
+    def _stop_timer(response):
+        start = g.pop('wayfinding_start', None)
+        if start is None:
+            # The layout carries the metrics store sent to the browser
+            if request.path == LAYOUT_PATH and not response.direct_passthrough:
+                record_payload('layout', len(response.get_data()))
+            return response
+        seconds = time.perf_counter() - start
+        callback = g.pop('wayfinding_callback')
+        profile = g.pop('wayfinding_profile', None)
+        if profile is not None:
+            profiler.finish(profile, callback, seconds)
+        callback_seconds.observe(seconds, callback)
+        if not response.direct_passthrough:
+            record_payload(callback, len(response.get_data()))
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return server.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    if PROFILING:
+        @server.route('/debug/profile')
+        def debug_profile():
+            callback = request.args.get('arm')
+            if callback:
+                profiler.arm(callback, int(request.args.get('count', 1)))
+                return server.response_class(f'armed {callback}\n', mimetype='text/plain')
+            return server.response_class('\n'.join(profiler.reports) or 'no profiles yet\n', mimetype='text/plain')
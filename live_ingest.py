@@ -0,0 +1,116 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from ingest import discover
+
+# New sessions while the dashboard is running.
+#
+# Session files can be copied into the drop directory or POSTed to /sessions,
+# which writes them there. Every server process polls the data source and the
+# drop directory and adds files it has not seen to its loaded data (see
+# DashboardData.add_files in wayfinding.py), so an upload handled by one
+# gunicorn worker reaches the others on their next poll; they find the file
+# already extracted in the column cache. Files stay in the drop directory, so
+# a restart ingests them with the rest. Files that do not parse as a session
+# (see session_loader.check_session) are not added, and uploads of them are
+# deleted again.
+
+DROP_DIR = os.environ.get(
+    'WAYFINDING_DROP_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'incoming'),
+)
+
+# Seconds between polls; 0 turns the watcher off (uploads are still added)
+WATCH_INTERVAL = float(os.environ.get('WAYFINDING_WATCH_INTERVAL', 5))
+
+# Files modified more recently than this (seconds) may still be being copied
+SETTLE_SECONDS = 1.0
+
+# Largest request /sessions accepts (bytes)
+MAX_UPLOAD_BYTES = int(float(os.environ.get('WAYFINDING_MAX_UPLOAD_MB', 64)) * 2 ** 20)
+
+
+def session_paths(source, drop_dir=DROP_DIR):
+    """Absolute paths of the session files of the data source and the drop directory."""
+    paths = discover(source) if not isinstance(source, (list, tuple)) else list(source)
+    if drop_dir and os.path.isdir(drop_dir):
+        paths += discover(drop_dir)
+    return sorted({os.path.abspath(path) for path in paths})
+
+
+def save_upload(content, drop_dir=DROP_DIR):
+    """Write an uploaded session file into the drop directory and return its path.
+
+    The name is taken from the content digest, so uploading a file twice adds it once."""
+    path = os.path.join(drop_dir, f'upload-{hashlib.sha256(content).hexdigest()[:16]}.json')
+    if not os.path.exists(path):
+        os.makedirs(drop_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=drop_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    return os.path.abspath(path)
+
+
+class SessionWatcher:
+    # Polls for session files not loaded yet (`list_paths`) in a daemon thread
+    # and passes them to `add`.
+    # Threads do not survive fork, so `ensure_running` is called per request
+    # and starts the thread once in every process.
+
+    def __init__(self, list_paths, add, interval=WATCH_INTERVAL):
+        self.list_paths = list_paths
+        self.add = add
+        self.interval = interval
+        self.failed = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='wayfinding-watch', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+    def poll(self):
+        """Add the new files that are complete, in one batch. If that fails they are added one at
+        a time, and a file that fails on its own is retried only once it changes."""
+        now = time.time()
+        paths = []
+        for path in self.list_paths():
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if now - mtime >= SETTLE_SECONDS and self.failed.get(path) != mtime:
+                paths.append((path, mtime))
+        if not paths:
+            return
+        try:
+            self.add([path for path, _ in paths])
+            return
+        except Exception as error:
+            if len(paths) == 1:
+                self._failed(*paths[0], error)
+                return
+        for path, mtime in paths:
+            try:
+                self.add([path])
+            except Exception as error:
+                self._failed(path, mtime, error)
+
+    def _failed(self, path, mtime, error):
+        self.failed[path] = mtime
+        message = (str(error).splitlines() or [''])[0]
+        print(f"session watcher: could not add {path}: {type(error).__name__}: {message}")
@@ -0,0 +1,408 @@
+import threading
+from collections import OrderedDict
+
+import folium
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+
+from density_grid import ALL_TASKS, CELL_SIZES
+from instrumentation import record_payload, timed
+from segmentation import track_segments
+from simplify import simplify_for_zoom
+from smoothing import smoothed_view
+
+# Map rendering for the dashboards.
+#
+# Maps are rendered straight to an HTML string for the iframe `srcDoc`
+# (nothing is written to the working directory, so concurrent requests and
+# workers cannot overwrite each other's map). Rendered documents are kept in
+# a bounded LRU cache keyed by everything that affects the output. Tracks are
+# drawn at the level of detail matching the map's zoom (see simplify.py),
+# from either the raw or the smoothed positions (see smoothing.py). Group
+# density maps draw the cells of a DensityGrid instead of one track. Playback
+# maps carry a layer the dashboard feeds with postMessage (see playback.py).
+
+MAP_CACHE_SIZE = 64
+
+# Heading bins (degrees) and their colors, shared by the legend
+HEADING_BINS = np.array([90, 180, 270])
+HEADING_COLORS = np.array(['red', 'orange', 'yellow', 'blue'])
+# Color of fixes without a heading, so they cannot pass for one of the bins
+NO_HEADING_COLOR = 'silver'
+
+# Decimal places kept for GeoJSON coordinates (~0.1 m)
+COORDINATE_PRECISION = 6
+
+# Overlay colors of detected segments (see segmentation.py), shared by the legend
+SEGMENT_COLORS = {
+    'stop': 'purple',
+    'turn': 'black',
+    'u_turn': 'magenta',
+    'look_around': 'cyan',
+    'backtrack': 'magenta',
+}
+
+
+class LRUCache:
+    # Thread-safe bounded LRU with hit/miss counters. Values are computed
+    # outside the lock, so a slow render does not block cache hits.
+
+    def __init__(self, maxsize=MAP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, predicate=None):
+        # Drop every entry whose key matches `predicate` (all entries when None)
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+map_cache = LRUCache()
+
+
+SEGMENT_LEGEND = '''<br>
+    <b>Segments</b><br>
+    <i style="border:3px solid purple;border-radius:50%;width:20px;height:20px;float:left;margin-right:8px"></i> Stop<br>
+    <i style="border:3px solid black;border-radius:50%;width:20px;height:20px;float:left;margin-right:8px"></i> Turn<br>
+    <i style="border:3px solid magenta;border-radius:50%;width:20px;height:20px;float:left;margin-right:8px"></i> U-turn<br>
+    <i style="border:3px solid cyan;border-radius:50%;width:20px;height:20px;float:left;margin-right:8px"></i> Looking around<br>
+    <i style="border-top:3px dashed magenta;width:20px;height:20px;float:left;margin-right:8px;margin-top:9px"></i> Backtracking
+'''
+
+
+# Density cells are colored by the share of the scope's participants passing through them
+DENSITY_BINS = np.array([0.1, 0.25, 0.5, 0.75])
+DENSITY_COLORS = np.array(['#ffffb2', '#fecc5c', '#fd8d3c', '#f03b20', '#bd0026'])
+
+
+class PlaybackLayer(MacroElement):
+    # Draws the time window the dashboard posts (see playback.playback_update):
+    # points it was sent are kept per track row, markers are only added or
+    # removed where the window moved, and the route line is the window's slice
+    _template = Template('''
+    {% macro script(this, kwargs) %}
+    (function() {
+        var map = {{ this._parent.get_name() }};
+        var renderer = L.canvas();
+        var line = L.polyline([], {color: 'grey', weight: 3, opacity: 0.8}).addTo(map);
+        var dots = L.layerGroup().addTo(map);
+        var position = L.circleMarker([0, 0], {radius: 8, color: 'black', weight: 2, fillColor: 'white',
+                                               fillOpacity: 1}).bindTooltip('', {permanent: true});
+        var ready = false, start = 0, coords = [], colors = [], seconds = [], markers = [], shown = [0, 0];
+
+        function marker(row) {
+            var i = row - start;
+            if (!markers[i] && coords[i]) {
+                markers[i] = L.circleMarker(coords[i], {renderer: renderer, radius: 4, weight: 1,
+                                                        color: colors[i], fillOpacity: 0.6});
+            }
+            return markers[i];
+        }
+
+        window.addEventListener('message', function(event) {
+            var update = event.data;
+            if (!update || update.type !== 'wayfinding-playback' || !(ready || update.reset)) {
+                return;
+            }
+            if (update.reset) {
+                dots.clearLayers();
+                ready = true;
+                start = update.window[0];
+                coords = [], colors = [], seconds = [], markers = [];
+                shown = [start, start];
+            }
+            update.chunks.forEach(function(chunk) {
+                if (chunk.offset < start) {
+                    coords = chunk.coords.concat(coords);
+                    colors = chunk.colors.concat(colors);
+                    seconds = chunk.seconds.concat(seconds);
+                    markers = new Array(chunk.coords.length).concat(markers);
+                    start = chunk.offset;
+                } else {
+                    coords = coords.concat(chunk.coords);
+                    colors = colors.concat(chunk.colors);
+                    seconds = seconds.concat(chunk.seconds);
+                }
+            });
+            var first = update.window[0], last = update.window[1], row, dot;
+            for (row = shown[0]; row < shown[1]; row++) {
+                if ((row < first || row >= last) && (dot = marker(row))) dots.removeLayer(dot);
+            }
+            for (row = first; row < last; row++) {
+                if ((row < shown[0] || row >= shown[1]) && (dot = marker(row))) dots.addLayer(dot);
+            }
+            shown = [first, last];
+            var visible = coords.slice(first - start, last - start).filter(function(point) { return point; });
+            line.setLatLngs(visible);
+            if (visible.length) {
+                position.setLatLng(visible[visible.length - 1]).addTo(map)
+                    .setTooltipContent(seconds[last - 1 - start].toFixed(0) + ' s');
+            } else {
+                position.remove();
+            }
+        });
+        window.wayfindingPlayback = true;
+    })();
+    {% endmacro %}
+    ''')
+
+
+def heading_colors(heading):
+    """Vectorized heading -> color; matches the legend (NaN headings get NO_HEADING_COLOR)."""
+    heading = np.asarray(heading, dtype=np.float64)
+    colors = HEADING_COLORS[np.searchsorted(HEADING_BINS, heading, side='right')]
+    return np.where(np.isnan(heading), NO_HEADING_COLOR, colors)
+
+
+def track_geojson(nav_tasks):
+    """One FeatureCollection per track: the route line plus one MultiPoint per heading bin."""
+    order = np.argsort(nav_tasks['timestamp'].to_numpy(), kind='stable')
+    lon = nav_tasks['longitude'].to_numpy(dtype=np.float64)[order]
+    lat = nav_tasks['latitude'].to_numpy(dtype=np.float64)[order]
+    valid = ~(np.isnan(lon) | np.isnan(lat))
+    coords = np.round(np.column_stack([lon, lat])[valid], COORDINATE_PRECISION)
+    colors = heading_colors(nav_tasks['heading'].to_numpy(dtype=np.float64)[order])[valid]
+
+    features = [{
+        'type': 'Feature',
+        'properties': {'color': 'grey'},
+        'geometry': {'type': 'LineString', 'coordinates': coords.tolist()},
+    }]
+    for color in list(HEADING_COLORS) + [NO_HEADING_COLOR]:
+        points = coords[colors == color]
+        if len(points):
+            features.append({
+                'type': 'Feature',
+                'properties': {'color': str(color)},
+                'geometry': {'type': 'MultiPoint', 'coordinates': points.tolist()},
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _add_track_layer(m, nav_tasks, opacity, show=True):
+    # Styling comes from feature properties, so folium emits one style switch
+    # and the document grows with the number of layers, not of points
+    def style(feature):
+        color = feature['properties']['color']
+        if color == 'grey':
+            return {'color': color, 'weight': 2, 'opacity': 0.6}
+        return {'color': color, 'fillColor': color, 'fillOpacity': opacity}
+
+    folium.GeoJson(
+        track_geojson(nav_tasks),
+        name='Track',
+        marker=folium.CircleMarker(radius=5, fill=True),
+        style_function=style,
+        show=show,
+    ).add_to(m)
+
+
+def _add_segment_layer(m, nav_tasks, segments, show=True):
+    # Stops as circles of their spread, turns and look-arounds as points,
+    # backtracking as a dashed line over the track; toggled as one layer
+    layer = folium.FeatureGroup(name='Stops and turns', show=show)
+    timestamps = nav_tasks['timestamp'].to_numpy()
+    for segment in segments.itertuples(index=False):
+        color = SEGMENT_COLORS[segment.kind]
+        location = (segment.latitude, segment.longitude)
+        if segment.kind == 'stop':
+            folium.Circle(location=location, radius=max(segment.value, 3), color=color, fill=True,
+                          fill_opacity=0.4, popup=f"Stop: {segment.duration_s:.0f} s").add_to(layer)
+        elif segment.kind == 'backtrack':
+            rows = nav_tasks[(timestamps >= np.datetime64(segment.start)) & (timestamps <= np.datetime64(segment.end))]
+            rows = rows.sort_values('timestamp')
+            folium.PolyLine(list(zip(rows['latitude'], rows['longitude'])), color=color, weight=4, dash_array='6 6',
+                            popup=f"Backtracking: {segment.value:.0f} m").add_to(layer)
+        else:
+            label = (f"Looking around: {segment.value:.0f}° in {segment.duration_s:.0f} s"
+                     if segment.kind == 'look_around' else
+                     f"{'U-turn' if segment.kind == 'u_turn' else 'Turn'}: {segment.value:+.0f}°")
+            folium.CircleMarker(location=location, radius=7, color=color, fill=False, weight=3,
+                                popup=label).add_to(layer)
+    layer.add_to(m)
+
+
+def _add_point_markers(m, nav_tasks, opacity):
+    # Legacy rendering: one CircleMarker per waypoint
+    colors = heading_colors(nav_tasks['heading'].to_numpy(dtype=np.float64))
+    for lat, lon, color in zip(nav_tasks['latitude'], nav_tasks['longitude'], colors):
+        folium.CircleMarker(
+            location=(lat, lon),
+            radius=5,
+            color=color,
+            fill=True,
+            fill_color=color,
+            fill_opacity=opacity
+        ).add_to(m)
+
+
+def density_geojson(grid, cells, level, participants):
+    """One MultiPolygon per color bin over the cells of one DensityGrid layer; `participants` is the
+    scope's participant count the shares are taken of."""
+    share = cells['participants'].to_numpy() / max(participants, 1)
+    colors = DENSITY_COLORS[np.searchsorted(DENSITY_BINS, share, side='right')]
+    polygons = np.round(grid.polygons(cells, level), COORDINATE_PRECISION)
+    features = []
+    for color in DENSITY_COLORS:
+        rings = polygons[colors == color]
+        if len(rings):
+            features.append({
+                'type': 'Feature',
+                'properties': {'color': str(color)},
+                'geometry': {'type': 'MultiPolygon', 'coordinates': rings[:, np.newaxis].tolist()},
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _map_view(lat, lon, zoom):
+    # folium.Map arguments centred on the positions; without any, folium's default of the
+    # whole world zoomed out
+    lat, lon = np.asarray(lat, dtype=np.float64).ravel(), np.asarray(lon, dtype=np.float64).ravel()
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    if not valid.any():
+        return {}
+    return {'location': [lat[valid].mean(), lon[valid].mean()], 'zoom_start': zoom}
+
+
+@timed('map_render')
+def create_density_map(grid, scope=ALL_TASKS, basemap="OpenStreetMap", zoom=14):
+    level = grid.level_for_zoom(zoom, scope)
+    cells = grid.layer(scope, level)
+    corners = grid.polygons(cells, level) if len(cells) else np.zeros((0, 0, 2))
+    m = folium.Map(tiles=basemap, **_map_view(corners[:, :, 1], corners[:, :, 0], zoom))
+    folium.TileLayer('CartoDB positron').add_to(m)
+    folium.TileLayer('CartoDB dark_matter').add_to(m)
+
+    def style(feature):
+        color = feature['properties']['color']
+        return {'color': color, 'weight': 0, 'fillColor': color, 'fillOpacity': 0.6}
+
+    folium.GeoJson(density_geojson(grid, cells, level, grid.participants(scope)), name='Group density', style_function=style).add_to(m)
+    folium.LayerControl().add_to(m)
+
+    bounds = np.concatenate([[0], DENSITY_BINS * 100, [100]])
+    rows = ''.join(f'<i style="background:{color};width:20px;height:20px;float:left;margin-right:8px"></i> '
+                   f'{low:.0f}-{high:.0f}%<br>' for color, low, high in zip(DENSITY_COLORS, bounds[:-1], bounds[1:]))
+    legend_html = f'''
+    <div style="position: fixed;
+                bottom: 50px; left: 50px; width: 190px;
+                background-color: white; z-index:9999; font-size:14px;
+                border:2px solid grey; padding: 10px;">
+    <b>Participants passing</b><br>
+    of {grid.participants(scope)}, {CELL_SIZES[level]} m cells<br>
+    {rows}
+    </div>
+    '''
+    m.get_root().html.add_child(folium.Element(legend_html))
+
+    html = m.get_root().render()
+    record_payload('map_html', len(html))
+    return html
+
+
+@timed('map_render')
+def create_map(nav_tasks, opacity=0.5, basemap="OpenStreetMap", mode="geojson", zoom=14, segments=None,
+               playback=False):
+    m = folium.Map(tiles=basemap, **_map_view(nav_tasks['latitude'], nav_tasks['longitude'], zoom))
+    full_track = nav_tasks
+    nav_tasks = simplify_for_zoom(nav_tasks, zoom)
+
+    # Add tile layers for switching basemaps
+    folium.TileLayer('OpenStreetMap').add_to(m)
+    folium.TileLayer('CartoDB positron').add_to(m)
+    folium.TileLayer('CartoDB dark_matter').add_to(m)
+    folium.TileLayer(
+        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        attr="Tiles © Esri — Source: Esri, DeLorme, NAVTEQ",
+        name='Imagery'
+    ).add_to(m)
+
+    # Track colored by heading, either as one GeoJSON layer or one marker per row.
+    # Playback maps start with only the played window; the whole track can be toggled on
+    if mode == "markers":
+        _add_point_markers(m, nav_tasks, opacity)
+    else:
+        _add_track_layer(m, nav_tasks, opacity, show=not playback)
+    # Stops, turns, looking around and backtracking detected on the full track
+    overlay = segments is not None and len(segments) > 0
+    if overlay:
+        _add_segment_layer(m, full_track, segments, show=not playback)
+    if playback:
+        PlaybackLayer().add_to(m)
+    folium.LayerControl().add_to(m)  # Enable layer control
+
+    # Add legend for heading colors
+    legend_html = '''
+    <div style="position: fixed;
+                bottom: 50px; left: 50px; width: 150px;
+                background-color: white; z-index:9999; font-size:14px;
+                border:2px solid grey; padding: 10px;">
+    <b>Heading Legend</b><br>
+    <i style="background:red;width:20px;height:20px;float:left;margin-right:8px"></i> 0-90°<br>
+    <i style="background:orange;width:20px;height:20px;float:left;margin-right:8px"></i> 90-180°<br>
+    <i style="background:yellow;width:20px;height:20px;float:left;margin-right:8px"></i> 180-270°<br>
+    <i style="background:blue;width:20px;height:20px;float:left;margin-right:8px"></i> 270-360°<br>
+    <i style="background:''' + NO_HEADING_COLOR + ''';width:20px;height:20px;float:left;margin-right:8px"></i> no heading
+    ''' + (SEGMENT_LEGEND if overlay else '') + '''
+    </div>
+    '''
+    m.get_root().html.add_child(folium.Element(legend_html))
+
+    html = m.get_root().render()
+    record_payload('map_html', len(html))
+    return html
+
+
+def cached_map(tracks, key, opacity=0.5, basemap="OpenStreetMap", data_version=None,
+               mode="geojson", zoom=14, segments=None, smoothed=False, playback=False):
+    """Map HTML of one (participant, session_id, taskCategory, taskNo) track from a TaskIndex, rendered once per
+    (track, style, zoom, data version). `segments` is a detect_segments table to overlay;
+    `smoothed` draws the smoothed positions instead of the raw fixes; `playback` adds the
+    playback layer."""
+    cache_key = (key, opacity, basemap, data_version, mode, zoom, segments is not None, smoothed, playback)
+    return map_cache.get(cache_key, lambda: create_map(
+        smoothed_view(tracks.track(key)) if smoothed else tracks.track(key), opacity, basemap, mode, zoom,
+        track_segments(segments, key) if segments is not None else None, playback))
+
+
+def cached_density_map(grid, scope=ALL_TASKS, basemap="OpenStreetMap", data_version=None, zoom=14):
+    """Group density map of one scope (a task_scope or ALL_TASKS), rendered once per (scope, zoom,
+    data version). Cache keys start with ('density', scope)."""
+    return map_cache.get((('density', scope), basemap, data_version, zoom),
+                         lambda: create_density_map(grid, scope, basemap, zoom))
@@ -1,8 +1,4 @@
-import json
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
-from shapely.geometry import LineString
 import folium
 from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output
@@ -10,98 +6,69 @@ import dash_bootstrap_components as dbc
 import dash
 from datetime import timedelta
 import plotly.express as px
+from event_index import EventIndex
+from ingest import DATA_SOURCE, ingest
+from object_scoring import accuracy_table, score_clicks
 # import matplotlib.pyplot as plt
 
-# Step 1: Load the JSON files and extract geospatial data for both groups
-file_path = r"D:\Munster\ThirdSemester\Theses\data\datan\group1.json"
-with open(file_path, 'r') as file:
-    data = json.load(file)
 
-participants = data['players']
-p = participants[0]
-waypoints = data['waypoints']
+def localization_map(events, scores):
+    """Map of the theme-object target polygons and of every scored click (see score_clicks)."""
+    # One target geometry per theme-object task (not per event)
+    theme_object = events.select(task_type='theme-object')
+    targets = {}
+    for task_id, geometry in zip(theme_object['task_id'], events.task_geometry(theme_object)):
+        if task_id not in targets and geometry:
+            targets[task_id] = geometry.get('features', [])
 
-file_path1 = r"D:\Munster\ThirdSemester\Theses\data\datan\group2.json"
-with open(file_path1, 'r') as file:
-    data1 = json.load(file)
-# Participants
-participants1 = data1['players']
-p1 = participants1[0]
-
-waypoints1 = data1['events']
-waypoints1 = pd.DataFrame(waypoints1)
-filtered_df = waypoints1[waypoints1['task'].apply(lambda x: isinstance(x, dict) and x.get('type') == 'theme-object')]
-print(filtered_df)
-
-filtered_df.columns = filtered_df.columns.str.strip()
-
-# Step 1: Extract relevant information
-extracted_events = []
-for idx, ev in filtered_df.iterrows():
-    task = ev.get('task', {})
-    interaction = ev.get('interaction', {})
-    
-    # Ensure that answer is a dictionary before accessing 'clickPosition'
-    answer = ev.get('answer', {})
-    if isinstance(answer, dict):
-        clickPosition = answer.get('clickPosition', None)
+    # Step 2: Find the center for initializing the map (using the first polygon's first coordinate)
+    first_polygon = next((feature['geometry']['coordinates'] for features in targets.values() for feature in features
+                          if feature.get('geometry', {}).get('type') == 'Polygon'), None)
+    if first_polygon is not None:
+        center_lat = first_polygon[0][0][1]
+        center_long = first_polygon[0][0][0]
     else:
-        clickPosition = None
+        center_lat, center_long = scores['click_latitude'].mean(), scores['click_longitude'].mean()
 
-    geometry_data = task.get('question', {}).get('geometry', {})
-    features = geometry_data.get('features', [])
-    
-    for feature in features:
-        geometry = feature.get('geometry', {})
-        data_event = {
-            'timestamp': ev.get('timestamp'),
-            'panCount': interaction.get('panCount', None),
-            'zoomCount': interaction.get('zoomCount', None),
-            'rotation': interaction.get('rotationCount', None),
-            'type': geometry.get('type', None),
-            'click_latitude': clickPosition[1] if clickPosition else None,
-            'click_longitude': clickPosition[0] if clickPosition else None,
-            'participant': ev.get('participant', p1),
-            'geometry': geometry.get('coordinates', None)
-        }
-        extracted_events.append(data_event)
+    # Initialize the map
+    m = folium.Map(location=[center_lat, center_long], zoom_start=15)
 
-# Convert the extracted events to a DataFrame
-extracted = pd.DataFrame(extracted_events)
+    # Step 3: Add the target polygons to the map
+    for features in targets.values():
+        for feature in features:
+            geometry = feature.get('geometry', {})
+            if geometry.get('type') == 'Polygon':
+                folium.Polygon(
+                    locations=[(lat, lon) for lon, lat in geometry['coordinates'][0]],  # Reversing lon, lat to lat, lon for Folium
+                    color='green',  # Green color for the correct location
+                    fill=True,
+                    fill_opacity=0.4
+                ).add_to(m)
 
-print(extracted)
+    # Step 4: Add the click positions, green for hits and red for misses
+    for row in scores.itertuples(index=False):
+        folium.Marker(
+            location=[row.click_latitude, row.click_longitude],
+            icon=folium.Icon(color='green' if row.hit else 'red'),
+            popup=f"{row.participant} {row.type} at {row.timestamp}: {row.distance_m:.1f} m from target"
+        ).add_to(m)
+    return m
 
-# Step 2: Find the center for initializing the map (using the first polygon's first coordinate)
-center_lat = extracted['geometry'][0][0][0][1]
-center_long = extracted['geometry'][0][0][0][0]
 
-# Initialize the map
-m = folium.Map(location=[center_lat, center_long], zoom_start=15)
+if __name__ == "__main__":
+    # Step 1: Ingest the session exports and score every object localization click
+    # (hit/miss against the target polygon and distance to it, in one batch)
+    store = ingest(DATA_SOURCE)
+    events = EventIndex(store)
 
-# Step 3: Add polygons to the map
-for index, row in extracted.iterrows():
-    if row['type'] == 'Polygon':
-        # Extract the polygon coordinates
-        polygon_coords = row['geometry'][0]  # Assuming it's a simple polygon
-        
-        # Create a Folium polygon
-        folium.Polygon(
-            locations=[(lat, lon) for lon, lat in polygon_coords],  # Reversing lon, lat to lat, lon for Folium
-            color='green',  # Green color for the correct location
-            fill=True,
-            fill_opacity=0.4
-        ).add_to(m)
+    scores = score_clicks(events)
+    print(scores)
+    print(accuracy_table(scores))
 
-    # Step 4: Add the click position as a blue marker if it exists
-    if pd.notnull(row['click_latitude']) and pd.notnull(row['click_longitude']):
-        folium.Marker(
-            location=[row['click_latitude'], row['click_longitude']],
-            icon=folium.Icon(color='blue'),
-            popup=f"Click Position at {row['timestamp']}"
-        ).add_to(m)
+    m = localization_map(events, scores)
 
-# Step 5: Save the map to an HTML file and display it
-m.save('Object_Localization.html')
+    # Step 5: Save the map to an HTML file and display it
+    m.save('Object_Localization.html')
 
-# Display the map in a Jupyter notebook (if applicable)
-m
\ No newline at end of file
+    # Display the map in a Jupyter notebook (if applicable)
+    m
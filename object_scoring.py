@@ -0,0 +1,115 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+from metrics import GEOD, local_lonlat, local_xy
+
+# Batch scoring of theme-object (object localization) answers.
+#
+# Every click on a theme-object task is scored against the task's target
+# polygon(s): hit/miss (point-in-polygon) and the geodesic distance from the
+# click to the nearest point of the target (0 for hits). Target geometries are
+# built once per task, not once per event. Clicks and targets are held as
+# shapely geometry arrays in a local metric projection; an STRtree over the
+# targets answers the point-in-polygon test for all clicks in one query and
+# shapely.shortest_line finds every nearest point in one call. Only the final
+# distance is measured on the WGS84 ellipsoid.
+
+OBJECT_TASK = 'theme-object'
+CLICK_EVENTS = ['ON_MAP_CLICKED', 'ON_OK_CLICKED']
+
+SCORE_COLUMNS = ['participant', 'session_id', 'task_id', 'type', 'timestamp',
+                 'click_longitude', 'click_latitude', 'correct', 'hit', 'distance_m']
+
+
+def _target_geometries(task_ids, task_geometry):
+    # task_id -> one (multi)polygon built from the task's question geometry
+    targets = {}
+    for task_id, geometry in zip(task_ids, task_geometry):
+        if task_id in targets or not geometry:
+            continue
+        parts = [shape(feature['geometry']) for feature in geometry.get('features', [])
+                 if feature.get('geometry')]
+        if parts:
+            targets[task_id] = shapely.union_all(parts)
+    return targets
+
+
+def score_clicks(events):
+    """One row per theme-object click of an EventIndex, with hit/miss and distance (metres) to the target."""
+    tasks = events.select(task_type=OBJECT_TASK)
+    targets = _target_geometries(tasks['task_id'].to_numpy(), events.task_geometry(tasks))
+
+    scores = pd.concat([events.select(type=event_type, task_type=OBJECT_TASK) for event_type in CLICK_EVENTS])
+    scores = scores[scores['click_longitude'].notna() & scores['task_id'].isin(list(targets))]
+    scores = scores.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    if scores.empty or not targets:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+
+    task_order = list(targets)
+    target_index = pd.Index(task_order).get_indexer(scores['task_id'])
+    origin_lat = float(scores['click_latitude'].mean())
+
+    # Bulk geometry arrays in local metres
+    target_array = shapely.transform(
+        np.array([targets[task_id] for task_id in task_order], dtype=object),
+        lambda coords: np.column_stack(local_xy(coords[:, 0], coords[:, 1], origin_lat)),
+    )
+    x, y = local_xy(scores['click_longitude'].to_numpy(), scores['click_latitude'].to_numpy(), origin_lat)
+    clicks = shapely.points(x, y)
+
+    # Point-in-polygon for all clicks through the spatial index
+    tree = shapely.STRtree(target_array)
+    click_idx, tree_idx = tree.query(clicks, predicate='within')
+    hit = np.zeros(len(scores), dtype=bool)
+    hit[click_idx[tree_idx == target_index[click_idx]]] = True
+
+    # Nearest point of each click's own target, measured geodesically
+    nearest = shapely.get_point(shapely.shortest_line(clicks, target_array[target_index]), 1)
+    near_lon, near_lat = local_lonlat(shapely.get_x(nearest), shapely.get_y(nearest), origin_lat)
+    distance = GEOD.inv(scores['click_longitude'].to_numpy(), scores['click_latitude'].to_numpy(),
+                        near_lon, near_lat)[2]
+
+    scores['hit'] = hit
+    scores['distance_m'] = np.where(hit, 0.0, distance)
+    return scores[SCORE_COLUMNS]
+
+
+def accuracy_table(scores):
+    """Per-participant accuracy of object localization answers."""
+    clicks = scores.assign(is_answer=scores['type'] == 'ON_OK_CLICKED',
+                           answer_hit=(scores['type'] == 'ON_OK_CLICKED') & scores['hit'])
+    table = clicks.groupby('participant', observed=True).agg(
+        clicks=('type', 'size'),
+        click_hits=('hit', 'sum'),
+        answers=('is_answer', 'sum'),
+        answer_hits=('answer_hit', 'sum'),
+        mean_distance_m=('distance_m', 'mean'),
+        median_distance_m=('distance_m', 'median'),
+        max_distance_m=('distance_m', 'max'),
+    ).reset_index()
+    table['click_accuracy'] = table['click_hits'] / table['clicks']
+    table['answer_accuracy'] = table['answer_hits'] / table['answers'].where(table['answers'] > 0)
+    return table
+
+
+if __name__ == "__main__":
+    from event_index import EventIndex
+    from ingest import DATA_SOURCE, ingest
+
+    parser = argparse.ArgumentParser(description="Score theme-object clicks for every ingested session")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    args = parser.parse_args()
+
+    store = ingest(args.source)
+    start = time.perf_counter()
+    scores = score_clicks(EventIndex(store))
+    table = accuracy_table(scores)
+    elapsed = time.perf_counter() - start
+    print(scores.to_string(index=False))
+    print(table.to_string(index=False))
+    print(f"scored {len(scores)} clicks from {len(store.sessions)} sessions in {elapsed * 1000:.1f} ms")
@@ -0,0 +1,91 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from map_render import COORDINATE_PRECISION, heading_colors
+
+# Time-windowed playback of one track on its map.
+#
+# A window (seconds after the track's first fix) is turned into rows by binary
+# search on the timestamps TaskIndex keeps sorted per track, not by a mask over
+# the track. The map is rendered once with a playback layer (see
+# map_render.PlaybackLayer) and every slider move then posts a small message
+# into the iframe instead of re-rendering it. The layer keeps every point it
+# was sent in one contiguous range of track rows ("held"); a message only
+# carries the rows of the new window the map does not hold yet, and the layer
+# adds and removes just the markers entering and leaving the window. Scrubbing
+# back over rows already sent costs no points at all.
+
+# Slider resolution (seconds)
+PLAYBACK_STEP = 1
+
+MESSAGE_TYPE = 'wayfinding-playback'
+
+
+def _chunk(track, start, end):
+    # Positions (lat, lon), heading colors and seconds into the track of rows start..end
+    rows = track.iloc[start:end]
+    lat = rows['latitude'].to_numpy(dtype=np.float64)
+    lon = rows['longitude'].to_numpy(dtype=np.float64)
+    coords = np.round(np.column_stack([lat, lon]), COORDINATE_PRECISION)
+    first = track['timestamp'].iloc[0]
+    return {
+        'offset': int(start),
+        # Fixes without a position are sent as null and skipped by the layer, so indices stay aligned
+        'coords': [None if np.isnan(point).any() else point for point in coords.tolist()],
+        'colors': heading_colors(rows['heading'].to_numpy(dtype=np.float64)).tolist(),
+        'seconds': np.round((rows['timestamp'] - first).dt.total_seconds().to_numpy(), 1).tolist(),
+    }
+
+
+def playback_update(track, rows, held=None):
+    """Message for the playback layer of `track`'s map to show `rows` (a slice of the track's rows,
+    see TaskIndex.window), and the range of rows the map holds afterwards. `held` is the
+    (start, end) range it holds before, None for a map that holds nothing."""
+    start, end = rows.start, rows.stop
+    reset = held is None or end < held[0] or start > held[1]
+    if reset:
+        # Nothing to build on: the map starts over with just this window
+        pieces, held = [(start, end)], (start, end)
+    else:
+        pieces = [(start, held[0])] if start < held[0] else []
+        pieces += [(held[1], end)] if end > held[1] else []
+        held = (min(start, held[0]), max(end, held[1]))
+    message = {
+        'type': MESSAGE_TYPE,
+        'reset': reset,
+        'window': [int(start), int(end)],
+        'chunks': [_chunk(track, first, last) for first, last in pieces if last > first],
+    }
+    return message, [int(held[0]), int(held[1])]
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+    from task_index import TaskIndex
+    from waypoint_table import DASHBOARD_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Scrub through the longest track and report the cost of each "
+                                                 "playback update")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    parser.add_argument('--steps', type=int, default=200, help="slider positions to scrub through")
+    args = parser.parse_args()
+
+    tracks = TaskIndex(ingest(args.source).waypoint_frame(DASHBOARD_COLUMNS, compact=True))
+    key = max(tracks.slices, key=lambda key: tracks.slices[key].stop - tracks.slices[key].start)
+    track, duration = tracks.track(key), tracks.duration(key)
+
+    # Forward to the end and back again, as a user dragging the slider would
+    ends = np.linspace(0, duration, args.steps)
+    held, sizes, start = None, [], time.perf_counter()
+    for end in np.concatenate([ends, ends[::-1]]):
+        message, held = playback_update(track, tracks.window(key, 0, end), held)
+        sizes.append(len(json.dumps(message)))
+    seconds = time.perf_counter() - start
+    full = len(json.dumps(playback_update(track, slice(0, len(track)))[0]))
+    print(f"{key}: {len(track)} waypoints over {duration:.0f} s")
+    print(f"{len(sizes)} updates in {seconds * 1000:.0f} ms ({seconds / len(sizes) * 1000:.2f} ms each), "
+          f"{sum(sizes) / len(sizes) / 1024:.1f} KB per update on average "
+          f"(whole track {full / 1024:.1f} KB, {sum(sizes) / 1024:.1f} KB in total)")
@@ -0,0 +1,291 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import EARTH_RADIUS, GROUP_KEYS, sort_tracks
+
+# Stops, turns, compass sweeps and backtracking in every track.
+#
+# As in metrics.py, all waypoints are sorted once by track and time and every
+# quantity is computed over the whole arrays at once; tracks only show up as
+# boundaries. Each row is compared with the rows up to WINDOW seconds before
+# and after it in the same track (found with one searchsorted over a
+# (track, time) key), which smooths out GPS jitter without a per-track loop.
+#
+#   stop         displacement across the window below STOP_SPEED for at least
+#                STOP_SECONDS, staying within STOP_RADIUS of its centre; the
+#                duration is the dwell time
+#   turn         walking direction changes by TURN_ANGLE across the window
+#   u_turn       ... by UTURN_ANGLE, i.e. turning around
+#   look_around  the compass turns through LOOK_ANGLE within the window while
+#                the participant stands or walks slowly (orienting, hesitating)
+#   backtrack    moving away from the track's end point (the destination of a
+#                navigation task) for at least BACKTRACK_METRES
+#
+# Walking direction is the device's coords.heading where it reports one and
+# the bearing of the displacement otherwise. Distances between the nearby
+# points compared here are equirectangular offsets (well under a metre off).
+
+# Bump when detection changes so cached segment tables are rebuilt
+SEGMENTS_VERSION = 2
+
+WINDOW = 5.0            # seconds before and after each row
+MAX_GAP = 30.0          # seconds without fixes that end any segment
+STOP_SPEED = 0.4        # m/s
+STOP_SECONDS = 10.0
+STOP_RADIUS = 15.0      # metres
+TURN_ANGLE = 60.0       # degrees
+UTURN_ANGLE = 150.0
+MIN_DISPLACEMENT = 2.0  # metres needed for a bearing from positions
+LOOK_ANGLE = 90.0       # degrees the compass turns through within the window
+LOOK_SPEED = 1.0        # m/s
+BACKTRACK_METRES = 15.0
+
+SEGMENT_KINDS = ['stop', 'turn', 'u_turn', 'look_around', 'backtrack']
+
+# Meaning of the `value` column per kind
+SEGMENT_VALUES = {
+    'stop': 'radius in metres',
+    'turn': 'signed direction change in degrees (positive = right)',
+    'u_turn': 'signed direction change in degrees (positive = right)',
+    'look_around': 'degrees the compass turned through',
+    'backtrack': 'metres moved away from the end point',
+}
+
+SEGMENT_COLUMNS = ['kind', 'start', 'end', 'duration_s', 'longitude', 'latitude', 'points', 'value']
+
+SUMMARY_COLUMNS = ['Stops', 'Dwell_time', 'Turns', 'U_turns', 'Look_arounds', 'Backtrack']
+
+# Tracks start at multiples of this in the (track, time) search key (ms, ~35 years)
+_TRACK_SPAN = 1 << 40
+
+
+def _offset(lon, lat, i, j):
+    # East/north metres from rows i to rows j
+    scale = np.cos(np.radians((lat[i] + lat[j]) / 2))
+    return np.radians(lon[j] - lon[i]) * EARTH_RADIUS * scale, np.radians(lat[j] - lat[i]) * EARTH_RADIUS
+
+
+def _wrap(degrees):
+    return (degrees + 180) % 360 - 180
+
+
+def _runs(flag, breaks):
+    """(first, last) rows of the runs of True in `flag`; a run never continues across a break."""
+    previous = np.concatenate([[False], flag[:-1]])
+    following = np.concatenate([flag[1:], [False]])
+    next_break = np.concatenate([breaks[1:], [True]])
+    return np.flatnonzero(flag & (breaks | ~previous)), np.flatnonzero(flag & (next_break | ~following))
+
+
+def _run_rows(first, last):
+    # Row positions of all runs, one after the other, and the offset of each run in them
+    lengths = last - first + 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.intp)
+    rows = np.repeat(first - offsets, lengths) + np.arange(lengths.sum())
+    return rows, offsets
+
+
+def _peak(values, first, last):
+    # Row of the largest value in each run
+    rows, offsets = _run_rows(first, last)
+    run = np.repeat(np.arange(len(first)), last - first + 1)
+    peak = np.maximum.reduceat(values[rows], offsets) if len(rows) else values[:0]
+    candidates = np.flatnonzero(values[rows] == peak[run])
+    _, first_candidate = np.unique(run[candidates], return_index=True)
+    return rows[candidates[first_candidate]]
+
+
+def detect_segments(frame, keys=GROUP_KEYS):
+    """One row per detected stop, turn, look-around and backtrack, for every track in `frame`.
+
+    Needs the key columns, timestamp, longitude, latitude, speed, heading and
+    compassHeading. See SEGMENT_VALUES for the `value` column."""
+    frame = frame[frame['longitude'].notna() & frame['latitude'].notna() & frame['timestamp'].notna()]
+    order, starts = sort_tracks(frame, keys)
+    if len(order) == 0:
+        return pd.DataFrame({column: [] for column in keys + SEGMENT_COLUMNS})
+
+    lon = frame['longitude'].to_numpy(dtype=np.float64)[order]
+    lat = frame['latitude'].to_numpy(dtype=np.float64)[order]
+    ms = frame['timestamp'].to_numpy().astype('datetime64[ms]').astype(np.int64)[order]
+    heading = frame['heading'].to_numpy(dtype=np.float64)[order]
+    compass = frame['compassHeading'].to_numpy(dtype=np.float64)[order]
+    counts = np.diff(np.append(starts, len(order)))
+    track = np.repeat(np.arange(len(starts)), counts)
+    ends = starts + counts - 1
+
+    # Neighbourhood of every row: first and last row within +-WINDOW in its track
+    key = track.astype(np.int64) * _TRACK_SPAN + (ms - ms[starts][track])
+    window = int(WINDOW * 1000)
+    before = np.searchsorted(key, key - window, side='left')
+    after = np.searchsorted(key, key + window, side='right') - 1
+
+    # Segments end at track starts and at gaps in the recording
+    breaks = np.zeros(len(order), dtype=bool)
+    breaks[starts] = True
+    breaks[1:] |= np.diff(ms) > MAX_GAP * 1000
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dx, dy = _offset(lon, lat, before, after)
+        seconds = (ms[after] - ms[before]) / 1000
+        speed = np.where(seconds > 0, np.hypot(dx, dy) / seconds, np.nan)
+
+    tables = [
+        _stops(lon, lat, ms, speed, breaks),
+        _turns(lon, lat, ms, speed, heading, before, after, breaks),
+        _look_arounds(lon, lat, ms, speed, compass, before, after, breaks),
+        _backtracks(lon, lat, ms, speed, ends[track], before, after, breaks),
+    ]
+    segments = pd.concat([table for table in tables if len(table)] or tables[:1], ignore_index=True)
+    segments = segments.sort_values(['row', 'kind'], ignore_index=True)
+
+    first_rows = frame.iloc[order[segments['row'].to_numpy()]]
+    result = pd.DataFrame({key: first_rows[key].to_numpy() for key in keys})
+    for column in SEGMENT_COLUMNS:
+        result[column] = segments[column].to_numpy()
+    return result
+
+
+def _table(kind, ms, first, last, longitude, latitude, value):
+    return pd.DataFrame({
+        'row': first,
+        'kind': kind,
+        'start': ms[first].astype('datetime64[ms]'),
+        'end': ms[last].astype('datetime64[ms]'),
+        'duration_s': (ms[last] - ms[first]) / 1000,
+        'longitude': longitude,
+        'latitude': latitude,
+        'points': last - first + 1,
+        'value': value,
+    })
+
+
+def _stops(lon, lat, ms, speed, breaks):
+    first, last = _runs(speed < STOP_SPEED, breaks)
+    long_enough = (ms[last] - ms[first]) >= STOP_SECONDS * 1000
+    first, last = first[long_enough], last[long_enough]
+    if not len(first):
+        return _table('stop', ms, first, last, lon[first], lat[first], np.zeros(0))
+
+    # Centre of each stop and how far its fixes spread around it
+    rows, offsets = _run_rows(first, last)
+    points = last - first + 1
+    centre_lon = np.add.reduceat(lon[rows], offsets) / points
+    centre_lat = np.add.reduceat(lat[rows], offsets) / points
+    run = np.repeat(np.arange(len(first)), points)
+    scale = np.cos(np.radians(centre_lat[run]))
+    spread = np.hypot(np.radians(lon[rows] - centre_lon[run]) * EARTH_RADIUS * scale,
+                      np.radians(lat[rows] - centre_lat[run]) * EARTH_RADIUS)
+    radius = np.maximum.reduceat(spread, offsets)
+    keep = radius <= STOP_RADIUS
+    return _table('stop', ms, first[keep], last[keep], centre_lon[keep], centre_lat[keep], radius[keep])
+
+
+def _turns(lon, lat, ms, speed, heading, before, after, breaks):
+    rows = np.arange(len(lon))
+    # Direction in and out of each row: bearing of the displacement, or the
+    # reported heading where both ends of the window have one
+    in_x, in_y = _offset(lon, lat, before, rows)
+    out_x, out_y = _offset(lon, lat, rows, after)
+    change = _wrap(np.degrees(np.arctan2(out_x, out_y)) - np.degrees(np.arctan2(in_x, in_y)))
+    valid = (np.hypot(in_x, in_y) >= MIN_DISPLACEMENT) & (np.hypot(out_x, out_y) >= MIN_DISPLACEMENT)
+    reported = (heading[before] >= 0) & (heading[after] >= 0) & (heading[before] < 360) & (heading[after] < 360)
+    change = np.where(reported, _wrap(heading[after] - heading[before]), change)
+    valid |= reported
+
+    size = np.where(valid, np.abs(change), 0.0)
+    first, last = _runs(valid & (speed >= STOP_SPEED) & (size >= TURN_ANGLE), breaks)
+    peak = _peak(size, first, last)
+    kind = np.where(size[peak] >= UTURN_ANGLE, 'u_turn', 'turn')
+    return _table(kind, ms, first, last, lon[peak], lat[peak], change[peak])
+
+
+def _window_range(values, before, after):
+    # max - min of values[before:after + 1] for every row, from a sparse table
+    # of maxima/minima over power-of-two spans
+    length = after - before + 1
+    level = np.floor(np.log2(np.maximum(length, 1))).astype(np.intp)
+    highest, lowest = [values], [values]
+    for k in range(1, int(level.max()) + 1 if len(level) else 1):
+        span = 1 << (k - 1)
+        highest.append(np.maximum(highest[-1][:-span], highest[-1][span:]))
+        lowest.append(np.minimum(lowest[-1][:-span], lowest[-1][span:]))
+    result = np.empty(len(values))
+    for k in np.unique(level):
+        rows = np.flatnonzero(level == k)
+        tail = after[rows] - (1 << k) + 1
+        result[rows] = (np.maximum(highest[k][before[rows]], highest[k][tail])
+                        - np.minimum(lowest[k][before[rows]], lowest[k][tail]))
+    return result
+
+
+def _look_arounds(lon, lat, ms, speed, compass, before, after, breaks):
+    # Compass unwrapped into a continuous angle; its range within the window
+    # is how far the device turned, which sample-to-sample jitter hardly adds to
+    step = _wrap(np.diff(compass, prepend=compass[:1]))
+    step[breaks | np.isnan(step)] = 0.0
+    sweep = _window_range(np.cumsum(step), before, after)
+    first, last = _runs((sweep >= LOOK_ANGLE) & ~(speed >= LOOK_SPEED), breaks)
+    peak = _peak(sweep, first, last)
+    return _table('look_around', ms, first, last, lon[peak], lat[peak], sweep[peak])
+
+
+def _backtracks(lon, lat, ms, speed, end_rows, before, after, breaks):
+    dx, dy = _offset(lon, lat, np.arange(len(lon)), end_rows)
+    to_end = np.hypot(dx, dy)
+    seconds = (ms[after] - ms[before]) / 1000
+    away = (to_end[after] - to_end[before]) > STOP_SPEED * seconds
+    first, last = _runs(away & (speed >= STOP_SPEED), breaks)
+    metres = to_end[last] - to_end[first]
+    keep = metres >= BACKTRACK_METRES
+    first, last = first[keep], last[keep]
+    return _table('backtrack', ms, first, last, lon[first], lat[first], metres[keep])
+
+
+def segment_summary(segments, keys=GROUP_KEYS):
+    """Per track with segments: stops, dwell time (min), turns, u-turns, look-arounds and backtracked metres."""
+    totals = segments.groupby(keys + ['kind'], observed=True, sort=True).agg(
+        count=('kind', 'size'), duration_s=('duration_s', 'sum'), value=('value', 'sum'))
+    totals = totals.unstack('kind', fill_value=0).reindex(
+        columns=pd.MultiIndex.from_product([['count', 'duration_s', 'value'], SEGMENT_KINDS]), fill_value=0)
+    summary = pd.DataFrame({
+        'Stops': totals[('count', 'stop')],
+        'Dwell_time': totals[('duration_s', 'stop')] / 60,
+        'Turns': totals[('count', 'turn')],
+        'U_turns': totals[('count', 'u_turn')],
+        'Look_arounds': totals[('count', 'look_around')],
+        'Backtrack': totals[('value', 'backtrack')],
+    })
+    return summary.reset_index()
+
+
+def track_segments(segments, key, keys=GROUP_KEYS):
+    """Segments of one (participant, session_id, taskCategory, taskNo) track."""
+    mask = np.ones(len(segments), dtype=bool)
+    for column, value in zip(keys, key):
+        mask &= segments[column].to_numpy() == value
+    return segments[mask]
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+
+    parser = argparse.ArgumentParser(description="Detect stops, turns, look-arounds and backtracking in every track")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    parser.add_argument('--output', help="write the segment table to this CSV file")
+    args = parser.parse_args()
+
+    waypoints = ingest(args.source).waypoint_frame(GROUP_KEYS + ['timestamp', 'longitude', 'latitude', 'speed',
+                                                                 'heading', 'compassHeading'], compact=True)
+    start = time.perf_counter()
+    segments = detect_segments(waypoints)
+    elapsed = time.perf_counter() - start
+    print(segment_summary(segments).to_string(index=False))
+    print(segments['kind'].value_counts().to_string())
+    print(f"{len(segments)} segments in {len(waypoints)} waypoints in {elapsed:.2f} s "
+          f"({len(waypoints) / max(elapsed, 1e-9):,.0f} waypoints/s)")
+    if args.output:
+        segments.to_csv(args.output, index=False)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count_lookup
+from session_loader import Session, load_session
+
+# Persistent on-disk cache of extracted sessions.
+#
+# Every source file is keyed by the sha256 of its content. The manifest maps
+# the absolute path to (mtime, size, sha256) so unchanged files are matched
+# with a single stat() instead of being re-hashed. Each cached session is a
+# directory of plain .npy files, one per column, which np.load memory-maps:
+# later boots and extra gunicorn workers share the pages through the OS page
+# cache instead of re-parsing JSON.
+#
+#   <cache>/manifest.json
+#   <cache>/sessions/<sha256>/meta.json
+#   <cache>/sessions/<sha256>/waypoints/<column>.npy
+#   <cache>/sessions/<sha256>/events/<column>.npy
+#   <cache>/tables/<key>/<column>.npy
+
+CACHE_DIR = os.environ.get(
+    'WAYFINDING_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.wayfinding_cache'),
+)
+
+# Bump when the extracted layout changes so stale entries are not reused
+CACHE_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json'), 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != CACHE_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def _write_manifest(cache_dir, files):
+    # Re-read before writing so concurrent workers do not drop each other's entries
+    merged = read_manifest(cache_dir)
+    merged.update(files)
+    _atomic_write_json(os.path.join(cache_dir, 'manifest.json'),
+                       {'version': CACHE_VERSION, 'files': merged})
+
+
+def _atomic_write_json(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(payload, file)
+    os.replace(tmp_path, path)
+
+
+def _save_columns(directory, columns):
+    os.makedirs(directory, exist_ok=True)
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = values.astype(str)
+        np.save(os.path.join(directory, name + '.npy'), values, allow_pickle=False)
+
+
+def _load_columns(directory, names):
+    return {
+        name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r', allow_pickle=False)
+        for name in names
+    }
+
+
+def _publish(tmp_dir, final_dir):
+    # Rename the finished directory into place; if another worker won the race
+    # its copy is identical, so ours is simply discarded
+    try:
+        os.rename(tmp_dir, final_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _store_session(cache_dir, digest, session):
+    root = os.path.join(cache_dir, 'sessions')
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix='.' + digest[:12])
+    _save_columns(os.path.join(tmp_dir, 'waypoints'), session.waypoints)
+    _save_columns(os.path.join(tmp_dir, 'events'), session.events)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as file:
+        json.dump({
+            'meta': session.meta,
+            'waypoints': list(session.waypoints),
+            'events': list(session.events),
+            'task_geometry': session.task_geometry,
+        }, file)
+    _publish(tmp_dir, os.path.join(root, digest))
+
+
+def _open_session(cache_dir, digest):
+    directory = os.path.join(cache_dir, 'sessions', digest)
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'r') as file:
+            stored = json.load(file)
+        return Session(
+            stored['meta'],
+            _load_columns(os.path.join(directory, 'waypoints'), stored['waypoints']),
+            _load_columns(os.path.join(directory, 'events'), stored['events']),
+            stored['task_geometry'],
+        )
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def cached_digest(path, manifest, cache_dir=CACHE_DIR):
+    # Digest of an unchanged, already extracted file, found with stat() only
+    path = os.path.abspath(path)
+    entry = manifest.get(path)
+    if not entry:
+        return None
+    stat = os.stat(path)
+    if entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+        return None
+    if not os.path.exists(os.path.join(cache_dir, 'sessions', entry['sha256'], 'meta.json')):
+        return None
+    return entry['sha256']
+
+
+def ensure_cached(path, cache_dir=CACHE_DIR, manifest=None):
+    """Extract `path` into the cache unless present; return (digest, hit, manifest_entry)."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    if manifest is None:
+        manifest = read_manifest(cache_dir)
+
+    entry = manifest.get(path)
+    if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+        digest = entry['sha256']
+    else:
+        digest = file_digest(path)
+    entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': digest}
+
+    hit = os.path.exists(os.path.join(cache_dir, 'sessions', digest, 'meta.json'))
+    if not hit:
+        _store_session(cache_dir, digest, load_session(path))
+    return digest, hit, entry
+
+
+def open_cached(digest, cache_dir=CACHE_DIR):
+    session = _open_session(cache_dir, digest)
+    if session is not None:
+        session.source_hash = digest
+    return session
+
+
+def load_session_cached(path, cache_dir=CACHE_DIR, manifest=None):
+    """Return (session, hit, manifest_entry) for one source file."""
+    digest, hit, entry = ensure_cached(path, cache_dir, manifest)
+    return open_cached(digest, cache_dir), hit, entry
+
+
+def record_entries(entries, cache_dir=CACHE_DIR, manifest=None):
+    # Persist manifest entries that differ from what is already recorded
+    if manifest is None:
+        manifest = read_manifest(cache_dir)
+    changed = {path: entry for path, entry in entries.items() if manifest.get(path) != entry}
+    if changed:
+        _write_manifest(cache_dir, changed)
+
+
+def load_sessions(paths, cache_dir=CACHE_DIR):
+    start = time.perf_counter()
+    manifest = read_manifest(cache_dir)
+    sessions = []
+    entries = {}
+    hits = 0
+    for path in paths:
+        session, hit, entry = load_session_cached(path, cache_dir, manifest)
+        sessions.append(session)
+        hits += hit
+        entries[os.path.abspath(path)] = entry
+    record_entries(entries, cache_dir, manifest)
+    report_load(len(sessions), hits, time.perf_counter() - start)
+    return sessions
+
+
+def report_load(files, hits, seconds):
+    mode = 'warm' if hits == files else 'cold'
+    print(f"session cache ({mode}): {files} files, {hits} cached, "
+          f"{files - hits} extracted in {seconds * 1000:.1f} ms")
+
+
+def _table_key(name, sessions, params):
+    # Tables depend on the set of sessions, not the order they were loaded in
+    digest = hashlib.sha256()
+    digest.update(f'{CACHE_VERSION}:{name}:{params!r}'.encode())
+    for source_hash in sorted(session.source_hash for session in sessions):
+        digest.update(source_hash.encode())
+    return digest.hexdigest()
+
+
+def store_table(name, sessions, frame, *params, cache_dir=CACHE_DIR):
+    """Cache a table computed for `sessions`, e.g. one updated incrementally as sessions arrive."""
+    key = _table_key(name, sessions, params)
+    root = os.path.join(cache_dir, 'tables')
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix='.' + key[:12])
+    _save_columns(tmp_dir, {column: frame[column].to_numpy() for column in frame.columns})
+    with open(os.path.join(tmp_dir, 'columns.json'), 'w') as file:
+        json.dump(list(frame.columns), file)
+    _publish(tmp_dir, os.path.join(root, key))
+
+
+def cached_table(name, sessions, compute, *params, cache_dir=CACHE_DIR):
+    """Return compute() from the cache, keyed by table name, params and source hashes."""
+    start = time.perf_counter()
+    key = _table_key(name, sessions, params)
+    directory = os.path.join(cache_dir, 'tables', key)
+    try:
+        with open(os.path.join(directory, 'columns.json'), 'r') as file:
+            names = json.load(file)
+        frame = pd.DataFrame(_load_columns(directory, names))
+        mode = 'warm'
+        count_lookup('tables', True)
+    except (OSError, ValueError):
+        count_lookup('tables', False)
+        frame = compute()
+        store_table(name, sessions, frame, *params, cache_dir=cache_dir)
+        mode = 'cold'
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"table cache ({mode}): {name} in {elapsed:.1f} ms")
+    return frame
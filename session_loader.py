@@ -0,0 +1,286 @@
+from array import array
+
+import ijson
+import numpy as np
+import pandas as pd
+
+# Streaming loader for GeoGami session exports.
+#
+# A session file holds a handful of header fields plus two large arrays,
+# `waypoints` and `events`. Instead of json.load-ing the whole document and
+# walking the resulting dicts, the file is read in chunks by a single ijson
+# parser and every leaf value is written straight into a flat, typed column.
+# No per-waypoint dicts are built; only the task question geometry of events
+# (needed for object localization) is materialized as a small GeoJSON dict.
+
+HEADER_FIELDS = ['_id', 'game', 'name', 'start', 'end']
+
+# Missing integers are stored as -1, missing floats as NaN, missing text as ''
+MISSING_INT = -1
+
+# Column name -> dtype of the extracted waypoint table
+WAYPOINT_COLUMNS = {
+    'timestamp': 'datetime64[ms]',
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'altitude': np.float64,
+    'speed': np.float64,
+    'heading': np.float64,
+    'accuracy': np.float64,
+    'taskNo': np.int16,
+    'taskCategory': str,
+    'panCount': np.int32,
+    'zoomCount': np.int32,
+    'rotation': np.float64,
+    'compassHeading': np.float64,
+    'zoom': np.float64,
+    'viewport_west': np.float64,
+    'viewport_south': np.float64,
+    'viewport_east': np.float64,
+    'viewport_north': np.float64,
+    'participant': str,
+}
+
+# JSON path below `waypoints.item` -> waypoint column
+WAYPOINT_FIELDS = {
+    'timestamp': 'timestamp',
+    'position.coords.latitude': 'latitude',
+    'position.coords.longitude': 'longitude',
+    'position.coords.altitude': 'altitude',
+    'position.coords.speed': 'speed',
+    'position.coords.heading': 'heading',
+    'position.coords.accuracy': 'accuracy',
+    'taskNo': 'taskNo',
+    'taskCategory': 'taskCategory',
+    'interaction.panCount': 'panCount',
+    'interaction.zoomCount': 'zoomCount',
+    'interaction.rotation': 'rotation',
+    'interaction.rotationCount': 'rotation',
+    'compassHeading': 'compassHeading',
+    'mapViewport.zoom': 'zoom',
+    'mapViewport.bounds._sw.lng': 'viewport_west',
+    'mapViewport.bounds._sw.lat': 'viewport_south',
+    'mapViewport.bounds._ne.lng': 'viewport_east',
+    'mapViewport.bounds._ne.lat': 'viewport_north',
+    'participant': 'participant',
+}
+
+# Column name -> dtype of the extracted event table
+EVENT_COLUMNS = {
+    'type': str,
+    'timestamp': 'datetime64[ms]',
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'accuracy': np.float64,
+    'compassHeading': np.float64,
+    'task_id': str,
+    'task_type': str,
+    'task_category': str,
+    'panCount': np.int32,
+    'zoomCount': np.int32,
+    'rotation': np.float64,
+    'click_latitude': np.float64,
+    'click_longitude': np.float64,
+    'correct': np.int8,
+    'zoom': np.float64,
+    'participant': str,
+}
+
+# JSON path below `events.item` -> event column
+EVENT_FIELDS = {
+    'type': 'type',
+    'timestamp': 'timestamp',
+    'position.coords.latitude': 'latitude',
+    'position.coords.longitude': 'longitude',
+    'position.coords.accuracy': 'accuracy',
+    'compassHeading': 'compassHeading',
+    'task._id': 'task_id',
+    'task.type': 'task_type',
+    'task.category': 'task_category',
+    'interaction.panCount': 'panCount',
+    'interaction.zoomCount': 'zoomCount',
+    'interaction.rotationCount': 'rotation',
+    'interaction.rotation': 'rotation',
+    'clickPosition.latitude': 'click_latitude',
+    'clickPosition.longitude': 'click_longitude',
+    'correct': 'correct',
+    'answer.correct': 'correct',
+    'mapViewport.zoom': 'zoom',
+    'participant': 'participant',
+}
+
+# answer.clickPosition is a [lon, lat] array on click/answer events
+CLICK_POSITION = 'events.item.answer.clickPosition.item'
+TASK_GEOMETRY = 'events.item.task.question.geometry'
+
+LEAF_EVENTS = {'number', 'string', 'boolean', 'null'}
+
+
+class _ColumnBuilder:
+    # Accumulates rows straight into typed buffers: array.array for numbers,
+    # plain lists only for text and ISO timestamps. A row is opened with
+    # `new_row` and its fields are then overwritten in place as leaf values
+    # arrive from the parser.
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.buffers = {}
+        self.defaults = {}
+        self.kinds = {}
+        for name, dtype in schema.items():
+            kind = 'U' if dtype is str else np.dtype(dtype).kind
+            if kind == 'f':
+                self.buffers[name] = array('d')
+                self.defaults[name] = np.nan
+            elif kind == 'i':
+                self.buffers[name] = array('q')
+                self.defaults[name] = MISSING_INT
+            else:
+                self.buffers[name] = []
+                self.defaults[name] = None
+            self.kinds[name] = kind
+
+    def new_row(self):
+        for name, buffer in self.buffers.items():
+            buffer.append(self.defaults[name])
+
+    def set(self, name, value):
+        if value is None:
+            return
+        kind = self.kinds[name]
+        if kind == 'f':
+            if not isinstance(value, str):
+                self.buffers[name][-1] = float(value)
+        elif kind == 'i':
+            if not isinstance(value, str):
+                self.buffers[name][-1] = int(value)
+        else:
+            self.buffers[name][-1] = str(value)
+
+    def finish(self, participant):
+        columns = {}
+        for name, dtype in self.schema.items():
+            buffer = self.buffers[name]
+            if name == 'participant':
+                columns[name] = np.array([participant if v is None else v for v in buffer], dtype=str)
+            elif dtype == 'datetime64[ms]':
+                columns[name] = _parse_timestamps(buffer)
+            elif isinstance(buffer, array):
+                source = np.float64 if buffer.typecode == 'd' else np.int64
+                columns[name] = np.frombuffer(buffer, dtype=source).astype(dtype)
+            else:
+                columns[name] = np.array(['' if v is None else v for v in buffer], dtype=str)
+        return columns
+
+
+def _parse_timestamps(values):
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), utc=True, format='ISO8601')
+    return parsed.dt.tz_localize(None).to_numpy().astype('datetime64[ms]')
+
+
+class Session:
+    # One parsed session file: header metadata plus columnar waypoint and
+    # event tables (dicts of equally long numpy arrays).
+
+    def __init__(self, meta, waypoints, events, task_geometry):
+        self.meta = meta
+        self.waypoints = waypoints
+        self.events = events
+        # GeoJSON of the task question per event row (None when absent)
+        self.task_geometry = task_geometry
+        # sha256 of the source file, set when loaded through session_cache
+        self.source_hash = None
+
+    @property
+    def participant(self):
+        players = self.meta.get('players') or []
+        return players[0] if players else ''
+
+    def waypoint_frame(self, columns=None):
+        names = columns or list(self.waypoints)
+        return pd.DataFrame({name: self.waypoints[name] for name in names})
+
+    def event_frame(self, columns=None):
+        names = columns or list(self.events)
+        return pd.DataFrame({name: self.events[name] for name in names})
+
+    def __len__(self):
+        return len(self.waypoints['timestamp'])
+
+
+def check_session(session):
+    """Raise ValueError unless `session` has the shape of a session export: named players and
+    waypoints that all carry a timestamp and a task, at least one of them with a position."""
+    players = session.meta.get('players')
+    if not players or not all(isinstance(player, str) and player for player in players):
+        raise ValueError("session has no players")
+    waypoints = session.waypoints
+    if not len(session):
+        raise ValueError("session has no waypoints")
+    if np.isnat(waypoints['timestamp']).any():
+        raise ValueError("session has waypoints without a timestamp")
+    if (waypoints['taskCategory'] == '').any() or (waypoints['taskNo'] < 0).any():
+        raise ValueError("session has waypoints without a task")
+    if np.isnan(waypoints['latitude']).all() or np.isnan(waypoints['longitude']).all():
+        raise ValueError("session has no waypoint with a position")
+
+
+def load_session(path):
+    meta = {'players': []}
+    waypoints = _ColumnBuilder(WAYPOINT_COLUMNS)
+    events = _ColumnBuilder(EVENT_COLUMNS)
+    task_geometry = []
+    waypoint_fields = {'waypoints.item.' + key: column for key, column in WAYPOINT_FIELDS.items()}
+    event_fields = {'events.item.' + key: column for key, column in EVENT_FIELDS.items()}
+
+    click_position = []
+    geometry_builder = None
+    geometry_depth = 0
+
+    with open(path, 'rb') as file:
+        for prefix, event, value in ijson.parse(file, use_float=True):
+            # Task geometry subtree: hand every parser event to a builder
+            if geometry_builder is not None:
+                geometry_builder.event(event, value)
+                if event in ('start_map', 'start_array'):
+                    geometry_depth += 1
+                elif event in ('end_map', 'end_array'):
+                    geometry_depth -= 1
+                if geometry_depth == 0:
+                    task_geometry[-1] = geometry_builder.value
+                    geometry_builder = None
+                continue
+
+            if event in LEAF_EVENTS:
+                column = waypoint_fields.get(prefix)
+                if column is not None:
+                    waypoints.set(column, value)
+                    continue
+                column = event_fields.get(prefix)
+                if column is not None:
+                    events.set(column, value)
+                elif prefix == CLICK_POSITION:
+                    click_position.append(value)
+                elif prefix == 'players.item':
+                    meta['players'].append(value)
+                elif prefix in HEADER_FIELDS:
+                    meta[prefix] = value
+            elif prefix == 'waypoints.item':
+                if event == 'start_map':
+                    waypoints.new_row()
+            elif prefix == 'events.item':
+                if event == 'start_map':
+                    events.new_row()
+                    task_geometry.append(None)
+                    click_position = []
+                elif event == 'end_map' and len(click_position) >= 2:
+                    events.set('click_longitude', click_position[0])
+                    events.set('click_latitude', click_position[1])
+            elif prefix == TASK_GEOMETRY and event == 'start_map':
+                geometry_builder = ijson.ObjectBuilder()
+                geometry_builder.event(event, value)
+                geometry_depth = 1
+
+    players = meta['players']
+    participant = players[0] if players else ''
+    return Session(meta, waypoints.finish(participant), events.finish(participant), task_geometry)
@@ -0,0 +1,159 @@
+import hashlib
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+from waypoint_table import compact_column
+
+# One in-memory store for many sessions.
+#
+# The per-session waypoint and event columns are concatenated into flat
+# arrays. Every row keeps the position of its session in `sessions`, so the
+# session tags (_id, game, players) are stored once per session and expanded
+# into categorical columns only when a frame is requested.
+#
+# After concatenation each session's columns are re-pointed at views into the
+# combined arrays. That releases the per-file memory maps the cache opened
+# (one file descriptor per column and session, which runs out quickly with
+# hundreds of sessions) without copying anything again.
+#
+# Sessions that arrive while the app runs are added with `append`; their rows
+# go after the existing ones, so earlier row numbers stay valid. Each append
+# is kept as a chunk of its own (see ColumnChunks): it concatenates only the
+# new sessions' columns, and reading the rows from some point on (the new
+# sessions) touches only the chunks holding them.
+
+SESSION_TAGS = ['session_id', 'game', 'players']
+
+
+def _concat(tables):
+    names = list(tables[0]) if tables else []
+    return {name: np.concatenate([table[name] for table in tables]) for name in names}
+
+
+def _rebase(sessions, table, columns, session_codes):
+    bounds = np.searchsorted(session_codes, np.arange(len(sessions) + 1))
+    for session, start, stop in zip(sessions, bounds[:-1], bounds[1:]):
+        setattr(session, table, {name: values[start:stop] for name, values in columns.items()})
+
+
+def session_id(session):
+    """The session's _id; sessions exported without one are told apart by their file contents."""
+    return session.meta.get('_id') or session.source_hash or ''
+
+
+class ColumnChunks:
+    # Equally long named columns plus the session code of every row, held as
+    # the chunks they were appended in. Reads by name return whole columns;
+    # `column` and `codes` read the rows from `start` on.
+
+    def __init__(self):
+        self.chunks = []
+        self.chunk_codes = []
+        self.offsets = [0]
+
+    def append(self, columns, codes):
+        if len(codes):
+            self.chunks.append(columns)
+            self.chunk_codes.append(codes)
+            self.offsets.append(self.offsets[-1] + len(codes))
+
+    def _from(self, parts, start):
+        first = min(bisect_right(self.offsets, start) - 1, len(parts) - 1)
+        if first < 0:
+            return None
+        parts = parts[first:]
+        parts[0] = parts[0][start - self.offsets[first]:]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def column(self, name, start=0):
+        return self._from([chunk[name] for chunk in self.chunks], start)
+
+    def codes(self, start=0):
+        codes = self._from(list(self.chunk_codes), start)
+        return np.zeros(0, dtype=np.int32) if codes is None else codes
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __iter__(self):
+        return iter(self.chunks[0] if self.chunks else ())
+
+    def __len__(self):
+        return self.offsets[-1]
+
+
+class SessionStore:
+
+    def __init__(self, sessions):
+        self.sessions = []
+        self.waypoints = ColumnChunks()
+        self.events = ColumnChunks()
+        self.task_geometry = []
+        self.append(sessions)
+
+    def append(self, sessions):
+        """Add sessions after the existing ones; returns the first waypoint row of the new sessions."""
+        sessions = list(sessions)
+        first_waypoint = len(self.waypoints)
+        offset = len(self.sessions)
+        self.sessions.extend(sessions)
+        self.task_geometry += [geometry for session in sessions for geometry in session.task_geometry]
+        for table in ['waypoints', 'events']:
+            columns = _concat([getattr(session, table) for session in sessions])
+            codes = np.repeat(np.arange(len(sessions), dtype=np.int32),
+                              [len(getattr(session, table)['timestamp']) for session in sessions])
+            _rebase(sessions, table, columns, codes)
+            getattr(self, table).append(columns, codes + offset)
+        return first_waypoint
+
+    @property
+    def waypoint_session(self):
+        return self.waypoints.codes()
+
+    @property
+    def event_session(self):
+        return self.events.codes()
+
+    @property
+    def version(self):
+        # Changes whenever any source file (or the set of files) changes
+        digest = hashlib.sha256()
+        for session in self.sessions:
+            digest.update((session.source_hash or session.meta.get('_id', '')).encode())
+        return digest.hexdigest()[:16]
+
+    @property
+    def session_table(self):
+        return pd.DataFrame({
+            'session_id': [session_id(session) for session in self.sessions],
+            'game': [session.meta.get('game', '') for session in self.sessions],
+            'players': [','.join(session.meta.get('players') or []) for session in self.sessions],
+            'name': [session.meta.get('name', '') for session in self.sessions],
+        })
+
+    def _tags(self, codes):
+        table = self.session_table
+        tags = {}
+        for tag in SESSION_TAGS:
+            tag_codes, categories = pd.factorize(table[tag])
+            tags[tag] = pd.Categorical.from_codes(tag_codes[codes], categories=categories)
+        return tags
+
+    def waypoint_frame(self, columns=None, compact=False, start=0):
+        # compact=True narrows the dtypes (see waypoint_table.py); only `columns` of the rows
+        # from `start` on are materialized
+        names = columns or list(self.waypoints) + SESSION_TAGS
+        tags = self._tags(self.waypoints.codes(start)) if set(names) & set(SESSION_TAGS) else {}
+        convert = compact_column if compact else lambda name, values: values
+        return pd.DataFrame({name: tags[name] if name in tags else convert(name, self.waypoints.column(name, start))
+                             for name in names})
+
+    def event_frame(self, columns=None):
+        names = columns or list(self.events) + SESSION_TAGS
+        tags = self._tags(self.events.codes()) if set(names) & set(SESSION_TAGS) else {}
+        return pd.DataFrame({name: tags[name] if name in tags else self.events[name] for name in names})
+
+    def __len__(self):
+        return len(self.waypoints)
@@ -0,0 +1,341 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import GROUP_KEYS, local_lonlat, local_xy, sort_tracks
+from task_index import track_labels
+
+# How alike the routes of different participants on the same task are. Every
+# track is a route, so a participant with two sessions on a task has two; they
+# are kept by (participant, session_id) and only labelled for display (see
+# task_index.track_labels).
+#
+# Routes are compared by shape, not by timing: each track is resampled to a
+# fixed number of points evenly spaced along its length (in local metres), so
+# a participant who lingered or whose phone logged more often does not look
+# different. The resampled routes of a track do not change when other tracks
+# are added, so the dashboard keeps them and resamples new tracks only. Two
+# distances are offered:
+#
+#   dtw      dynamic time warping, as the mean distance (m) between aligned points
+#   frechet  discrete Fréchet distance (m), the leash length a walker and a dog
+#            following the two routes need
+#
+# Both are dynamic programs over the point-to-point distance matrix of a pair.
+# Pairs are not looped over: a batch of pairs is updated one anti-diagonal of
+# the matrix at a time, so the Python loop runs once per diagonal and each step
+# is one array operation over every pair in the batch. The all-pairs matrix of
+# a task uses MATRIX_POINTS per route and is split over a process pool once it
+# has POOL_PAIRS pairs.
+#
+# "Most similar route" lookups compare one route with the others at the finer
+# LOOKUP_POINTS. The routes nearest in the coarse matrix are computed first
+# (the pre-filter), which sets the distance to beat; the other routes are then
+# taken in order of a lower bound of their distance and skipped as soon as the
+# bound is no better, so most pairs never run the dynamic program:
+#
+#   every point is aligned with at least one point of the other route, and
+#   both routes' first and last points with each other, so the distance is at
+#   least the (summed or largest) distance of each point to its nearest point
+#   on the other route and at least the distance of the end points.
+
+# Bump when the distances change so cached matrices are rebuilt
+SIMILARITY_VERSION = 4
+
+METRICS = {'dtw': 'DTW (mean m apart)', 'frechet': 'Fréchet (m)'}
+
+# Points per resampled route: the all-pairs matrix, and most-similar lookups
+MATRIX_POINTS = 32
+LOOKUP_POINTS = 128
+ROUTE_POINTS = (MATRIX_POINTS, LOOKUP_POINTS)
+
+# Columns of a similarity table: one row per pair of tracks of a task
+SIMILARITY_COLUMNS = ['taskCategory', 'taskNo', 'participant_a', 'session_a', 'participant_b', 'session_b',
+                      'distance']
+
+# Pairs x matrix cells per vectorized batch (bounds the memory of one batch, ~16 bytes per cell)
+BATCH_CELLS = 2 ** 21
+
+# Pairs above which the matrix is computed in a process pool
+POOL_PAIRS = 20000
+
+# Routes compared per step of a lookup
+LOOKUP_BATCH = 8
+
+
+def resample(x, y, points):
+    """`points` positions evenly spaced along the route through (x, y); None without any position."""
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    if not len(x):
+        return None
+    along = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+    targets = np.linspace(0.0, along[-1], points)
+    return np.column_stack([np.interp(targets, along, x), np.interp(targets, along, y)])
+
+
+def track_routes(frame, counts=ROUTE_POINTS, keys=GROUP_KEYS):
+    """Resampled routes of the tracks of `frame`, as longitude/latitude: {points: {track key: array
+    of shape (points, 2)}} for each of `counts`. Each track is resampled in metres around its own
+    latitude, so its routes do not depend on the other tracks and are kept as tracks are added.
+    Tracks without a single position are left out."""
+    order, starts = sort_tracks(frame, keys)
+    lon = frame['longitude'].to_numpy(dtype=np.float64)[order]
+    lat = frame['latitude'].to_numpy(dtype=np.float64)[order]
+    ends = np.append(starts[1:], len(order))
+    first_rows = frame.iloc[order[starts]][keys].itertuples(index=False, name=None)
+    routes = {points: {} for points in counts}
+    for key, start, end in zip(first_rows, starts, ends):
+        valid = np.isfinite(lon[start:end]) & np.isfinite(lat[start:end])
+        if not valid.any():
+            continue
+        origin_lat = float(lat[start:end][valid].mean())
+        x, y = local_xy(lon[start:end], lat[start:end], origin_lat)
+        for points in counts:
+            path = resample(x, y, points)
+            routes[points][key] = np.column_stack(local_lonlat(path[:, 0], path[:, 1], origin_lat))
+    return routes
+
+
+def task_paths(routes, keys, points=LOOKUP_POINTS, project=True):
+    """(the `keys` that have a route, their routes from `routes` (see track_routes) as an array of
+    shape (tracks, points, 2)): in local metres around the routes' mean latitude, or as
+    longitude/latitude if not `project`."""
+    keys = [key for key in keys if key in routes[points]]
+    paths = np.array([routes[points][key] for key in keys]).reshape(len(keys), points, 2)
+    if not project or not len(keys):
+        return keys, paths
+    return keys, np.stack(local_xy(paths[:, :, 0], paths[:, :, 1], float(paths[:, :, 1].mean())), axis=-1)
+
+
+def task_routes(frame, points=LOOKUP_POINTS):
+    """(track keys, resampled routes in local metres) of the tracks of one task, ordered by key."""
+    routes = track_routes(frame, (points,))
+    return task_paths(routes, sorted(routes[points]), points)
+
+
+def _squared_costs(a, b):
+    # Squared point-to-point distances of each pair: (pairs, n, m)
+    dx = a[:, :, np.newaxis, 0] - b[:, np.newaxis, :, 0]
+    dy = a[:, :, np.newaxis, 1] - b[:, np.newaxis, :, 1]
+    return dx * dx + dy * dy
+
+
+def pair_distances(a, b, metric='dtw'):
+    """Distance between routes a[k] and b[k] for every k (arrays of shape (pairs, points, 2))."""
+    pairs, n, m = len(a), a.shape[1], b.shape[1]
+    result = np.empty(pairs)
+    batch = max(BATCH_CELLS // (n * m), 1)
+    for first in range(0, pairs, batch):
+        cost = np.sqrt(_squared_costs(a[first:first + batch], b[first:first + batch]))
+        # Accumulated cost with a border of infinities; cell (i, j) of the pair is [:, i + 1, j + 1]
+        total = np.full((len(cost), n + 1, m + 1), np.inf)
+        total[:, 0, 0] = 0.0
+        for diagonal in range(n + m - 1):
+            i = np.arange(max(0, diagonal - m + 1), min(n, diagonal + 1))
+            j = diagonal - i
+            best = np.minimum(np.minimum(total[:, i, j + 1], total[:, i, j]), total[:, i + 1, j])
+            if metric == 'frechet':
+                total[:, i + 1, j + 1] = np.maximum(cost[:, i, j], best)
+            else:
+                total[:, i + 1, j + 1] = cost[:, i, j] + best
+        result[first:first + batch] = total[:, n, m]
+    return result / n if metric == 'dtw' else result
+
+
+def lower_bounds(query, paths, metric='dtw'):
+    """Lower bound of the distance between `query` (points, 2) and each of `paths`."""
+    n, m = len(query), paths.shape[1]
+    result = np.empty(len(paths))
+    batch = max(BATCH_CELLS // (n * m), 1)
+    for first in range(0, len(paths), batch):
+        cost = _squared_costs(query[np.newaxis], paths[first:first + batch])
+        rows, columns = np.sqrt(cost.min(axis=2)), np.sqrt(cost.min(axis=1))
+        ends = [np.sqrt(cost[:, 0, 0]), np.sqrt(cost[:, -1, -1])]
+        if metric == 'frechet':
+            bound = np.maximum.reduce([rows.max(axis=1), columns.max(axis=1)] + ends)
+        else:
+            bound = np.maximum.reduce([rows.sum(axis=1), columns.sum(axis=1),
+                                       ends[0] + ends[1] if n + m > 2 else ends[0]]) / n
+        result[first:first + len(cost)] = bound
+    return result
+
+
+def route_distances(a, b, metric='dtw'):
+    """pair_distances of routes a[k] and b[k] given as longitude/latitude (see track_routes). Each
+    pair is projected around its own mean latitude, so its distance does not depend on other routes."""
+    origin_lat = (a[:, :, 1].mean(axis=1) + b[:, :, 1].mean(axis=1))[:, np.newaxis] / 2
+    return pair_distances(np.stack(local_xy(a[:, :, 0], a[:, :, 1], origin_lat), axis=-1),
+                          np.stack(local_xy(b[:, :, 0], b[:, :, 1], origin_lat), axis=-1), metric)
+
+
+def distance_matrix(routes, metric='dtw', workers=None):
+    """Symmetric matrix of the distances between all `routes` (longitude/latitude, see route_distances)."""
+    count = len(routes)
+    a, b = np.triu_indices(count, k=1)
+    if len(a) > POOL_PAIRS and workers != 1:
+        workers = workers or os.cpu_count() or 1
+        chunks = np.array_split(np.arange(len(a)), workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(route_distances, [routes[a[chunk]] for chunk in chunks],
+                             [routes[b[chunk]] for chunk in chunks], [metric] * len(chunks))
+            upper = np.concatenate(list(parts))
+    else:
+        upper = route_distances(routes[a], routes[b], metric)
+    matrix = np.zeros((count, count))
+    matrix[a, b] = matrix[b, a] = upper
+    return matrix
+
+
+def nearest(query, paths, count=5, metric='dtw', prefilter=None):
+    """The `count` paths closest to `query`: (indices, distances, pairs computed). `prefilter` holds
+    approximate distances (e.g. a row of the coarse matrix) that decide which paths are computed
+    first; the result is exact either way."""
+    count = min(count, len(paths))
+    if not count:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), 0
+    distances = np.full(len(paths), np.inf)
+    bounds = lower_bounds(query, paths, metric)
+    first = np.argsort(prefilter if prefilter is not None else bounds, kind='stable')[:count]
+    distances[first] = pair_distances(np.broadcast_to(query, (count,) + query.shape), paths[first], metric)
+    computed = count
+
+    # Remaining paths by lower bound; none at or past the current count-th best can enter
+    rest = np.setdiff1d(np.arange(len(paths)), first)
+    rest = rest[np.argsort(bounds[rest], kind='stable')]
+    for start in range(0, len(rest), LOOKUP_BATCH):
+        threshold = np.partition(distances, count - 1)[count - 1]
+        batch = rest[start:start + LOOKUP_BATCH]
+        batch = batch[bounds[batch] < threshold]
+        if not len(batch):
+            break
+        distances[batch] = pair_distances(np.broadcast_to(query, (len(batch),) + query.shape), paths[batch], metric)
+        computed += len(batch)
+    closest = np.argsort(distances, kind='stable')[:count]
+    return closest, distances[closest], computed
+
+
+def cluster_order(matrix):
+    """Order of the rows of a distance matrix that keeps clusters together: the leaves of an
+    average-linkage clustering."""
+    count = len(matrix)
+    if count < 3:
+        return np.arange(count)
+    linkage = matrix.astype(np.float64, copy=True)
+    np.fill_diagonal(linkage, np.inf)
+    sizes = np.ones(count)
+    members = {row: [row] for row in range(count)}
+    for _ in range(count - 1):
+        i, j = divmod(int(np.argmin(linkage)), count)
+        merged = (linkage[i] * sizes[i] + linkage[j] * sizes[j]) / (sizes[i] + sizes[j])
+        linkage[i, :], linkage[:, i] = merged, merged
+        linkage[j, :], linkage[:, j] = np.inf, np.inf
+        linkage[i, i] = np.inf
+        sizes[i] += sizes[j]
+        members[i] += members.pop(j)
+    return np.array(next(iter(members.values())))
+
+
+def _pair_rows(keys, a, b, distances):
+    # Rows of a similarity table for the pairs (keys[a], keys[b]) of one task's tracks
+    category, number = keys[0][2:]
+    return pd.DataFrame({
+        'taskCategory': category,
+        'taskNo': number,
+        'participant_a': [keys[row][0] for row in a],
+        'session_a': [keys[row][1] for row in a],
+        'participant_b': [keys[row][0] for row in b],
+        'session_b': [keys[row][1] for row in b],
+        'distance': distances,
+    }, columns=SIMILARITY_COLUMNS)
+
+
+def _task_keys(keys):
+    # Track keys grouped by (taskCategory, taskNo), sorted
+    tasks = {}
+    for key in sorted(keys):
+        tasks.setdefault(key[2:], []).append(key)
+    return tasks
+
+
+def similarity_table(routes, metric='dtw', points=MATRIX_POINTS, workers=None):
+    """Distances between the routes (see track_routes) of all tracks of each task, one row per pair
+    of tracks, by participant and session: taskCategory, taskNo, participant_a, session_a,
+    participant_b, session_b, distance. A pair's distance depends on its two routes only (see
+    route_distances), so extend_similarity_table adds pairs that match a rebuild."""
+    tables = []
+    for keys in _task_keys(routes[points]).values():
+        keys, paths = task_paths(routes, keys, points, project=False)
+        a, b = np.triu_indices(len(keys), k=1)
+        tables.append(_pair_rows(keys, a, b, distance_matrix(paths, metric, workers)[a, b]))
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=SIMILARITY_COLUMNS)
+
+
+def extend_similarity_table(table, routes, new_keys, metric='dtw', points=MATRIX_POINTS):
+    """`table` (a similarity_table) with the pairs the tracks `new_keys` add: each new track against
+    the other tracks of its task in `routes` (see track_routes). Only those pairs are computed; the
+    rows already in `table` are kept as they are."""
+    new_keys = set(new_keys)
+    tasks = {key[2:] for key in new_keys}
+    tables = [table]
+    for keys in _task_keys([key for key in routes[points] if key[2:] in tasks]).values():
+        keys, paths = task_paths(routes, keys, points, project=False)
+        new = np.array([key in new_keys for key in keys], dtype=bool)
+        a, b = np.triu_indices(len(keys), k=1)
+        pick = new[a] | new[b]
+        distances = route_distances(paths[a[pick]], paths[b[pick]], metric)
+        tables.append(_pair_rows(keys, a[pick], b[pick], distances))
+    return pd.concat(tables, ignore_index=True)
+
+
+def square_matrix(table, keys):
+    """Symmetric distance matrix of one task's rows of a similarity_table, one row per track of `keys`."""
+    position = {key[:2]: row for row, key in enumerate(keys)}
+    a = np.array([position[pair] for pair in zip(table['participant_a'], table['session_a'])], dtype=np.intp)
+    b = np.array([position[pair] for pair in zip(table['participant_b'], table['session_b'])], dtype=np.intp)
+    matrix = np.zeros((len(keys), len(keys)))
+    matrix[a, b] = matrix[b, a] = table['distance'].to_numpy()
+    return matrix
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+    from smoothing import smooth_tracks, smoothed_view
+    from waypoint_table import DASHBOARD_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Pairwise route similarity of the participants of one task")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    parser.add_argument('--task', nargs=2, default=['nav', '1'], metavar=('CATEGORY', 'NUMBER'))
+    parser.add_argument('--metric', choices=sorted(METRICS), default='dtw')
+    parser.add_argument('--raw', action='store_true', help="compare the raw GPS fixes instead of the smoothed tracks")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    frame = ingest(args.source).waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+    frame = frame[(frame['taskCategory'] == args.task[0]) & (frame['taskNo'] == int(args.task[1]))]
+    if not args.raw:
+        frame = smoothed_view(frame.join(smooth_tracks(frame)))
+
+    start = time.perf_counter()
+    table = similarity_table(track_routes(frame, (MATRIX_POINTS,)), args.metric, workers=args.workers)
+    seconds = time.perf_counter() - start
+    keys, paths = task_routes(frame)
+    labels, matrix = track_labels(keys), square_matrix(table, keys)
+    print(f"{len(table)} pairs of {len(labels)} routes at {MATRIX_POINTS} points in {seconds:.2f} s "
+          f"({len(table) / max(seconds, 1e-9):,.0f} pairs/s)")
+
+    start, computed = time.perf_counter(), 0
+    for row, label in enumerate(labels):
+        others = np.flatnonzero(np.arange(len(labels)) != row)
+        closest, distances, pairs = nearest(paths[row], paths[others], 3, args.metric, matrix[row, others])
+        computed += pairs
+        if row < 10:
+            print(f"{label}: " + ', '.join(f"{labels[others[index]]} {distance:.1f} m"
+                                                 for index, distance in zip(closest, distances)))
+    seconds = time.perf_counter() - start
+    print(f"most similar routes of {len(labels)} tracks at {LOOKUP_POINTS} points in {seconds:.2f} s, "
+          f"{computed} of {len(labels) * (len(labels) - 1)} pairs computed")
@@ -0,0 +1,140 @@
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from metrics import EARTH_RADIUS, GROUP_KEYS, local_xy, sort_tracks
+
+# Level-of-detail for trajectories.
+#
+# Douglas-Peucker is run once per track with no tolerance. Every point gets
+# an importance: the perpendicular distance (in metres) at which DP would keep
+# it, capped by the importance of the split that produced its segment. Capping
+# makes the levels nested, so the simplification for ANY tolerance is simply
+# `importance >= tolerance`, and one float column on the waypoint table
+# replaces a separate copy of each track per level. End points are always kept.
+#
+# The map picks the tolerance that corresponds to about one screen pixel at
+# its zoom level; route metrics keep using the full-resolution track.
+
+# Zoom levels the dashboard offers; above the last one the full track is drawn
+LOD_ZOOMS = list(range(12, 19))
+
+# Simplification tolerance in screen pixels
+PIXEL_TOLERANCE = 1.0
+
+# Segments are not split further once their deviation drops below this (metres)
+MIN_TOLERANCE = 0.25
+
+
+def metres_per_pixel(zoom, latitude):
+    # Web Mercator ground resolution of a 256 px tile pyramid
+    return 2 * np.pi * EARTH_RADIUS * np.cos(np.radians(latitude)) / (256 * 2 ** zoom)
+
+
+def tolerance_for_zoom(zoom, latitude):
+    return PIXEL_TOLERANCE * metres_per_pixel(zoom, latitude)
+
+
+def _segment_distances(x, y, start, end):
+    # Distance of points start+1..end-1 to the segment start-end
+    px, py = x[start + 1:end], y[start + 1:end]
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return np.hypot(px - x[start], py - y[start])
+    t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length2, 0, 1)
+    return np.hypot(px - (x[start] + t * dx), py - (y[start] + t * dy))
+
+
+def track_importance(x, y):
+    """Nested Douglas-Peucker importance (metres) of each point of one projected track."""
+    n = len(x)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, parent = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(x, y, start, end)
+        split = int(np.argmax(distances))
+        distance = distances[split]
+        if distance < MIN_TOLERANCE:
+            continue
+        split += start + 1
+        importance[split] = min(distance, parent)
+        stack.append((start, split, importance[split]))
+        stack.append((split, end, importance[split]))
+    return importance
+
+
+def lod_importance(frame, keys=GROUP_KEYS):
+    """Importance of every row of `frame` (aligned with its index), computed per track."""
+    order, starts = sort_tracks(frame, keys)
+    lon = frame['longitude'].to_numpy(dtype=np.float64)[order]
+    lat = frame['latitude'].to_numpy(dtype=np.float64)[order]
+
+    # Local equirectangular projection around each track's mean latitude
+    ends = np.append(starts[1:], len(order))
+    importance = np.zeros(len(order))
+    for start, end in zip(starts, ends):
+        track_lat = lat[start:end]
+        valid = ~(np.isnan(lon[start:end]) | np.isnan(track_lat))
+        if not valid.any():
+            continue
+        x, y = local_xy(lon[start:end][valid], track_lat[valid], np.nanmean(track_lat))
+        values = np.zeros(end - start)
+        values[valid] = track_importance(x, y)
+        importance[start:end] = values
+
+    result = np.empty(len(order))
+    result[order] = importance
+    return pd.Series(result, index=frame.index, name='lod_importance')
+
+
+def simplify_for_zoom(frame, zoom):
+    """Rows of `frame` to draw at `zoom` (needs the lod_importance column)."""
+    if 'lod_importance' not in frame or zoom is None or zoom > LOD_ZOOMS[-1] or frame.empty:
+        return frame
+    tolerance = tolerance_for_zoom(zoom, frame['latitude'].mean())
+    return frame[frame['lod_importance'].to_numpy() >= tolerance]
+
+
+def lod_report(frame, zooms=LOD_ZOOMS):
+    """Points and GeoJSON coordinate payload kept at each zoom, against the full track."""
+    if 'lod_importance' not in frame:
+        frame = frame.assign(lod_importance=lod_importance(frame))
+
+    def payload(rows):
+        coords = np.round(rows[['longitude', 'latitude']].to_numpy(), 6).tolist()
+        return len(json.dumps(coords))
+
+    full_points, full_bytes = len(frame), payload(frame)
+    rows = []
+    for zoom in list(zooms) + [None]:
+        kept = simplify_for_zoom(frame, zoom) if zoom is not None else frame
+        kept_bytes = payload(kept)
+        rows.append({
+            'zoom': zoom if zoom is not None else 'full',
+            'tolerance_m': tolerance_for_zoom(zoom, frame['latitude'].mean()) if zoom is not None else 0.0,
+            'points': len(kept),
+            'points_pct': 100 * len(kept) / max(full_points, 1),
+            'payload_bytes': kept_bytes,
+            'payload_pct': 100 * kept_bytes / max(full_bytes, 1),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+
+    parser = argparse.ArgumentParser(description="Report trajectory level-of-detail point counts and payloads")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    args = parser.parse_args()
+
+    waypoints = ingest(args.source).waypoint_frame()
+    print(lod_report(waypoints).to_string(index=False))
@@ -0,0 +1,191 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import GROUP_KEYS, local_lonlat, local_xy, route_metrics, sort_tracks
+
+# Accuracy-aware smoothing of every track at once.
+#
+# Each track is filtered with a constant-velocity Kalman filter and then
+# smoothed backwards (Rauch-Tung-Striebel), in local metres. A fix is weighted
+# by its reported accuracy (measurement variance accuracy^2, never below
+# MIN_ACCURACY); fixes worse than MAX_ACCURACY, and fixes further than GATE
+# standard deviations from the prediction (jumps the reported accuracy does
+# not explain), are not used, and the smoother bridges them. Missing
+# accuracies (the -1 sentinel, NaN after waypoint_table) count as
+# DEFAULT_ACCURACY.
+#
+# East and north are filtered independently with the same noise, so their
+# covariances are identical and kept once. Tracks are not looped over: they
+# are ordered by length and step k of the filter updates the k-th row of every
+# track that long in one array operation (on contiguous slices), so the Python
+# loop runs once per row of the longest track, not once per waypoint.
+#
+# The smoothed positions are extra columns next to the raw ones; see
+# smoothed_view for a frame that uses them in place of the raw positions.
+
+# Bump when the smoothing changes so cached smoothed metrics are rebuilt
+SMOOTHING_VERSION = 1
+
+MIN_ACCURACY = 3.0        # metres; GPS does not get better than this on a phone
+DEFAULT_ACCURACY = 10.0   # metres, for fixes without a reported accuracy
+MAX_ACCURACY = 30.0       # metres; worse fixes are not used
+GATE = 4.0                # standard deviations
+ACCELERATION_NOISE = 1.0  # m/s^2, how quickly a walker changes velocity
+INITIAL_SPEED = 2.0       # m/s, spread of the unknown velocity at a track's first fix
+
+# Position variance (m^2) standing for "unknown"; larger than any distance on Earth squared
+NO_CONFIDENCE = 1e14
+
+SMOOTHED_COLUMNS = ['smooth_longitude', 'smooth_latitude', 'smooth_speed', 'gps_used']
+
+
+def _measurement_variance(accuracy):
+    accuracy = np.where(np.isnan(accuracy), DEFAULT_ACCURACY, accuracy)
+    return np.maximum(accuracy, MIN_ACCURACY) ** 2
+
+
+def smooth_tracks(frame, keys=GROUP_KEYS):
+    """Smoothed position (degrees) and speed (m/s) of every row of `frame`, and whether its fix
+    was used, computed per track (aligned with the frame's index). Needs the key columns,
+    timestamp, longitude, latitude and accuracy."""
+    order, starts = sort_tracks(frame, keys)
+    lon = frame['longitude'].to_numpy(dtype=np.float64)[order]
+    lat = frame['latitude'].to_numpy(dtype=np.float64)[order]
+    seconds = frame['timestamp'].to_numpy().astype('datetime64[ms]').astype(np.int64)[order] / 1000
+    variance = _measurement_variance(frame['accuracy'].to_numpy(dtype=np.float64)[order])
+    counts = np.diff(np.append(starts, len(order)))
+    track = np.repeat(np.arange(len(starts)), counts)
+
+    # Local metres around each track's first position (fixes without a position are never used)
+    origin = np.nan_to_num(lat[starts], nan=0.0)[track] if len(order) else lat
+    x, y = local_xy(lon, lat, origin)
+    located = ~(np.isnan(x) | np.isnan(y))
+    usable = located & (variance <= MAX_ACCURACY ** 2)
+    x, y = np.where(located, x, 0.0), np.where(located, y, 0.0)
+    dt = np.zeros(len(order))
+    if len(order) > 1:
+        dt[1:] = np.maximum(np.diff(seconds), 0.0)
+    dt[starts] = 0.0
+
+    # Step-major layout: the k-th rows of all tracks at least k+1 rows long, longest
+    # tracks first, are one contiguous slice, and the same track keeps its position
+    # in the slice of every step
+    by_length = np.argsort(-counts, kind='stable')
+    rank = np.empty(len(starts), dtype=np.intp)
+    rank[by_length] = np.arange(len(starts))
+    step_order = np.lexsort((rank[track], np.arange(len(order)) - starts[track]))
+    active = np.searchsorted(-counts[by_length], -np.arange(counts.max() if len(counts) else 0), side='left')
+    offsets = np.concatenate([[0], np.cumsum(active)]).astype(np.intp)
+    x, y, dt, variance, usable = x[step_order], y[step_order], dt[step_order], variance[step_order], usable[step_order]
+
+    # Filtered state (position, velocity per axis) and covariance, shared by both axes,
+    # before (pred_) and after each update
+    px, vx, py, vy = np.zeros((4, len(order)))
+    pp, pv, vv = np.zeros((3, len(order)))
+    pred_pp, pred_pv, pred_vv = np.zeros((3, len(order)))
+    used = np.zeros(len(order), dtype=bool)
+    q = ACCELERATION_NOISE ** 2
+
+    # Tracks start at their first position, with no confidence in it unless the fix is usable
+    first = slice(0, active[0] if len(active) else 0)
+    px[first], py[first] = x[first], y[first]
+    pred_pp[first] = np.where(usable[first], variance[first], NO_CONFIDENCE)
+    pred_vv[first] = INITIAL_SPEED ** 2
+    for k in range(len(active)):
+        rows = slice(offsets[k], offsets[k + 1])
+        if k:
+            previous = slice(offsets[k - 1], offsets[k - 1] + active[k])
+            step = dt[rows]
+            px[rows] = px[previous] + step * vx[previous]
+            py[rows] = py[previous] + step * vy[previous]
+            vx[rows], vy[rows] = vx[previous], vy[previous]
+            pred_pp[rows] = pp[previous] + step * (2 * pv[previous] + step * vv[previous]) + q * step ** 3 / 3
+            pred_pv[rows] = pv[previous] + step * vv[previous] + q * step ** 2 / 2
+            pred_vv[rows] = vv[previous] + q * step
+
+        # Update with the fixes that are usable and consistent with the prediction
+        s = pred_pp[rows] + variance[rows]
+        ix, iy = x[rows] - px[rows], y[rows] - py[rows]
+        update = usable[rows] & ((ix * ix + iy * iy) <= GATE ** 2 * s)
+        gain_p = np.where(update, pred_pp[rows] / s, 0.0)
+        gain_v = np.where(update, pred_pv[rows] / s, 0.0)
+        px[rows] += gain_p * ix
+        py[rows] += gain_p * iy
+        vx[rows] += gain_v * ix
+        vy[rows] += gain_v * iy
+        pp[rows] = (1 - gain_p) * pred_pp[rows]
+        pv[rows] = (1 - gain_p) * pred_pv[rows]
+        vv[rows] = pred_vv[rows] - gain_v * pred_pv[rows]
+        used[rows] = update
+
+    # Backwards pass; the last row of each track keeps its filtered state
+    sx, svx, sy, svy = px.copy(), vx.copy(), py.copy(), vy.copy()
+    for k in range(len(active) - 2, -1, -1):
+        rows = slice(offsets[k], offsets[k] + active[k + 1])
+        following = slice(offsets[k + 1], offsets[k + 2])
+        step = dt[following]
+        # Gain P F' inv(P_pred) of the shared 2x2 covariance
+        a, b, c, d = pp[rows] + step * pv[rows], pv[rows], pv[rows] + step * vv[rows], vv[rows]
+        e, f, h = pred_pp[following], pred_pv[following], pred_vv[following]
+        det = e * h - f * f
+        g11, g12 = (a * h - b * f) / det, (b * e - a * f) / det
+        g21, g22 = (c * h - d * f) / det, (d * e - c * f) / det
+        dpx, dvx = sx[following] - (px[rows] + step * vx[rows]), svx[following] - vx[rows]
+        dpy, dvy = sy[following] - (py[rows] + step * vy[rows]), svy[following] - vy[rows]
+        sx[rows] = px[rows] + g11 * dpx + g12 * dvx
+        svx[rows] = vx[rows] + g21 * dpx + g22 * dvx
+        sy[rows] = py[rows] + g11 * dpy + g12 * dvy
+        svy[rows] = vy[rows] + g21 * dpy + g22 * dvy
+
+    # Back to sorted row order
+    unsorted = np.empty(len(order), dtype=np.intp)
+    unsorted[step_order] = np.arange(len(order))
+    sx, sy, speed = sx[unsorted], sy[unsorted], np.hypot(svx, svy)[unsorted]
+    used, usable = used[unsorted], usable[unsorted]
+
+    smooth_lon, smooth_lat = local_lonlat(sx, sy, origin)
+    # Tracks without a single usable fix have nothing to smooth towards
+    has_fix = np.bincount(track, weights=usable, minlength=len(starts)) > 0
+    smooth_lon = np.where(has_fix[track], smooth_lon, lon)
+    smooth_lat = np.where(has_fix[track], smooth_lat, lat)
+
+    result = pd.DataFrame(index=frame.index)
+    for name, values in [('smooth_longitude', smooth_lon), ('smooth_latitude', smooth_lat),
+                         ('smooth_speed', speed.astype(np.float32)), ('gps_used', used)]:
+        column = np.empty(len(order), dtype=values.dtype)
+        column[order] = values
+        result[name] = column
+    return result
+
+
+def smoothed_view(frame):
+    """`frame` with the smoothed positions (and their LOD importance, if there) in place of the raw ones."""
+    columns = {'smooth_longitude': 'longitude', 'smooth_latitude': 'latitude',
+               'smooth_lod_importance': 'lod_importance'}
+    present = {name: raw for name, raw in columns.items() if name in frame}
+    return frame.drop(columns=list(present.values())).rename(columns=present)
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+    from waypoint_table import DASHBOARD_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Smooth every track and compare route metrics before and after")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    args = parser.parse_args()
+
+    frame = ingest(args.source).waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+    start = time.perf_counter()
+    smoothed = smooth_tracks(frame)
+    seconds = time.perf_counter() - start
+    frame = frame.join(smoothed)
+    raw = route_metrics(frame)
+    smooth = route_metrics(smoothed_view(frame))
+    comparison = raw[GROUP_KEYS + ['Route_length']].assign(Smoothed_length=smooth['Route_length'])
+    comparison['change_pct'] = 100 * (comparison['Smoothed_length'] / comparison['Route_length'] - 1)
+    print(comparison.to_string(index=False, float_format='{:.3f}'.format))
+    print(f"{(~smoothed['gps_used']).sum()} of {len(frame)} fixes not used; "
+          f"smoothed in {seconds:.2f} s ({len(frame) / max(seconds, 1e-9):,.0f} waypoints/s)")
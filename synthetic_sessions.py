@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import local_lonlat, local_xy
+from simplify import metres_per_pixel
+
+# Synthetic GeoGami session exports for benchmarks.
+#
+# Every generated file has the layout of a real export: a `waypoints` array
+# (position.coords, mapViewport, interaction counts, taskNo/taskCategory)
+# followed by `events` (INIT_GAME, INIT_TASK, WAYPOINT_REACHED, map clicks,
+# answers with clickPosition, FINISHED_GAME) and the header fields. All
+# participants play the same game, so task ids and the theme-object target
+# polygons are shared between sessions. Tracks are random walks around the
+# study area with walking speed, stops, GPS noise, occasional bad fixes and
+# the -1 heading/speed sentinels of real devices. Waypoints are written in
+# chunks, so a single session can hold millions of them.
+
+CENTER = (7.6261, 51.9606)  # lon, lat of the study area
+START = pd.Timestamp('2024-09-02T10:00:00Z')
+GAME_ID = '66d5955ea03941001c0e3bf4'
+
+# (taskCategory, taskNo, task type) of the synthetic game
+GAME_TASKS = [
+    ('nav', 1, 'nav-flag'),
+    ('nav', 2, 'nav-arrow'),
+    ('nav', 3, 'nav-photo'),
+    ('nav', 4, 'nav-text'),
+    ('theme', 5, 'theme-object'),
+    ('theme', 6, 'theme-direction'),
+    ('theme', 7, 'theme-object'),
+    ('theme', 8, 'theme-loc'),
+]
+
+# Share of object-localization clicks that land inside the target
+HIT_RATE = 0.7
+
+CHUNK_SIZE = 10000
+
+
+def _object_id(*parts):
+    return hashlib.sha1('/'.join(str(part) for part in parts).encode()).hexdigest()[:24]
+
+
+def _iso(timestamps):
+    return np.datetime_as_string(timestamps.astype('datetime64[ms]'), unit='ms', timezone='UTC')
+
+
+def game_tasks(game=GAME_ID):
+    """Task documents of the synthetic game, with a rectangular target polygon per theme-object task."""
+    rng = np.random.default_rng(int(_object_id(game), 16) % 2 ** 32)
+    tasks = []
+    for category, number, task_type in GAME_TASKS:
+        task = {'_id': _object_id(game, number), 'name': f'Tasktypes.{task_type}', 'type': task_type,
+                'category': category, 'question': {}, 'answer': {'type': 'MAP_POINT'}}
+        if task_type == 'theme-object':
+            x, y = local_xy(*CENTER, CENTER[1])
+            x, y = x + rng.uniform(-400, 400), y + rng.uniform(-400, 400)
+            width, height = rng.uniform(20, 60, 2)
+            lon, lat = local_lonlat(np.array([x, x + width, x + width, x, x]),
+                                    np.array([y, y, y + height, y + height, y]), CENTER[1])
+            task['question'] = {'type': 'MAP_FEATURE_PHOTO', 'geometry': {
+                'type': 'FeatureCollection',
+                'features': [{'id': _object_id(game, number, 'target'), 'type': 'Feature', 'geometry': {
+                    'type': 'Polygon', 'coordinates': [np.column_stack([lon, lat]).tolist()]}}],
+            }}
+            task['evaluate'] = 'evalPointInPolygon'
+        tasks.append(task)
+    return tasks
+
+
+def _walk(rng, n):
+    # Walking track in local metres: heading random walk, stops, GPS noise
+    dt = rng.uniform(0.8, 2.2, n)
+    speed = np.clip(rng.normal(1.3, 0.25, n), 0.2, None)
+    for start in rng.integers(0, n, max(n // 200, 1)):
+        speed[start:start + rng.integers(5, 30)] = 0.0
+    heading = np.mod(rng.uniform(0, 360) + np.cumsum(rng.normal(0, 8, n)), 360)
+    x = np.cumsum(speed * dt * np.sin(np.radians(heading)))
+    y = np.cumsum(speed * dt * np.cos(np.radians(heading)))
+    accuracy = rng.lognormal(np.log(5), 0.4, n)
+    bad = rng.random(n) < 0.01
+    accuracy[bad] = rng.uniform(30, 80, bad.sum())
+    # Small jitter on good fixes, jumps of up to the reported accuracy on bad ones
+    noise = np.where(bad, accuracy / 2, accuracy / 20)
+    x += rng.normal(0, noise)
+    y += rng.normal(0, noise)
+    # Devices report -1 heading and speed while standing still
+    heading = np.where(speed == 0, -1.0, heading)
+    speed = np.where(speed == 0, -1.0, speed)
+    return np.cumsum(dt), x, y, speed, heading, accuracy
+
+
+def _click(rng, target, hit):
+    # A click inside the target rectangle, or 10-80 m beyond its corners
+    ring = np.array(target['features'][0]['geometry']['coordinates'][0])
+    x, y = local_xy(ring[:, 0], ring[:, 1], CENTER[1])
+    if hit:
+        click_x, click_y = rng.uniform(x.min(), x.max()), rng.uniform(y.min(), y.max())
+    else:
+        angle = rng.uniform(0, 2 * np.pi)
+        distance = np.hypot(np.ptp(x), np.ptp(y)) / 2 + rng.uniform(10, 80)
+        click_x, click_y = x.mean() + distance * np.cos(angle), y.mean() + distance * np.sin(angle)
+    lon, lat = local_lonlat(click_x, click_y, CENTER[1])
+    return float(lon), float(lat)
+
+
+def generate_session(participant, n_waypoints, seed=0, game=GAME_ID, start=START):
+    """(header, waypoint columns, events) of one synthetic session."""
+    rng = np.random.default_rng(seed)
+    tasks = game_tasks(game)
+    seconds, x, y, speed, heading, accuracy = _walk(rng, n_waypoints)
+    start = start + pd.Timedelta(days=int(rng.integers(0, 30)), minutes=int(rng.integers(0, 600)))
+    timestamps = np.datetime64(start.tz_localize(None), 'ms') + (seconds * 1000).astype('timedelta64[ms]')
+    origin_x, origin_y = local_xy(*CENTER, CENTER[1])
+    lon, lat = local_lonlat(x + origin_x + rng.uniform(-300, 300), y + origin_y + rng.uniform(-300, 300), CENTER[1])
+
+    # Contiguous task blocks of random length
+    shares = rng.dirichlet(np.full(len(tasks), 2.0))
+    bounds = np.concatenate([[0], np.round(np.cumsum(shares) * n_waypoints).astype(int)])
+    bounds[-1] = n_waypoints
+    task_of_row = np.repeat(np.arange(len(tasks)), np.diff(bounds))
+
+    # Interaction counts accumulate within a task
+    pans = np.cumsum(rng.random(n_waypoints) < 0.02)
+    zooms = np.cumsum(rng.random(n_waypoints) < 0.01)
+    rotation = np.cumsum(np.abs(rng.normal(0, 2, n_waypoints)) * (rng.random(n_waypoints) < 0.05))
+    task_start = bounds[:-1][task_of_row]
+    zoom = np.clip(16 + np.cumsum(rng.normal(0, 0.05, n_waypoints)), 13, 19)
+    half_width = metres_per_pixel(zoom, lat) * 200 / (111320 * np.cos(np.radians(lat)))
+    half_height = metres_per_pixel(zoom, lat) * 350 / 110540
+
+    waypoints = {
+        'timestamp': _iso(timestamps),
+        'longitude': lon, 'latitude': lat,
+        'altitude': 56 + rng.normal(0, 3, n_waypoints),
+        'speed': speed, 'heading': heading, 'accuracy': accuracy,
+        'taskNo': np.array([task[1] for task in GAME_TASKS])[task_of_row],
+        'taskCategory': np.array([task[0] for task in GAME_TASKS])[task_of_row],
+        'panCount': pans - pans[task_start], 'zoomCount': zooms - zooms[task_start],
+        'rotation': rotation - rotation[task_start],
+        'compassHeading': np.mod(np.where(heading < 0, 0, heading) + rng.normal(0, 15, n_waypoints), 360),
+        'zoom': zoom,
+        'west': lon - half_width, 'south': lat - half_height,
+        'east': lon + half_width, 'north': lat + half_height,
+    }
+
+    def event(kind, row, task=None, **fields):
+        row = min(row, n_waypoints - 1)
+        record = {
+            'type': kind,
+            'timestamp': str(waypoints['timestamp'][row]),
+            'position': {'timestamp': int(timestamps[row].astype('int64')), 'coords': {
+                'latitude': float(lat[row]), 'longitude': float(lon[row]),
+                'accuracy': float(accuracy[row]), 'heading': float(heading[row]), 'speed': float(speed[row])}},
+            'mapViewport': {'zoom': float(zoom[row])},
+            'compassHeading': float(waypoints['compassHeading'][row]),
+            'interaction': {'panCount': int(waypoints['panCount'][row]), 'zoomCount': int(waypoints['zoomCount'][row]),
+                            'rotationCount': float(waypoints['rotation'][row])},
+        }
+        if task is not None:
+            record['task'] = task
+        record.update(fields)
+        return record
+
+    events = [event('INIT_GAME', 0)]
+    for task, first, last in zip(tasks, bounds[:-1], bounds[1:]):
+        last = max(first, last - 1)
+        events.append(event('INIT_TASK', first, task))
+        if task['category'] == 'nav':
+            events.append(event('WAYPOINT_REACHED', last, task))
+            continue
+        target = task['question'].get('geometry')
+        for attempt in range(int(rng.integers(1, 4))):
+            hit = bool(rng.random() < HIT_RATE) if target else bool(rng.random() < 0.5)
+            if target:
+                click_lon, click_lat = _click(rng, target, hit)
+            else:
+                click_lon, click_lat = float(lon[last]) + rng.normal(0, 3e-4), float(lat[last]) + rng.normal(0, 2e-4)
+            events.append(event('ON_MAP_CLICKED', last, task,
+                                clickPosition={'latitude': click_lat, 'longitude': click_lon},
+                                answer={'clickPosition': [click_lon, click_lat], 'correct': hit}))
+        events.append(event('ON_OK_CLICKED', last, task, correct=hit,
+                            answer={'clickPosition': [click_lon, click_lat], 'correct': hit}))
+    events.append(event('FINISHED_GAME', n_waypoints - 1))
+
+    header = {
+        'players': [participant],
+        '_id': _object_id(game, participant, seed),
+        'game': game,
+        'name': f'WayFinding_{participant}',
+        'start': str(waypoints['timestamp'][0]) if n_waypoints else start.isoformat(),
+        'end': str(waypoints['timestamp'][-1]) if n_waypoints else start.isoformat(),
+        'playersCount': 1,
+    }
+    return header, waypoints, events
+
+
+def _waypoint_records(waypoints, start, stop):
+    columns = {name: values[start:stop].tolist() for name, values in waypoints.items()}
+    for i in range(stop - start):
+        yield {
+            'timestamp': columns['timestamp'][i],
+            'position': {'coords': {
+                'latitude': columns['latitude'][i], 'longitude': columns['longitude'][i],
+                'altitude': columns['altitude'][i], 'speed': columns['speed'][i],
+                'heading': columns['heading'][i], 'accuracy': columns['accuracy'][i]}},
+            'mapViewport': {
+                'bounds': {'_sw': {'lng': columns['west'][i], 'lat': columns['south'][i]},
+                           '_ne': {'lng': columns['east'][i], 'lat': columns['north'][i]}},
+                'zoom': columns['zoom'][i]},
+            'compassHeading': columns['compassHeading'][i],
+            'interaction': {'panCount': columns['panCount'][i], 'zoomCount': columns['zoomCount'][i],
+                            'rotation': columns['rotation'][i]},
+            'taskNo': columns['taskNo'][i],
+            'taskCategory': columns['taskCategory'][i],
+        }
+
+
+def write_session(path, header, waypoints, events):
+    """Write one session in the export layout, streaming the waypoints in chunks."""
+    n = len(waypoints['timestamp'])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('{"waypoints": [')
+        for start in range(0, n, CHUNK_SIZE):
+            if start:
+                f.write(', ')
+            f.write(', '.join(json.dumps(record) for record in _waypoint_records(waypoints, start, min(start + CHUNK_SIZE, n))))
+        f.write('], "events": ')
+        f.write(json.dumps(events))
+        for key, value in header.items():
+            f.write(f', {json.dumps(key)}: {json.dumps(value)}')
+        f.write('}')
+    os.replace(tmp_path, path)
+
+
+def write_sessions(directory, participants, waypoints, seed=0):
+    """Write `participants` sessions sharing `waypoints` in total; returns the file paths.
+
+    Existing files with the same parameters are reused."""
+    os.makedirs(directory, exist_ok=True)
+    per_session = max(waypoints // participants, len(GAME_TASKS))
+    paths = []
+    for index in range(participants):
+        participant = f'P{index:04d}'
+        path = os.path.join(directory, f'{participant}-{per_session}-{seed}.json')
+        if not os.path.exists(path):
+            write_session(path, *generate_session(participant, per_session, seed=seed * 100003 + index))
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic GeoGami session exports")
+    parser.add_argument('directory')
+    parser.add_argument('--participants', type=int, default=10)
+    parser.add_argument('--waypoints', type=int, default=10000, help="total waypoints over all sessions")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = write_sessions(args.directory, args.participants, args.waypoints, args.seed)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"wrote {len(paths)} sessions ({size / 1e6:.1f} MB) in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,167 @@
+from bisect import bisect_right
+from collections import Counter
+
+import numpy as np
+
+from metrics import GROUP_KEYS, sort_tracks
+from waypoint_table import concat_frames
+
+# (participant, session_id, taskCategory, taskNo) -> contiguous row slice.
+#
+# The waypoint table is sorted once by participant, session, task and
+# timestamp, so every track occupies one contiguous block of rows. Looking a
+# track up is a dict lookup plus an iloc slice (a view, no copy) instead of a
+# boolean mask over all waypoints.
+#
+# New sessions are added with `extend`, which appends their tracks as one more
+# sorted block instead of re-sorting the table; blocks are kept apart, so that
+# costs only the new rows. Tracks are keyed by session, so a new session only
+# ever adds tracks and the indexed rows never move.
+#
+# The timestamps are also kept as int64 arrays (ms) per block, ascending within every
+# track, so the rows of a time window are found by binary search (`window`).
+
+# Characters of the session id shown next to a participant with several sessions
+SESSION_LABEL = 8
+
+
+class TaskIndex:
+
+    def __init__(self, frame, keys=GROUP_KEYS):
+        self.keys = keys
+        order, starts = sort_tracks(frame, keys)
+        block = frame.iloc[order].reset_index(drop=True)
+        self.blocks, self.block_times, self.offsets = [block], [_times(block)], [0]
+        self.slices = _block_slices(block, starts, keys)
+        self.session_participants = _session_participants(self.slices)
+
+    def extend(self, frame):
+        """A new TaskIndex with the tracks of `frame` (e.g. the rows of new sessions) appended after
+        the indexed ones as a block of their own; returns (index, keys of `frame`)."""
+        keys = track_keys(frame, self.keys)
+        indexed = [key for key in keys if key in self.slices]
+        if indexed:
+            raise ValueError(f"tracks already indexed: {indexed}")
+        order, starts = sort_tracks(frame, self.keys)
+        block = frame.iloc[order].reset_index(drop=True)
+        rows = self.offsets[-1] + len(self.blocks[-1])
+        added = _block_slices(block, starts, self.keys, offset=rows)
+        index = TaskIndex.__new__(TaskIndex)
+        index.keys = self.keys
+        index.blocks = self.blocks + [block]
+        index.block_times = self.block_times + [_times(block)]
+        index.offsets = self.offsets + [rows]
+        index.slices = self.slices | added
+        index.session_participants = self.session_participants | _session_participants(added)
+        return index, keys
+
+    @property
+    def frame(self):
+        """All rows, in row order; joins the blocks added by `extend` (a copy) when there are any."""
+        return self.blocks[0] if len(self.blocks) == 1 else concat_frames(self.blocks)
+
+    def _locate(self, rows):
+        # (block number, rows within that block) of a track's slice
+        block = bisect_right(self.offsets, rows.start) - 1
+        return block, slice(rows.start - self.offsets[block], rows.stop - self.offsets[block])
+
+    def key(self, session, category, number):
+        """Key of the track of one session on one task, None when that session has no such track."""
+        key = (self.session_participants.get(session), session, category, number)
+        return key if key in self.slices else None
+
+    def track(self, key):
+        rows = self.slices.get(key)
+        if rows is None:
+            return self.blocks[0].iloc[0:0]
+        block, rows = self._locate(rows)
+        return self.blocks[block].iloc[rows]
+
+    def window(self, key, start=0, end=np.inf):
+        """Rows of one track from `start` to `end` seconds after its first fix, as a slice of the
+        track's rows (track.iloc[rows])."""
+        rows = self.slices.get(key)
+        if rows is None:
+            return slice(0, 0)
+        block, rows = self._locate(rows)
+        times = self.block_times[block][rows]
+        bounds = times[0] + np.array([start, end], dtype=np.float64) * 1000
+        first = int(np.searchsorted(times, bounds[0], side='left'))
+        return slice(first, max(int(np.searchsorted(times, bounds[1], side='right')), first))
+
+    def duration(self, key):
+        """Seconds from the first to the last fix of one track."""
+        rows = self.slices.get(key)
+        if rows is None:
+            return 0.0
+        block, rows = self._locate(rows)
+        times = self.block_times[block]
+        return float(times[rows.stop - 1] - times[rows.start]) / 1000
+
+    def tracks(self, keys):
+        """Rows of several tracks, one track after the other."""
+        # One take per run of tracks in the same block, so only whole blocks are concatenated
+        runs = []
+        for key in keys:
+            if key in self.slices:
+                block, rows = self._locate(self.slices[key])
+                if not runs or runs[-1][0] != block:
+                    runs.append((block, []))
+                runs[-1][1].append(np.arange(rows.start, rows.stop))
+        return concat_frames([self.blocks[block].iloc[np.concatenate(rows)] for block, rows in runs]
+                             or [self.track(None)])
+
+    def tasks(self):
+        """Sorted (taskCategory, taskNo) pairs present in the data."""
+        return sorted({(category, number) for _, _, category, number in self.slices})
+
+    def task_tracks(self, category, number):
+        """Keys of the tracks of one task, by participant and session."""
+        return sorted(key for key in self.slices if key[2:] == (category, number))
+
+    def participants(self, category, number):
+        return sorted({participant for participant, _, _, _ in self.task_tracks(category, number)})
+
+    def __contains__(self, key):
+        return key in self.slices
+
+    def __len__(self):
+        return len(self.slices)
+
+
+def track_keys(frame, keys=GROUP_KEYS):
+    """(participant, session_id, taskCategory, taskNo) of the tracks with rows in `frame`."""
+    first_rows = frame[keys].drop_duplicates().itertuples(index=False, name=None)
+    return [tuple(_plain(value) for value in key) for key in first_rows]
+
+
+def track_labels(keys):
+    """Display names of the tracks `keys`: the participant, followed by the start of the session id
+    where the participant has several sessions on the same task."""
+    tasks = Counter((participant, category, number) for participant, _, category, number in keys)
+    return [f'{participant} ({session[:SESSION_LABEL]})' if tasks[(participant, category, number)] > 1
+            else str(participant) for participant, session, category, number in keys]
+
+
+def _block_slices(frame, starts, keys, offset=0):
+    # Slices of the tracks of a sorted block starting at row `offset` of the table
+    ends = np.append(starts[1:], len(frame))
+    first_rows = frame.iloc[starts][keys].itertuples(index=False, name=None)
+    return {
+        tuple(_plain(value) for value in key): slice(int(start) + offset, int(end) + offset)
+        for key, start, end in zip(first_rows, starts, ends)
+    }
+
+
+def _session_participants(slices):
+    # session_id -> participant; a session belongs to one participant
+    return {session: participant for participant, session, _, _ in slices}
+
+
+def _times(frame):
+    return frame['timestamp'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+
+def _plain(value):
+    # numpy scalars -> Python values so keys match what Dash callbacks send
+    return value.item() if isinstance(value, np.generic) else value
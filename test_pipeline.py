@@ -0,0 +1,477 @@
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import wayfinding
+from density_grid import DensityGrid, task_scope
+from event_index import EVENT_KEYS, EventIndex
+from map_render import COORDINATE_PRECISION, LRUCache, cached_density_map, cached_map
+from metrics import GEOD, GROUP_KEYS, local_lonlat, local_xy, route_metrics
+from object_scoring import CLICK_EVENTS, OBJECT_TASK, accuracy_table, score_clicks
+from playback import playback_update
+from segmentation import detect_segments
+from session_loader import load_session
+from session_store import SessionStore
+from similarity import (lower_bounds, nearest, pair_distances, similarity_table, square_matrix, task_paths,
+                        track_routes)
+from smoothing import smooth_tracks, smoothed_view
+from synthetic_sessions import CENTER, game_tasks, generate_session, write_session
+from task_index import TaskIndex, track_labels
+from waypoint_index import WaypointIndex
+from waypoint_table import DASHBOARD_COLUMNS
+from wayfinding import DashboardData, create_app
+
+# Checks of the pipeline's vectorized pieces against straightforward reference
+# computations, on synthetic sessions (see synthetic_sessions.py) and small
+# hand-built tracks, and of the dashboard server adding sessions. Run with
+# `python -m pytest -q` (conftest.py keeps the caches out of the working copy);
+# benchmark.py times the same pieces.
+
+
+@pytest.fixture(scope='module')
+def session_paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('sessions')
+    paths = []
+    for index, participant in enumerate(['P0000', 'P0001', 'P0002', 'P0001', 'P0003']):
+        path = str(directory / f'{participant}-{index}.json')
+        write_session(path, *generate_session(participant, 400, seed=index))
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture(scope='module')
+def sessions(session_paths):
+    return [load_session(path) for path in session_paths]
+
+
+def _track(legs, start=CENTER, participant='P', session='s', task=('nav', 1), noise=0.0, seed=0):
+    # One track at 1 Hz from (seconds, east m/s, north m/s) legs, in the compact dashboard columns;
+    # returns (frame, true x, true y) in local metres around `start`
+    rng = np.random.default_rng(seed)
+    east = np.concatenate([np.full(seconds, vx, dtype=np.float64) for seconds, vx, _ in legs])
+    north = np.concatenate([np.full(seconds, vy, dtype=np.float64) for seconds, _, vy in legs])
+    x, y = np.concatenate([[0.0], np.cumsum(east)]), np.concatenate([[0.0], np.cumsum(north)])
+    # Devices report the heading of the walking direction, none while standing (NaN once compact)
+    moving = np.hypot(east, north) > 0
+    heading = np.where(moving, np.mod(np.degrees(np.arctan2(east, north)), 360), np.nan)
+    heading = np.concatenate([heading[:1], heading])
+    origin_x, origin_y = local_xy(*start, start[1])
+    lon, lat = local_lonlat(origin_x + x + rng.normal(0, noise, len(x)),
+                            origin_y + y + rng.normal(0, noise, len(y)), start[1])
+    frame = pd.DataFrame({
+        'participant': participant, 'session_id': session, 'taskCategory': task[0], 'taskNo': task[1],
+        'timestamp': pd.Timestamp('2024-09-02T10:00:00') + pd.to_timedelta(np.arange(len(x)), unit='s'),
+        'longitude': lon, 'latitude': lat, 'accuracy': max(noise, 3.0),
+        'heading': heading, 'speed': np.nan, 'compassHeading': 0.0,
+    })
+    return frame, x, y
+
+
+# Streaming loader
+
+
+def test_streaming_loader_matches_json_load(session_paths, sessions):
+    with open(session_paths[0], 'r') as file:
+        document = json.load(file)
+    session = sessions[0]
+    waypoints = document['waypoints']
+    assert len(session) == len(waypoints)
+    assert session.meta['players'] == document['players'] and session.meta['_id'] == document['_id']
+
+    coords = [waypoint['position']['coords'] for waypoint in waypoints]
+    for column in ['latitude', 'longitude', 'speed', 'heading', 'accuracy']:
+        assert np.array_equal(session.waypoints[column], [point[column] for point in coords])
+    assert np.array_equal(session.waypoints['viewport_west'],
+                          [waypoint['mapViewport']['bounds']['_sw']['lng'] for waypoint in waypoints])
+    assert np.array_equal(session.waypoints['panCount'],
+                          [waypoint['interaction']['panCount'] for waypoint in waypoints])
+    assert list(session.waypoints['taskCategory']) == [waypoint['taskCategory'] for waypoint in waypoints]
+    timestamps = pd.to_datetime([waypoint['timestamp'] for waypoint in waypoints], utc=True).tz_localize(None)
+    assert np.array_equal(session.waypoints['timestamp'], timestamps.to_numpy().astype('datetime64[ms]'))
+
+    events = document['events']
+    assert list(session.events['type']) == [event['type'] for event in events]
+    # Clicks carry the position as an object, answers as a [lon, lat] array
+    clicks = [event['clickPosition']['latitude'] if 'clickPosition' in event
+              else event['answer']['clickPosition'][1] if 'answer' in event else np.nan for event in events]
+    assert np.allclose(session.events['click_latitude'], clicks, equal_nan=True)
+
+
+# Geodesic route metrics
+
+
+def test_route_metrics_match_geodesic_sums():
+    rng = np.random.default_rng(1)
+    first = _track([(120, 1.2, 0.3), (60, -0.4, 1.0)], participant='A')[0]
+    second = _track([(90, 0.0, -1.5)], participant='B', session='t')[0]
+    frame = pd.concat([first, second], ignore_index=True)
+    metrics = route_metrics(frame.iloc[rng.permutation(len(frame))])
+
+    assert list(metrics['participant']) == ['A', 'B']
+    for track, row in zip([first, second], metrics.itertuples()):
+        lon, lat = track['longitude'].to_numpy(), track['latitude'].to_numpy()
+        length = GEOD.inv(lon[:-1], lat[:-1], lon[1:], lat[1:])[2].sum()
+        straight = GEOD.inv(lon[0], lat[0], lon[-1], lat[-1])[2]
+        seconds = len(track) - 1
+        assert row.points == len(track)
+        assert row.Route_length == pytest.approx(length / 1000, rel=1e-9)
+        assert row.Straight_line == pytest.approx(straight / 1000, rel=1e-9)
+        assert row.Duration == pytest.approx(seconds / 60)
+        assert row.Mean_speed == pytest.approx(length / seconds, rel=1e-9)
+        assert row.Tortuosity == pytest.approx(length / straight, rel=1e-9)
+    # Local metres and the ellipsoid agree to well under a percent at this scale
+    assert metrics['Route_length'].iloc[1] == pytest.approx(0.135, rel=5e-3)
+
+
+# Kalman filter and RTS smoother
+
+
+def test_smoothing_reduces_noise_and_bridges_jumps():
+    frame, x, y = _track([(300, 1.3, 0.2), (200, 0.1, -1.2)], noise=5.0, seed=3)
+    # A fix 200 m off with a good reported accuracy: a jump the gate has to reject
+    frame.loc[250, 'longitude'] += 200 / (111320 * np.cos(np.radians(CENTER[1])))
+    frame.loc[250, 'accuracy'] = 5.0
+    smoothed = smooth_tracks(frame)
+
+    origin_x, origin_y = local_xy(*CENTER, CENTER[1])
+
+    def error(lon, lat):
+        east, north = local_xy(lon, lat, CENTER[1])
+        return np.hypot(east - origin_x - x, north - origin_y - y)
+
+    raw = error(frame['longitude'].to_numpy(), frame['latitude'].to_numpy())
+    smooth = error(smoothed['smooth_longitude'].to_numpy(), smoothed['smooth_latitude'].to_numpy())
+    good = np.arange(len(frame)) != 250
+    assert np.sqrt(np.mean(smooth[good] ** 2)) < 0.6 * np.sqrt(np.mean(raw[good] ** 2))
+    assert not smoothed['gps_used'].iloc[250] and smoothed['gps_used'].mean() > 0.95
+    assert smooth[250] < 10
+    assert np.nanmedian(smoothed['smooth_speed']) == pytest.approx(1.3, abs=0.2)
+
+
+# Segmentation
+
+
+def test_segmentation_counts():
+    # North, a right turn, east with a stop halfway, then a hairpin back west
+    frame = _track([(60, 0.0, 1.3), (60, 1.3, 0.0), (40, 0.0, 0.0), (30, 1.3, 0.0), (8, 0.0, 1.3),
+                    (60, -1.3, 0.0)])[0]
+    segments = detect_segments(frame)
+    assert segments['kind'].value_counts().to_dict() == {'stop': 1, 'turn': 1, 'u_turn': 1, 'backtrack': 2}
+    stop = segments[segments['kind'] == 'stop'].iloc[0]
+    assert stop['duration_s'] == pytest.approx(40, abs=WINDOW_SLACK)
+    turns = segments[segments['kind'].isin(['turn', 'u_turn'])]
+    assert list(turns['value']) == pytest.approx([90, -180])
+    # Walking east (78 m, split by the stop) took it away from where it ended
+    backtrack = segments.loc[segments['kind'] == 'backtrack', 'value'].sum()
+    assert 78 - 2 * WINDOW_SLACK * 1.3 < backtrack <= 78 + 1
+
+    # Two tracks are segmented independently of each other
+    other = frame.assign(participant='Q')
+    both = detect_segments(pd.concat([frame, other], ignore_index=True))
+    assert both.groupby('participant')['kind'].size().to_dict() == {'P': len(segments), 'Q': len(segments)}
+
+
+# The windows blur the edges of stops and backtracking by up to this many seconds
+WINDOW_SLACK = 6
+
+
+# Route similarity
+
+
+def _exact(a, b, metric):
+    # Textbook dynamic program over one pair
+    n, m = len(a), len(b)
+    total = np.full((n + 1, m + 1), np.inf)
+    total[0, 0] = 0.0
+    for i in range(n):
+        for j in range(m):
+            cost = np.hypot(*(a[i] - b[j]))
+            best = min(total[i, j], total[i, j + 1], total[i + 1, j])
+            total[i + 1, j + 1] = max(cost, best) if metric == 'frechet' else cost + best
+    return total[n, m] / n if metric == 'dtw' else total[n, m]
+
+
+@pytest.mark.parametrize('metric', ['dtw', 'frechet'])
+def test_similarity_exact_and_bounds(metric):
+    rng = np.random.default_rng(7)
+    paths = np.cumsum(rng.normal(0, 10, (12, 9, 2)), axis=1)
+    query = np.cumsum(rng.normal(0, 10, (9, 2)), axis=0)
+
+    exact = np.array([_exact(query, path, metric) for path in paths])
+    assert np.allclose(pair_distances(np.broadcast_to(query, paths.shape), paths, metric), exact)
+    # Routes of different lengths
+    assert pair_distances(query[np.newaxis, :7], paths[:1], metric)[0] == pytest.approx(
+        _exact(query[:7], paths[0], metric))
+
+    assert (lower_bounds(query, paths, metric) <= exact + 1e-9).all()
+    closest, distances, computed = nearest(query, paths, 3, metric)
+    assert list(closest) == list(np.argsort(exact, kind='stable')[:3])
+    assert np.allclose(distances, np.sort(exact)[:3]) and computed <= len(paths)
+
+
+# Incremental structures against a rebuild
+
+
+def test_density_grid_extend_matches_rebuild(sessions):
+    store = SessionStore(sessions)
+    frame = store.waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+    first = len(sessions[0]) + len(sessions[1]) + len(sessions[2])
+    grid = DensityGrid(frame.iloc[:first].reset_index(drop=True))
+    grid = grid.extend(frame.iloc[first:].reset_index(drop=True))
+    rebuilt = DensityGrid(frame, origin_lat=grid.origin_lat)
+    for level in range(len(rebuilt.cells)):
+        assert grid.cells[level].equals(rebuilt.cells[level])
+    assert grid.scope_participants.equals(rebuilt.scope_participants)
+
+
+def test_task_index_extend_matches_rebuild(sessions):
+    store = SessionStore(sessions[:3])
+    index = TaskIndex(store.waypoint_frame(DASHBOARD_COLUMNS, compact=True))
+    first_row = store.append(sessions[3:])
+    index, keys = index.extend(store.waypoint_frame(DASHBOARD_COLUMNS, compact=True, start=first_row))
+    rebuilt = TaskIndex(store.waypoint_frame(DASHBOARD_COLUMNS, compact=True))
+
+    assert set(keys) == set(rebuilt.slices) - set(TaskIndex(SessionStore(sessions[:3]).waypoint_frame(
+        DASHBOARD_COLUMNS, compact=True)).slices)
+    assert set(index.slices) == set(rebuilt.slices)
+    # P0001 walked every task twice: one track per session, apart from each other
+    assert len(index.task_tracks('nav', 1)) == len(sessions)
+    for key in rebuilt.slices:
+        track, expected = index.track(key), rebuilt.track(key)
+        assert np.array_equal(track['timestamp'].to_numpy(), expected['timestamp'].to_numpy())
+        assert np.array_equal(track['longitude'].to_numpy(), expected['longitude'].to_numpy())
+        assert index.duration(key) == rebuilt.duration(key)
+        assert index.window(key, 10, 60) == rebuilt.window(key, 10, 60)
+    both = index.tracks(rebuilt.task_tracks('theme', 5))
+    assert both[GROUP_KEYS].astype(str).equals(
+        rebuilt.tracks(rebuilt.task_tracks('theme', 5))[GROUP_KEYS].astype(str))
+    with pytest.raises(ValueError):
+        index.extend(store.waypoint_frame(DASHBOARD_COLUMNS, compact=True, start=first_row))
+
+
+# Spatial index
+
+
+def test_waypoint_index_queries_match_brute_force(sessions):
+    frame = SessionStore(sessions).waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+    first = len(frame) - len(sessions[-1])
+    index = WaypointIndex(frame.iloc[:first]).extend(frame.iloc[first:])
+    assert len(index.parts) == 2 and len(index) == len(frame)
+    lon, lat = frame['longitude'].to_numpy(dtype=np.float64), frame['latitude'].to_numpy(dtype=np.float64)
+
+    # Around a waypoint of the last session, so both parts are near the query
+    query_lon, query_lat = lon[first + 50] + 1e-5, lat[first + 50]
+    distances = GEOD.inv(np.full(len(frame), query_lon), np.full(len(frame), query_lat), lon, lat)[2]
+    rows, found = index.radius(query_lon, query_lat, 60)
+    order = np.argsort(rows)
+    assert np.array_equal(rows[order], np.flatnonzero(distances <= 60))
+    assert np.allclose(found[order], distances[distances <= 60])
+    assert index.nearest(query_lon, query_lat) == (int(np.argmin(distances)), pytest.approx(distances.min()))
+
+    west, south, east, north = query_lon - 0.002, query_lat - 0.001, query_lon + 0.002, query_lat + 0.001
+    inside = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+    assert np.array_equal(np.sort(index.bbox(west, south, east, north)), np.flatnonzero(inside))
+
+    passes = index.passes(query_lon, query_lat, 60)
+    near = frame[distances <= 60].assign(distance_m=distances[distances <= 60])
+    expected = near.groupby(GROUP_KEYS, observed=True).agg(points=('timestamp', 'size'),
+                                                           closest_m=('distance_m', 'min')).reset_index()
+    assert list(passes['points']) == list(expected['points'])
+    assert np.allclose(passes['closest_m'], expected['closest_m'])
+
+
+# Events and object localization
+
+
+def test_event_index_selects_like_a_mask(sessions):
+    store = SessionStore(sessions)
+    index = EventIndex(store)
+    events = store.event_frame()
+    assert len(index) == len(events) and index.counts().sum() == len(events)
+    queries = [{'type': 'ON_MAP_CLICKED'}, {'task_type': OBJECT_TASK}, {'participant': 'P0001'},
+               {'type': 'ON_OK_CLICKED', 'task_type': OBJECT_TASK, 'participant': 'P0001'},
+               {'type': 'INIT_TASK', 'participant': 'P0002'}, {'type': 'NO_SUCH_EVENT'}]
+    for query in queries:
+        mask = np.logical_and.reduce([events[key].astype(str) == value for key, value in query.items()])
+        selected = index.select(**query)
+        assert sorted(selected.index) == list(np.flatnonzero(mask))
+        # Ordered by key, then by time within every (type, task_type, participant)
+        for _, block in selected.groupby(EVENT_KEYS, observed=True, sort=False):
+            assert block['timestamp'].is_monotonic_increasing
+    clicks = index.select(type='ON_OK_CLICKED', task_type=OBJECT_TASK)
+    assert index.task_geometry(clicks) == [store.task_geometry[row] for row in clicks.index]
+
+
+def test_object_scoring_against_each_target(sessions):
+    index = EventIndex(SessionStore(sessions))
+    scores = score_clicks(index)
+    clicks = index.select(task_type=OBJECT_TASK)
+    assert len(scores) == clicks['type'].isin(CLICK_EVENTS).sum()
+
+    # Target rectangles of the synthetic game, measured flat in local metres
+    targets = {task['_id']: task['question']['geometry']['features'][0]['geometry']['coordinates'][0]
+               for task in game_tasks() if task['type'] == OBJECT_TASK}
+    for row in scores.itertuples():
+        ring = np.array(targets[row.task_id])
+        target = shapely.Polygon(np.column_stack(local_xy(ring[:, 0], ring[:, 1], CENTER[1])))
+        click = shapely.Point(*local_xy(row.click_longitude, row.click_latitude, CENTER[1]))
+        # The generator put hits inside the target and misses 10-80 m beyond its corners
+        assert row.hit == (row.correct == 1) == target.contains(click)
+        # Flat metres on the sphere and the ellipsoid agree to well under a percent here
+        assert row.distance_m == pytest.approx(target.distance(click), rel=5e-3, abs=1e-6)
+
+    table = accuracy_table(scores)
+    expected = scores.groupby('participant', observed=True)['hit'].mean()
+    assert np.allclose(table.set_index('participant')['click_accuracy'], expected)
+
+
+# Playback
+
+
+def test_playback_sends_each_row_once(sessions):
+    tracks = TaskIndex(SessionStore(sessions[:1]).waypoint_frame(DASHBOARD_COLUMNS, compact=True))
+    key = max(tracks.slices, key=lambda key: tracks.slices[key].stop - tracks.slices[key].start)
+    track, duration = tracks.track(key), tracks.duration(key)
+    seconds = (track['timestamp'] - track['timestamp'].iloc[0]).dt.total_seconds().to_numpy()
+
+    # What the playback layer holds: track row -> position sent
+    shown, held, sent = {}, None, 0
+    windows = [(0, duration / 4), (0, duration / 2), (duration / 8, duration / 2), (0, duration / 3),
+               (duration * 0.9, duration), (0, duration)]
+    for start, end in windows:
+        rows = tracks.window(key, start, end)
+        assert list(range(rows.start, rows.stop)) == list(np.flatnonzero((seconds >= start) & (seconds <= end)))
+        message, held = playback_update(track, rows, held)
+        if message['reset']:
+            shown = {}
+        for chunk in message['chunks']:
+            offsets = range(chunk['offset'], chunk['offset'] + len(chunk['coords']))
+            # Rows the map holds already are never sent again
+            assert not set(offsets) & set(shown)
+            shown.update(zip(offsets, chunk['coords']))
+            sent += len(offsets)
+        assert message['window'] == [rows.start, rows.stop]
+        assert set(range(rows.start, rows.stop)) <= set(shown) and held == [min(shown), max(shown) + 1]
+    # The jump to the end starts over, so the track is sent once plus the part re-sent after it
+    assert sent < 2 * len(track)
+    expected = np.round(track[['latitude', 'longitude']].to_numpy(dtype=np.float64), COORDINATE_PRECISION).tolist()
+    assert [shown[row] for row in sorted(shown)] == expected
+
+
+# Map cache
+
+
+def test_map_cache_evicts_least_recently_used():
+    cache, renders = LRUCache(maxsize=2), []
+
+    def render(key):
+        return lambda: renders.append(key) or f'<html>{key}</html>'
+
+    for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+        assert cache.get(key, render(key)) == f'<html>{key}</html>'
+    # 'b' was the least recently used when 'c' came in, then 'c' when 'b' came back
+    assert renders == ['a', 'b', 'c', 'b']
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (2, 2, 4, 2)
+    assert cache.invalidate(lambda key: key == 'a') == 1 and cache.stats()['size'] == 1
+    assert cache.invalidate() == 1 and cache.stats()['size'] == 0
+
+
+# Live ingest through the dashboard server
+
+
+@pytest.fixture(scope='module')
+def dashboard(tmp_path_factory, session_paths):
+    # Dashboard over the first three sessions, loaded before the tests; they upload the others
+    source = tmp_path_factory.mktemp('source')
+    for path in session_paths[:3]:
+        shutil.copy(path, source)
+    data = DashboardData(str(source), str(tmp_path_factory.mktemp('drop')))
+    return data, create_app(data, load='eager').server.test_client()
+
+
+def _post(client, content):
+    return client.post('/sessions', data=content, content_type='application/json')
+
+
+def test_upload_adds_a_session(dashboard, session_paths):
+    data, client = dashboard
+    revision, tracks = data.revision, len(data.tracks)
+    track_key = data.tracks.task_tracks('nav', 1)[0]
+    track_map = cached_map(data.tracks, track_key, data_version=data.version)
+    density_map = cached_density_map(data.density, task_scope('nav', 1), data_version=data.version)
+    with open(session_paths[3], 'rb') as file:
+        content = file.read()
+
+    response = _post(client, content)
+    added = response.get_json()
+    assert response.status_code == 201 and added['sessions'] == 1 and added['revision'] == revision + 1
+    assert len(data.tracks) == tracks + len(added['tracks'])
+    assert {participant for participant, _, _, _ in added['tracks']} == {'P0001'}
+    # P0001 has two sessions on the task now, labelled apart in the metrics and the similarity
+    labels = sorted(data.task_metrics('nav', 1)['participant'])
+    assert labels == sorted(track_labels(data.tracks.task_tracks('nav', 1)))
+    assert sum(label.startswith('P0001 (') for label in labels) == 2
+
+    # Only the new pairs were computed, and the matrix matches one built from every route at once
+    keys, _, matrix, order, paths = data.route_similarity('nav', 1, 'dtw', 'smoothed')
+    routes = track_routes(smoothed_view(data.tracks.frame))
+    table = similarity_table(routes, 'dtw')
+    assert len(keys) == 4 and sorted(order) == [0, 1, 2, 3]
+    assert np.allclose(matrix, square_matrix(table[(table['taskCategory'] == 'nav') & (table['taskNo'] == 1)], keys))
+    assert np.allclose(paths, task_paths(routes, keys)[1])
+
+    # Track maps stay cached; the density maps the new rows count into are rendered again
+    assert cached_map(data.tracks, track_key, data_version=data.version) is track_map
+    assert cached_density_map(data.density, task_scope('nav', 1), data_version=data.version) != density_map
+
+    # The same file again is already loaded; the same session in another file is a duplicate
+    assert _post(client, content).get_json()['sessions'] == 0
+    reformatted = json.dumps(json.loads(content), indent=1).encode()
+    response = _post(client, reformatted)
+    assert response.status_code == 200 and len(response.get_json()['duplicates']) == 1
+    assert data.revision == revision + 1 and len(os.listdir(data.drop_dir)) == 1
+
+
+def test_upload_rejects_files_that_are_not_sessions(dashboard, session_paths, monkeypatch):
+    data, client = dashboard
+    revision, files = data.revision, sorted(os.listdir(data.drop_dir))
+    for content, error in [(b'{"players": ["A"], "waypoints": []}', 'no waypoints'),
+                           (b'{"waypoints": []}', 'no players'), (b'not json', 'JSONError')]:
+        response = _post(client, content)
+        assert response.status_code == 400 and error in response.get_json()['error']
+
+    # One bad file fails the whole request
+    with open(session_paths[4], 'rb') as file:
+        good = file.read()
+    response = client.post('/sessions', data={'file': [(io.BytesIO(good), 'good.json'),
+                                                       (io.BytesIO(b'{"players": []}'), 'bad.json')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert data.revision == revision and sorted(os.listdir(data.drop_dir)) == files
+    assert 'P0003' not in data.tracks.participants('nav', 1)
+
+    monkeypatch.setattr(wayfinding, 'MAX_UPLOAD_BYTES', len(good) - 1)
+    assert _post(client, good).status_code == 413
+    monkeypatch.undo()
+    assert _post(client, good).status_code == 201 and 'P0003' in data.tracks.participants('nav', 1)
+
+
+def test_waypoints_near(dashboard):
+    data, client = dashboard
+    key = data.tracks.task_tracks('nav', 1)[0]
+    point = data.tracks.track(key).iloc[10]
+    response = client.get(f'/waypoints/near?lon={point.longitude}&lat={point.latitude}&radius=5')
+    assert response.status_code == 200
+    passes = {tuple(row[column] for column in GROUP_KEYS): row for row in response.get_json()}
+    assert passes[key]['closest_m'] == pytest.approx(0, abs=1e-6)
+    for query in ['lon=x&lat=51.96', 'lat=51.96', f'lon={point.longitude}&lat={point.latitude}&radius=far',
+                  'lon=nan&lat=51.96', f'lon={point.longitude}&lat={point.latitude}&radius=-1']:
+        response = client.get(f'/waypoints/near?{query}')
+        assert response.status_code == 400 and 'error' in response.get_json()
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from metrics import GROUP_KEYS, route_metrics
+from segmentation import SUMMARY_COLUMNS, segment_summary
+from simplify import lod_importance
+from smoothing import SMOOTHED_COLUMNS, smooth_tracks, smoothed_view
+from task_index import track_labels
+
+# Per-track columns and tables derived from the compact waypoint view, shared
+# by the dashboard (wayfinding.py) and the offline report export
+# (export_reports.py), so both draw and measure the same tracks.
+
+# Columns computed per track; recomputed for the tracks new sessions extend
+DERIVED_COLUMNS = SMOOTHED_COLUMNS + ['lod_importance', 'smooth_lod_importance']
+
+
+def derive_columns(frame):
+    """`frame` with the smoothed positions and the LOD importance of both kinds of track added."""
+    frame = frame.join(smooth_tracks(frame))
+    frame['lod_importance'] = lod_importance(frame).astype(np.float32)
+    frame['smooth_lod_importance'] = lod_importance(smoothed_view(frame)).astype(np.float32)
+    return frame
+
+
+def track_metrics(frame):
+    """Route metrics of the raw and of the smoothed tracks in `frame`."""
+    return {'raw': route_metrics(frame), 'smoothed': route_metrics(smoothed_view(frame))}
+
+
+def metrics_table(route_tables, segments):
+    """Route metrics of every track, raw and smoothed (the `track` column), with its segment
+    summary; tracks without segments get zeros."""
+    summary = segment_summary(segments)
+    tables = []
+    for track, route_table in route_tables.items():
+        for key in GROUP_KEYS:
+            summary[key] = summary[key].astype(route_table[key].dtype)
+        table = route_table.merge(summary, on=GROUP_KEYS, how='left')
+        table[SUMMARY_COLUMNS] = table[SUMMARY_COLUMNS].fillna(0)
+        tables.append(table.assign(track=track))
+    return pd.concat(tables, ignore_index=True)
+
+
+def label_tracks(metrics):
+    """`metrics` (rows of a metrics_table), sorted by track, with the display label of every track
+    (see track_labels)."""
+    metrics = metrics.sort_values(['track'] + GROUP_KEYS, kind='stable', ignore_index=True)
+    keys = list(metrics[GROUP_KEYS].itertuples(index=False, name=None))
+    unique = sorted(set(keys))
+    labels = dict(zip(unique, track_labels(unique)))
+    return metrics.assign(label=[labels[key] for key in keys])
@@ -1,241 +1,838 @@
-import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
-from shapely.geometry import LineString
-import folium
+import numpy as np
+from flask import jsonify, request
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash
 from datetime import timedelta
-import plotly.express as px
+from density_grid import ALL_TASKS, DensityGrid, task_scope
+from ingest import DATA_SOURCE, ingest
+from instrumentation import instrument_server, process_memory, register_cache, register_gauge, timed
+from live_ingest import DROP_DIR, MAX_UPLOAD_BYTES, WATCH_INTERVAL, SessionWatcher, save_upload, session_paths
+from map_render import cached_density_map, cached_map, map_cache
+from metrics import METRICS_VERSION, route_metrics
+from playback import PLAYBACK_STEP, playback_update
+from segmentation import SEGMENTS_VERSION, SUMMARY_COLUMNS, detect_segments
+from session_cache import cached_table, load_sessions, store_table
+from session_loader import check_session
+from session_store import session_id
+from similarity import (LOOKUP_POINTS, MATRIX_POINTS, METRICS, ROUTE_POINTS, SIMILARITY_VERSION,
+                        cluster_order, extend_similarity_table, nearest, similarity_table, square_matrix,
+                        task_paths, track_routes)
+from simplify import LOD_ZOOMS
+from smoothing import SMOOTHING_VERSION, smoothed_view
+from task_index import TaskIndex, track_labels
+from track_tables import derive_columns, label_tracks, metrics_table, track_metrics
+from waypoint_index import WaypointIndex
+from waypoint_table import DASHBOARD_COLUMNS
 # import matplotlib.pyplot as plt
 
-# Step 1: Load the JSON files and extract geospatial data for both groups
-file_path = r"D:\Munster\ThirdSemester\Theses\data\datan\group1.json"
-with open(file_path, 'r') as file:
-    data = json.load(file)
-
-participants = data['players']
-p = participants[0]
-waypoints = data['waypoints']
-
-file_path1 = r"D:\Munster\ThirdSemester\Theses\data\datan\group2.json"
-with open(file_path1, 'r') as file:
-    data1 = json.load(file)
-
-participants1 = data1['players']
-p1 = participants1[0]
-waypoints1 = data1['waypoints']
-
-# Step 2: Extract necessary information and create a GeoDataFrame for both groups
-extracted_data = []
-for wp in waypoints:
-    position = wp.get('position', {})
-    coords = position.get('coords', {})
-    interaction = wp.get('interaction', {})
-
-    data_entry = {
-        'timestamp': wp.get('timestamp'),
-        'latitude': coords.get('latitude'),
-        'longitude': coords.get('longitude'),
-        'altitude': coords.get('altitude'),
-        'speed': coords.get('speed'),
-        'heading': coords.get('heading'),
-        'accuracy': coords.get('accuracy'),
-        'taskNo': wp.get('taskNo'),
-        'taskCategory': wp.get('taskCategory'),
-        'panCount': interaction.get('panCount'),
-        'zoomCount': interaction.get('zoomCount'),
-        'rotation': interaction.get('rotation'),
-        'participant': wp.get('participant', p)
-    }
-    extracted_data.append(data_entry)
-
-# Extract data for group 2
-extracted_data1 = []
-for wp1 in waypoints1:
-    position1 = wp1.get('position', {})
-    coords1 = position1.get('coords', {})
-    interaction1 = wp1.get('interaction', {})
-
-    data_entry1 = {
-        'timestamp': wp1.get('timestamp'),
-        'latitude': coords1.get('latitude'),
-        'longitude': coords1.get('longitude'),
-        'altitude': coords1.get('altitude'),
-        'speed': coords1.get('speed'),
-        'heading': coords1.get('heading'),
-        'accuracy': coords1.get('accuracy'),
-        'taskNo': wp1.get('taskNo'),
-        'taskCategory': wp1.get('taskCategory'),
-        'panCount': interaction1.get('panCount'),
-        'zoomCount': interaction1.get('zoomCount'),
-        'rotation': interaction1.get('rotation'),
-        'participant': wp1.get('participant', p1)
-    }
-    extracted_data1.append(data_entry1)
-
-# Combine both datasets
-alldata = extracted_data + extracted_data1
-
-# Convert to GeoDataFrame
-gdf = gpd.GeoDataFrame(
-    alldata,
-    geometry=[Point(data['longitude'], data['latitude']) for data in alldata],
-    crs="EPSG:4326"  # WGS84 Latitude/Longitude
-)
-
-# Filter the tasks for navigation (safe copy with .loc[])
-nav_tasks = gdf.loc[(gdf['taskCategory'] == 'nav') & (gdf['taskNo'] == 1)].copy()
-
-# Convert 'timestamp' column to datetime safely
-nav_tasks['timestamp'] = pd.to_datetime(nav_tasks['timestamp'])
-# Group by 'participant' and calculate 'duration' and 'route length'
-
-df_duration = nav_tasks.groupby('participant').agg(
-    Duration=pd.NamedAgg(column='timestamp', aggfunc=lambda x: x.max() - x.min()),  # Calculate duration
-).reset_index()
-
-lines = (
-    nav_tasks.groupby('participant')
-    .apply(lambda x: LineString(x.sort_values('timestamp')[['longitude', 'latitude']].values))
-    .reset_index()
-)
-
-gdf_lines = gpd.GeoDataFrame(
-    lines, 
-    geometry=lines[0],  # The LineString geometries created in the lambda function
-    crs="EPSG:4326"
-)
-gdf_lines.drop(columns=0, inplace=True)
-
-gdf_lines_projected = gdf_lines.to_crs(epsg=3395)
-gdf_lines_projected['Route_length'] = gdf_lines_projected.length / 1000
-gdf_lines_with_length = gdf_lines_projected.to_crs(epsg=4326)
-gdf1_length = pd.merge(gdf_lines_with_length, df_duration, on='participant')
-df_length = pd.DataFrame(gdf1_length.drop(columns='geometry'))
-print(df_length)
-
-# Step 3: Create a function to generate the map
-def create_map(nav_tasks, opacity=0.5, basemap="OpenStreetMap"):
-    map_center = [nav_tasks.geometry.y.mean(), nav_tasks.geometry.x.mean()]
-    m = folium.Map(location=map_center, zoom_start=14, tiles=basemap)
-    
-    # Add tile layers for switching basemaps
-    folium.TileLayer('OpenStreetMap').add_to(m)
-    folium.TileLayer('CartoDB positron').add_to(m)
-    folium.TileLayer('CartoDB dark_matter').add_to(m)
-    folium.TileLayer(
-        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
-        attr="Tiles © Esri — Source: Esri, DeLorme, NAVTEQ",
-        name='Imagery'
-    ).add_to(m)
-    folium.LayerControl().add_to(m)  # Enable layer control
-    
-    # Color based on heading
-    def get_color(heading):
-        if heading < 90:
-            return 'red'
-        elif heading < 180:
-            return 'orange'
-        elif heading < 270:
-            return 'yellow'
+# How the data is loaded. 'background' (the default) returns the app at once
+# and loads in a thread, so the server binds immediately and /ready reports
+# progress; 'eager' loads before the app is returned, which gunicorn --preload
+# needs so that forked workers share one copy (see gunicorn.conf.py).
+LOAD_MODE = os.environ.get('WAYFINDING_LOAD', 'background')
+
+LOAD_STAGES = ['ingest', 'waypoint_frame', 'derive_columns', 'task_index', 'waypoint_index', 'density',
+               'route_metrics', 'segments', 'similarity', 'initial_map']
+
+METRIC_TABLE_COLUMNS = ['participant', 'Route_length', 'Duration', 'Mean_speed', 'Tortuosity',
+                        'Stops', 'Dwell_time', 'Turns', 'Backtrack']
+
+# Per-track values that can be charted
+CHART_COLUMNS = ['Route_length', 'Duration', 'Mean_speed', 'Tortuosity'] + SUMMARY_COLUMNS
+
+# Tracks the maps and metrics can be shown for: the recorded fixes or the smoothed positions
+TRACK_OPTIONS = [{'label': 'Raw GPS', 'value': 'raw'}, {'label': 'Smoothed', 'value': 'smoothed'}]
+TRACKS = [option['value'] for option in TRACK_OPTIONS]
+DEFAULT_TRACK = 'smoothed'
+
+# What the map shows: the selected participant's track, its playback over time, or where
+# the whole group walked
+MAP_VIEWS = [{'label': 'Participant track', 'value': 'track'},
+             {'label': 'Playback', 'value': 'playback'},
+             {'label': 'Group density (task)', 'value': 'task'},
+             {'label': 'Group density (all tasks)', 'value': 'all'}]
+
+# Route distances the similarity matrix can show, and how many most similar routes are listed
+SIMILARITY_OPTIONS = [{'label': label, 'value': metric} for metric, label in METRICS.items()]
+SIMILAR_ROUTES = 5
+
+# How often open dashboards check for newly added sessions (ms)
+REFRESH_INTERVAL = max(WATCH_INTERVAL, 1) * 1000
+
+
+def append_tracks(table, rows):
+    """`table` (one or more rows per track) with the rows of new tracks added after the others."""
+    return pd.concat([table, rows], ignore_index=True)
+
+
+def track_view(frame, track):
+    """The raw or the smoothed positions of `frame`."""
+    return smoothed_view(frame) if track == 'smoothed' else frame
+
+
+def similarity_params(track):
+    """Cache parameters of a similarity table; the smoothed routes also depend on the smoothing."""
+    params = (SIMILARITY_VERSION, MATRIX_POINTS)
+    return params + (SMOOTHING_VERSION,) if track == 'smoothed' else params
+
+
+def task_similarity(tracks, routes, tables, tasks):
+    """(track keys, distance matrix, cluster order of its rows, resampled routes for lookups) of every
+    (taskCategory, taskNo, metric, track) of `tasks`, from the resampled `routes` per track and the
+    similarity `tables` per (metric, track)."""
+    result = {}
+    for category, number in tasks:
+        task_keys = tracks.task_tracks(category, number)
+        for track in TRACKS:
+            keys, paths = task_paths(routes[track], task_keys, LOOKUP_POINTS)
+            for metric in METRICS:
+                table = tables[(metric, track)]
+                rows = table[(table['taskCategory'] == category) & (table['taskNo'] == number)]
+                matrix = square_matrix(rows, keys)
+                result[(category, number, metric, track)] = (keys, matrix, cluster_order(matrix), paths)
+    return result
+
+
+class DashboardData:
+    # Everything the dashboard serves, loaded once per process, plus the
+    # loading progress reported by /ready and the loading page. Sessions added
+    # later (add_files) update it in place and bump `revision`.
+
+    def __init__(self, source=DATA_SOURCE, drop_dir=DROP_DIR):
+        self.source = source
+        self.drop_dir = drop_dir
+        self.paths = set()
+        self.revision = 0
+        self._update_lock = threading.Lock()
+        self.watcher = SessionWatcher(self.new_paths, self.add_files)
+        # Resampled routes of every track per track kind (see similarity.track_routes), route
+        # similarity tables per (metric, track), and the matrix and routes of every
+        # (taskCategory, taskNo, metric, track) built from them; computed while loading
+        self.routes = {}
+        self.similarity_tables = {}
+        self.similarity = {}
+        self.ready = threading.Event()
+        self.stage = None
+        self.completed = []
+        self.error = None
+        self.started = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _stage(self, name):
+        self.stage = name
+        with timed(name):
+            yield
+        self.completed.append(name)
+
+    def load(self):
+        with self._lock:
+            if self.started is not None:
+                return
+            self.started = time.perf_counter()
+        try:
+            self._load()
+        except Exception as error:
+            self.error = f'{type(error).__name__}: {error}'
+            raise
+        self.load_seconds = time.perf_counter() - self.started
+        self.stage = None
+        self.ready.set()
+
+    def _load(self):
+        # Step 1: Ingest the session exports (directory or glob from WAYFINDING_DATA,
+        # served from the on-disk column cache when the files have not changed)
+        with self._stage('ingest'):
+            paths = session_paths(self.source, self.drop_dir)
+            self.store = ingest(paths)
+            self.paths = set(paths)
+
+        # Step 2: Take the columns the dashboard uses from the combined waypoint table,
+        # in compact dtypes (categorical keys, float32 readings) and without per-row
+        # point geometry; see waypoint_table.py
+        with self._stage('waypoint_frame'):
+            alldata = self.store.waypoint_frame(DASHBOARD_COLUMNS, compact=True)
+
+        # Accuracy-weighted Kalman smoothing of every track, next to the raw positions (fixes
+        # without a usable accuracy or far off the track are bridged, see smoothing.py), and the
+        # Douglas-Peucker importance of every waypoint, raw and smoothed, used to draw each zoom
+        # level with only the points visible at that scale; added sessions get the same columns
+        # from track_tables.derive_columns
+        with self._stage('derive_columns'):
+            alldata = derive_columns(alldata)
+
+        # Sort once by (participant, session_id, taskCategory, taskNo, timestamp): every
+        # track is then a contiguous row slice looked up by key instead of a mask over all rows
+        with self._stage('task_index'):
+            self.tracks = TaskIndex(alldata)
+
+        # Spatial index over all waypoints for viewport and proximity queries
+        with self._stage('waypoint_index'):
+            self.waypoint_index = WaypointIndex(self.tracks.frame)
+
+        # Waypoints and participants per grid cell, per task and over all tasks, at every
+        # cell size the density maps use (see density_grid.py)
+        with self._stage('density'):
+            self.density = DensityGrid(self.tracks.frame)
+
+        # Geodesic route length (km), duration (min), mean speed (m/s) and tortuosity
+        # for every (participant, session_id, taskCategory, taskNo), computed in one vectorized pass,
+        # for the raw and for the smoothed tracks
+        with self._stage('route_metrics'):
+            self.route_tables = {
+                'raw': cached_table('route_metrics', self.store.sessions,
+                                    lambda: route_metrics(self.tracks.frame), METRICS_VERSION),
+                'smoothed': cached_table('route_metrics_smoothed', self.store.sessions,
+                                         lambda: route_metrics(smoothed_view(self.tracks.frame)),
+                                         METRICS_VERSION, SMOOTHING_VERSION),
+            }
+
+        # Stops, turns, looking around and backtracking in every track, also in one
+        # vectorized pass; drawn on the maps and summarized per track next to the metrics
+        with self._stage('segments'):
+            self.segments = cached_table('segments', self.store.sessions,
+                                         lambda: detect_segments(self.tracks.frame), SEGMENTS_VERSION)
+            self.all_metrics = metrics_table(self.route_tables, self.segments)
+
+        # Route similarity of every task's tracks, raw and smoothed, by both distances; the
+        # matrices are O(tracks²) per task, so they are computed here (or taken from the
+        # table cache) rather than when a task is first viewed
+        with self._stage('similarity'):
+            self.routes = {track: track_routes(track_view(self.tracks.frame, track)) for track in TRACKS}
+            for metric in METRICS:
+                for track in TRACKS:
+                    self.similarity_tables[(metric, track)] = cached_table(
+                        f'similarity_{metric}_{track}', self.store.sessions,
+                        lambda: similarity_table(self.routes[track], metric), *similarity_params(track))
+            self.similarity = task_similarity(self.tracks, self.routes, self.similarity_tables, self.tracks.tasks())
+
+        # Step 3: Generate the map initially with default values (first participant's track, default opacity, default basemap)
+        # Maps are rendered in memory and kept in an LRU cache keyed by selection and data version
+        tasks = self.tracks.tasks()
+        self.default_task = ('nav', 1) if ('nav', 1) in tasks else tasks[0]
+        self.task_categories = sorted({category for category, _ in tasks})
+
+        df_length = self.task_metrics(*self.default_task)
+        print(df_length)
+
+        # Maps are keyed by the data loaded at startup; sessions added later
+        # invalidate only the maps of the tracks they change
+        self.version = self.store.version
+        with self._stage('initial_map'):
+            self.default_key = self.tracks.task_tracks(*self.default_task)[0]
+            self.initial_map = cached_map(self.tracks, self.default_key,
+                                          data_version=self.version, segments=self.segments,
+                                          smoothed=DEFAULT_TRACK == 'smoothed')
+
+    def start(self, mode=LOAD_MODE):
+        if mode == 'eager':
+            self.load()
         else:
-            return 'blue'
-
-    for _, row in nav_tasks.iterrows():
-        folium.CircleMarker(
-            location=(row.geometry.y, row.geometry.x),
-            radius=5,
-            color=get_color(row.heading),
-            fill=True,
-            fill_color=get_color(row.heading),
-            fill_opacity=opacity
-        ).add_to(m)
-
-    # Add legend for heading colors
-    legend_html = '''
-    <div style="position: fixed; 
-                bottom: 50px; left: 50px; width: 150px; height: 150px; 
-                background-color: white; z-index:9999; font-size:14px;
-                border:2px solid grey; padding: 10px;">
-    <b>Heading Legend</b><br>
-    <i style="background:red;width:20px;height:20px;float:left;margin-right:8px"></i> 0-90°<br>
-    <i style="background:orange;width:20px;height:20px;float:left;margin-right:8px"></i> 90-180°<br>
-    <i style="background:yellow;width:20px;height:20px;float:left;margin-right:8px"></i> 180-270°<br>
-    <i style="background:blue;width:20px;height:20px;float:left;margin-right:8px"></i> 270-360°
-    </div>
-    '''
-    m.get_root().html.add_child(folium.Element(legend_html))
-
-    map_path = "map.html"
-    m.save(map_path)
-    return map_path
-
-# Generate the map initially with default values (first participant, default opacity, default basemap)
-default_participant = nav_tasks['participant'].unique()[0]
-initial_map_path = create_map(nav_tasks[nav_tasks['participant'] == default_participant])
-
-# Step 4: Set up Dash App
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
-server = app.server
+            threading.Thread(target=self.load, name='wayfinding-load', daemon=True).start()
+
+    def new_paths(self):
+        """Session files in the data source or drop directory that are not loaded yet."""
+        if not self.ready.is_set():
+            return []
+        return [path for path in session_paths(self.source, self.drop_dir) if path not in self.paths]
+
+    @timed('add_sessions')
+    def add_files(self, paths):
+        """Add new session files to the loaded data. Tracks are keyed by session, so they only
+        add tracks: smoothing, LOD importance, metrics and segments are computed for those and
+        no loaded track changes. The new rows are kept as blocks of their own (see SessionStore,
+        TaskIndex and WaypointIndex), so adding a session costs about its own size. Sessions
+        already loaded (e.g. the same export uploaded again) are skipped and reported as
+        duplicates. Nothing is added if any file is not a session (ValueError, see check_session)."""
+        with self._update_lock:
+            paths = [os.path.abspath(path) for path in paths if os.path.abspath(path) not in self.paths]
+            loaded_sessions = load_sessions(paths) if paths else []
+            for path, session in zip(paths, loaded_sessions):
+                try:
+                    check_session(session)
+                except ValueError as error:
+                    raise ValueError(f'{os.path.basename(path)}: {error}') from None
+            loaded = {session_id(session) for session in self.store.sessions}
+            sessions, duplicates = [], []
+            for path, session in zip(paths, loaded_sessions):
+                if session_id(session) in loaded:
+                    duplicates.append(path)
+                else:
+                    sessions.append(session)
+                    loaded.add(session_id(session))
+            self.paths.update(duplicates)
+            if not sessions:
+                return {'sessions': 0, 'waypoints': 0, 'tracks': [], 'duplicates': duplicates,
+                        'revision': self.revision}
+            first_row = self.store.append(sessions)
+            rows = self.store.waypoint_frame(DASHBOARD_COLUMNS, compact=True, start=first_row)
+
+            block = derive_columns(rows)
+            tracks, keys = self.tracks.extend(block)
+            waypoint_index = self.waypoint_index.extend(tracks.blocks[-1])
+            density = self.density.extend(rows)
+
+            block_metrics = track_metrics(block)
+            route_tables = {track: append_tracks(table, block_metrics[track])
+                            for track, table in self.route_tables.items()}
+            block_segments = detect_segments(block)
+            segments = append_tracks(self.segments, block_segments)
+            store_table('route_metrics', self.store.sessions, route_tables['raw'], METRICS_VERSION)
+            store_table('route_metrics_smoothed', self.store.sessions, route_tables['smoothed'],
+                        METRICS_VERSION, SMOOTHING_VERSION)
+            store_table('segments', self.store.sessions, segments, SEGMENTS_VERSION)
+
+            # Similarity: only the new tracks are resampled and only their pairs computed (see
+            # extend_similarity_table), then the matrices of the tasks they join are rebuilt from the tables
+            routes = {}
+            for track in TRACKS:
+                added = track_routes(track_view(block, track))
+                routes[track] = {points: self.routes[track][points] | added[points] for points in ROUTE_POINTS}
+            tasks = sorted({(category, number) for _, _, category, number in keys})
+            similarity_tables = {}
+            for (metric, track), table in self.similarity_tables.items():
+                similarity_tables[(metric, track)] = extend_similarity_table(table, routes[track], keys, metric)
+                store_table(f'similarity_{metric}_{track}', self.store.sessions,
+                            similarity_tables[(metric, track)], *similarity_params(track))
+            similarity = self.similarity | task_similarity(tracks, routes, similarity_tables, tasks)
+
+            self.tracks, self.waypoint_index, self.density = tracks, waypoint_index, density
+            self.route_tables, self.segments = route_tables, segments
+            # Metrics of the new tracks only; labels are given when the table is shown
+            self.all_metrics = pd.concat([self.all_metrics, metrics_table(block_metrics, block_segments)],
+                                         ignore_index=True)
+            self.task_categories = sorted({category for category, _ in tracks.tasks()})
+            self.routes, self.similarity_tables, self.similarity = routes, similarity_tables, similarity
+            self.paths.update(paths)
+            self.revision += 1
+            # Track maps stay valid; only the density maps the new rows count into are dropped
+            scopes = {('density', ALL_TASKS)} | {('density', task_scope(category, number)) for category, number in tasks}
+            map_cache.invalidate(lambda cache_key: cache_key[0] in scopes)
+            return {'sessions': len(sessions), 'waypoints': len(rows), 'tracks': sorted(keys),
+                    'duplicates': duplicates, 'revision': self.revision}
+
+    def task_metrics(self, category, number, track=DEFAULT_TRACK):
+        metrics = self.all_metrics
+        selected = label_tracks(metrics[(metrics['taskCategory'] == category) & (metrics['taskNo'] == number)
+                                         & (metrics['track'] == track)])
+        return selected[METRIC_TABLE_COLUMNS].assign(participant=selected['label'])
+
+    def track_options(self, category, number):
+        """Dropdown options of one task's tracks: labelled by participant, valued by session."""
+        keys = self.tracks.task_tracks(category, number)
+        return [{'label': label, 'value': key[1]} for key, label in zip(keys, track_labels(keys))]
+
+    def route_similarity(self, category, number, metric='dtw', track=DEFAULT_TRACK):
+        """(track keys, track labels, distance matrix, cluster order of its rows, resampled routes for
+        lookups) of one task; see similarity.py. Computed while loading and when sessions are added,
+        not here; only the labels are given here, as they change when a participant adds a session."""
+        empty = ([], np.zeros((0, 0)), np.zeros(0, dtype=np.intp), np.zeros((0, LOOKUP_POINTS, 2)))
+        keys, matrix, order, paths = self.similarity.get((category, number, metric, track), empty)
+        return keys, track_labels(keys), matrix, order, paths
 
-app.layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.H1("Wayfinding Performance among Different Users", style={'text-align': 'center', 'color': 'white'})
-        ])
-    ], style={'background-color': 'black'}),
-
-    dbc.Row([
-        dbc.Col([
-            html.Label("Select Task Participant:", style={'color': 'white'}),
-            dcc.Dropdown(
-                id='task-participant-dropdown',
-                options=[{'label': Participant, 'value': Participant} for Participant in nav_tasks['participant'].unique()],
-                value=default_participant  # Default participant selection
-            )
-        ], width=4)
-    ]),
-
-    dbc.Row([
-        # Left Column (Map)
-        dbc.Col(
-            html.Iframe(id="map", srcDoc=open(initial_map_path, "r").read(), width="100%", height="500"),
-            width=6  
-        ),
-        
-        # Right Column (Data and Graph)
-        dbc.Col([
-            html.Div(children='Route Length(Km) Vs Time(DD/HH/MM/SS)', style={'text-align': 'center', 'color': 'white'}),
-            html.Hr(),
-            dcc.RadioItems(options=['Route_length', 'Duration'], value='Route_length', id='controls-and-radio-item', style={'color': 'white'}),
-            dash_table.DataTable(data=df_length.to_dict('records'), page_size=6, style_table={'height': '100px', 'overflowY': 'auto'}),
-            dcc.Graph(figure={}, id='controls-and-graph')
-        ], width=6)  
-    ])
-], fluid=True, style={'background-color': 'black'})
-
-# Step 5: Define app callback for map updates
-@app.callback(
-    [Output('map', 'srcDoc'),
-     Output('controls-and-graph', 'figure')],
-    [Input('task-participant-dropdown', 'value'),
-     Input('controls-and-radio-item', 'value')]
-)
-def update_map(selected_participant, col_chosen):
-    # Update map based on the selected participant
-    filtered_data = nav_tasks[nav_tasks['participant'] == selected_participant]
-    default_opacity = 0.5  # Set default opacity
-    default_basemap = 'OpenStreetMap'  # Default basemap
-    map_path = create_map(filtered_data, default_opacity, default_basemap)
-
-    # Update graph based on selected radio button choice
-    fig = px.histogram(df_length, x='participant', y=col_chosen)
-
-    return open(map_path, 'r').read(), fig
+    def most_similar(self, key, metric='dtw', track=DEFAULT_TRACK, count=SIMILAR_ROUTES):
+        """The `count` routes of the same task closest to the track `key`, by label."""
+        keys, labels, matrix, _, paths = self.route_similarity(*key[2:], metric, track)
+        if key not in keys:
+            return pd.DataFrame({'participant': [], 'distance_m': []})
+        row = keys.index(key)
+        others = np.flatnonzero(np.arange(len(keys)) != row)
+        closest, distances, _ = nearest(paths[row], paths[others], count, metric, matrix[row, others])
+        return pd.DataFrame({'participant': [labels[others[index]] for index in closest],
+                             'distance_m': np.round(distances, 1)})
+
+    def task_numbers(self, category):
+        return [number for task_category, number in self.tracks.tasks() if task_category == category]
+
+    def status(self):
+        memory = process_memory()
+        return {
+            'ready': self.ready.is_set(),
+            'stage': self.stage,
+            'completed': list(self.completed),
+            'progress': len(self.completed) / len(LOAD_STAGES),
+            'elapsed_s': time.perf_counter() - self.started if self.started is not None else None,
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+            'sessions': len(self.paths),
+            'revision': self.revision,
+            'pid': os.getpid(),
+            'rss_bytes': memory['rss'],
+            'pss_bytes': memory['pss'],
+            'shared_bytes': memory['shared'],
+        }
+
+
+def describe_status(status):
+    if status['error']:
+        return f"Loading failed: {status['error']}"
+    return f"Loading data ({status['stage'] or 'starting'}, {status['progress']:.0%})..."
+
+
+def loading_layout(data):
+    return dbc.Container([
+        html.H1("Wayfinding Performance among Different Users", style={'text-align': 'center', 'color': 'white'}),
+        html.Div(id='loading-status', children=describe_status(data.status()), style={'color': 'white'}),
+        dcc.Interval(id='loading-poll', interval=1000)
+    ], fluid=True, style={'background-color': 'black'})
+
+
+def metrics_records(data):
+    metrics = label_tracks(data.all_metrics)
+    return metrics[['track', 'taskCategory', 'taskNo', 'label'] + METRIC_TABLE_COLUMNS].to_dict('records')
+
+
+def dashboard_layout(data):
+    df_length = data.task_metrics(*data.default_task)
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.H1("Wayfinding Performance among Different Users", style={'text-align': 'center', 'color': 'white'})
+            ])
+        ], style={'background-color': 'black'}),
+
+        dbc.Row([
+            dbc.Col([
+                html.Label("Select Task Category:", style={'color': 'white'}),
+                dcc.Dropdown(
+                    id='task-category-dropdown',
+                    options=[{'label': category, 'value': category} for category in data.task_categories],
+                    value=data.default_task[0],
+                    clearable=False
+                )
+            ], width=2),
+            dbc.Col([
+                html.Label("Select Task Number:", style={'color': 'white'}),
+                dcc.Dropdown(
+                    id='task-number-dropdown',
+                    options=[{'label': number, 'value': number} for number in data.task_numbers(data.default_task[0])],
+                    value=data.default_task[1],
+                    clearable=False
+                )
+            ], width=2),
+            dbc.Col([
+                html.Label("Select Task Participant:", style={'color': 'white'}),
+                # One entry per track: a participant with several sessions on the task is listed once per session
+                dcc.Dropdown(
+                    id='task-participant-dropdown',
+                    options=data.track_options(*data.default_task),
+                    value=data.default_key[1]  # Default participant's session
+                )
+            ], width=3),
+            dbc.Col([
+                html.Label("Map zoom (level of detail):", style={'color': 'white'}),
+                dcc.Slider(
+                    id='zoom-slider',
+                    min=LOD_ZOOMS[0], max=LOD_ZOOMS[-1] + 1, step=1, value=14,
+                    marks={zoom: str(zoom) for zoom in LOD_ZOOMS} | {LOD_ZOOMS[-1] + 1: 'full'}
+                )
+            ], width=3),
+            dbc.Col([
+                html.Label("Track:", style={'color': 'white'}),
+                dcc.RadioItems(id='track-radio', options=TRACK_OPTIONS, value=DEFAULT_TRACK, style={'color': 'white'})
+            ], width=2)
+        ]),
+
+        dbc.Row([
+            # Left Column (Map)
+            dbc.Col([
+                dcc.RadioItems(id='map-view', options=MAP_VIEWS, value='track', inline=True,
+                               style={'color': 'white'}, inputStyle={'margin-left': '10px', 'margin-right': '4px'}),
+                html.Iframe(id="map", srcDoc=data.initial_map, width="100%", height="500"),
+                html.Div(id='playback-controls', style={'display': 'none'}, children=[
+                    html.Label("Playback window (seconds into the task):", style={'color': 'white'}),
+                    dcc.RangeSlider(id='playback-window', min=0, max=1, step=PLAYBACK_STEP, value=[0, 1],
+                                    marks=None, allowCross=False, updatemode='drag',
+                                    tooltip={'placement': 'bottom'})
+                ])
+            ], width=6),
+
+            # Right Column (Data and Graph)
+            dbc.Col([
+                html.Div(children='Route Length(Km) Vs Time(min)', style={'text-align': 'center', 'color': 'white'}),
+                html.Hr(),
+                dcc.RadioItems(options=CHART_COLUMNS, value='Route_length', id='controls-and-radio-item', style={'color': 'white'}),
+                dash_table.DataTable(id='metrics-table', data=df_length.to_dict('records'), page_size=6, style_table={'height': '100px', 'overflowY': 'auto'}),
+                dcc.Graph(figure={}, id='controls-and-graph')
+            ], width=6)
+        ]),
+
+        dbc.Row([
+            # Route similarity of the task's participants, clustered, and the routes closest to the selected one
+            dbc.Col([
+                html.Div(children='Route Similarity', style={'text-align': 'center', 'color': 'white'}),
+                html.Hr(),
+                dcc.RadioItems(id='similarity-metric', options=SIMILARITY_OPTIONS, value='dtw', inline=True,
+                               style={'color': 'white'}, inputStyle={'margin-left': '10px', 'margin-right': '4px'}),
+                dcc.Graph(figure={}, id='similarity-matrix')
+            ], width=8),
+            dbc.Col([
+                html.Div(id='similar-routes-title', children='Most Similar Routes',
+                         style={'text-align': 'center', 'color': 'white'}),
+                html.Hr(),
+                dash_table.DataTable(id='similar-routes', data=[], page_size=SIMILAR_ROUTES)
+            ], width=4)
+        ]),
+
+        # Metrics of every track, sent to the browser once; the
+        # table and chart are filtered and drawn from it client-side
+        dcc.Store(id='metrics-store', data=metrics_records(data)),
+
+        # Sessions added while the page is open bump the revision; the selectors,
+        # metrics and map then refresh from the updated data
+        dcc.Store(id='data-revision', data=data.revision),
+        dcc.Interval(id='refresh-poll', interval=REFRESH_INTERVAL),
+
+        # Playback: every rendered map gets a new token, and the state records which
+        # rows of the track the current map already holds (see playback.py)
+        dcc.Store(id='map-token'),
+        dcc.Store(id='playback-state'),
+        dcc.Store(id='playback-message'),
+        dcc.Store(id='playback-sent')
+    ], fluid=True, style={'background-color': 'black'})
+
+
+def create_app(data=None, load=LOAD_MODE):
+    """Build the Dash app; the data is loaded according to `load` ('background' or 'eager')."""
+    data = data or DashboardData()
+
+    # Step 4: Set up Dash App. The layout is served per request, so pages
+    # opened while the data is loading get a progress view that swaps itself
+    # for the dashboard once loading is done.
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+    server = app.server
+
+    # Stage and callback timings, payload sizes and cache hit rates on /metrics
+    instrument_server(server)
+    register_cache('maps', map_cache.stats)
+    register_gauge('wayfinding_ready', 'Whether the dashboard data is loaded.', lambda: data.ready.is_set())
+    register_gauge('wayfinding_load_seconds', 'Time taken to load the dashboard data.', lambda: data.load_seconds)
+
+    @server.before_request
+    def watch_sessions():
+        # Started per process, so every gunicorn worker polls the drop directory
+        if data.ready.is_set():
+            data.watcher.ensure_running()
+
+    @server.route('/health')
+    def health():
+        return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+    @server.route('/ready')
+    def ready():
+        # 200 once the data is loaded, 503 with the loading progress until then
+        status = data.status()
+        return jsonify(status), 200 if status['ready'] else 503
+
+    @server.route('/stats/map-cache')
+    def map_cache_stats():
+        return jsonify(map_cache.stats())
+
+    @server.route('/waypoints/near')
+    def waypoints_near():
+        # Tracks passing within `radius` metres of a point, e.g. /waypoints/near?lon=7.6255&lat=51.9625&radius=20
+        if not data.ready.is_set():
+            return jsonify(data.status()), 503
+        try:
+            lon, lat = float(request.args['lon']), float(request.args['lat'])
+            radius = float(request.args.get('radius', 20))
+        except (KeyError, ValueError):
+            lon = lat = radius = np.nan
+        if not np.isfinite([lon, lat, radius]).all() or radius < 0:
+            return jsonify({'error': 'lon and lat need to be numbers (degrees), radius a number of metres '
+                                     'not below 0 (default 20)'}), 400
+        passes = data.waypoint_index.passes(lon, lat, radius)
+        return server.response_class(passes.to_json(orient='records', date_format='iso'), mimetype='application/json')
+
+    @server.route('/sessions', methods=['POST'])
+    def upload_sessions():
+        # New session exports, as multipart files or one JSON request body, e.g.
+        # curl -F file=@session.json http://localhost:8050/sessions
+        if not data.ready.is_set():
+            return jsonify(data.status()), 503
+        if request.content_length is None:
+            return jsonify({'error': 'uploads need a Content-Length'}), 411
+        if request.content_length > MAX_UPLOAD_BYTES:
+            return jsonify({'error': f'uploads are limited to {MAX_UPLOAD_BYTES} bytes'}), 413
+        uploads = [upload.read() for upload in request.files.getlist('file')] or [request.get_data()]
+        if not any(uploads):
+            return jsonify({'error': 'no session file in the request'}), 400
+        paths = [save_upload(content, data.drop_dir) for content in uploads]
+        try:
+            added = data.add_files(paths)
+        except Exception as error:
+            # Files that are not sessions are not left for the watchers or the next start
+            for path in set(paths) - data.paths:
+                os.remove(path)
+            return jsonify({'error': f'{type(error).__name__}: {error}'}), 400
+        # A session uploaded again is not kept twice in the drop directory
+        for path in set(added['duplicates']):
+            os.remove(path)
+        return jsonify(added), 201 if added['sessions'] else 200
+
+    app.layout = lambda: html.Div(
+        id='page', children=dashboard_layout(data) if data.ready.is_set() else loading_layout(data))
+
+    # Step 5: Define app callbacks for the loading page, the task selectors and map updates
+    @app.callback(
+        [Output('page', 'children'),
+         Output('loading-status', 'children')],
+        Input('loading-poll', 'n_intervals')
+    )
+    def poll_loading(_):
+        if data.ready.is_set():
+            return dashboard_layout(data), dash.no_update
+        return dash.no_update, describe_status(data.status())
+
+    @app.callback(
+        [Output('data-revision', 'data'),
+         Output('task-category-dropdown', 'options'),
+         Output('metrics-store', 'data')],
+        Input('refresh-poll', 'n_intervals'),
+        State('data-revision', 'data')
+    )
+    def refresh_data(_, revision):
+        # Only sends anything when sessions were added since the page got its data
+        if not data.ready.is_set() or revision == data.revision:
+            raise PreventUpdate
+        options = [{'label': category, 'value': category} for category in data.task_categories]
+        return data.revision, options, metrics_records(data)
+
+    @app.callback(
+        [Output('task-number-dropdown', 'options'),
+         Output('task-number-dropdown', 'value')],
+        [Input('task-category-dropdown', 'value'),
+         Input('data-revision', 'data')],
+        State('task-number-dropdown', 'value')
+    )
+    def update_task_numbers(category, _, current):
+        if not data.ready.is_set():
+            raise PreventUpdate
+        numbers = data.task_numbers(category)
+        value = current if current in numbers else numbers[0] if numbers else None
+        return [{'label': number, 'value': number} for number in numbers], value
+
+    @app.callback(
+        [Output('task-participant-dropdown', 'options'),
+         Output('task-participant-dropdown', 'value')],
+        [Input('task-category-dropdown', 'value'),
+         Input('task-number-dropdown', 'value')],
+        State('task-participant-dropdown', 'value')
+    )
+    def update_participants(category, number, current):
+        # Values are session ids, so the selected session stays selected on its other tasks
+        if not data.ready.is_set():
+            raise PreventUpdate
+        options = data.track_options(category, number)
+        sessions = [option['value'] for option in options]
+        return options, current if current in sessions else sessions[0] if sessions else None
+
+    # Table and chart are filtered from the metrics store in the browser, so task
+    # and radio changes cost no server round-trip
+    app.clientside_callback(
+        """
+        function(metrics, category, number, column, track) {
+            const rows = (metrics || []).filter(
+                row => row.track === track && row.taskCategory === category && row.taskNo === number);
+            const table = rows.map(row => ({
+                participant: row.label,
+                Route_length: row.Route_length,
+                Duration: row.Duration,
+                Mean_speed: row.Mean_speed,
+                Tortuosity: row.Tortuosity,
+                Stops: row.Stops,
+                Dwell_time: row.Dwell_time,
+                Turns: row.Turns,
+                Backtrack: row.Backtrack
+            }));
+            const figure = {
+                data: [{
+                    type: 'histogram',
+                    histfunc: 'sum',
+                    x: rows.map(row => row.label),
+                    y: rows.map(row => row[column])
+                }],
+                layout: {
+                    xaxis: {title: {text: 'participant'}},
+                    yaxis: {title: {text: 'sum of ' + column}},
+                    barmode: 'relative'
+                }
+            };
+            return [table, figure];
+        }
+        """,
+        [Output('metrics-table', 'data'),
+         Output('controls-and-graph', 'figure')],
+        [Input('metrics-store', 'data'),
+         Input('task-category-dropdown', 'value'),
+         Input('task-number-dropdown', 'value'),
+         Input('controls-and-radio-item', 'value'),
+         Input('track-radio', 'value')]
+    )
+
+    @app.callback(
+        [Output('map', 'srcDoc'),
+         Output('map-token', 'data')],
+        [Input('task-participant-dropdown', 'value'),
+         Input('task-category-dropdown', 'value'),
+         Input('task-number-dropdown', 'value'),
+         Input('zoom-slider', 'value'),
+         Input('track-radio', 'value'),
+         Input('map-view', 'value')]
+    )
+    def update_map(session, category, number, zoom, track, view):
+        # Update map based on the selected participant's session and task
+        if not data.ready.is_set():
+            raise PreventUpdate
+        key = data.tracks.key(session, category, number)
+        default_opacity = 0.5  # Set default opacity
+        default_basemap = 'OpenStreetMap'  # Default basemap
+        token = uuid.uuid4().hex
+        if view in ('task', 'all'):
+            # Every participant's fixes, from the precomputed density grid
+            scope = task_scope(category, number) if view == 'task' else ALL_TASKS
+            return cached_density_map(data.density, scope, default_basemap, data.version, zoom=zoom), token
+        if key is None:
+            return '', token
+        return cached_map(data.tracks, key, default_opacity, default_basemap, data.version, zoom=zoom,
+                          segments=data.segments, smoothed=track == 'smoothed', playback=view == 'playback'), token
+
+    @app.callback(
+        Output('similarity-matrix', 'figure'),
+        [Input('task-category-dropdown', 'value'),
+         Input('task-number-dropdown', 'value'),
+         Input('track-radio', 'value'),
+         Input('similarity-metric', 'value'),
+         Input('data-revision', 'data')]
+    )
+    def update_similarity_matrix(category, number, track, metric, _):
+        # Rows and columns in cluster order, so groups of similar routes show as blocks
+        if not data.ready.is_set():
+            raise PreventUpdate
+        _, labels, matrix, order, _ = data.route_similarity(category, number, metric, track)
+        labels = [labels[row] for row in order]
+        return {
+            'data': [{
+                'type': 'heatmap',
+                'z': np.round(matrix[np.ix_(order, order)], 1).tolist(),
+                'x': labels,
+                'y': labels,
+                'colorscale': 'Viridis',
+                'reversescale': True,
+                'colorbar': {'title': {'text': 'm'}}
+            }],
+            'layout': {
+                'title': {'text': f'{METRICS[metric]}, clustered'},
+                'yaxis': {'autorange': 'reversed'},
+                'height': 500
+            }
+        }
+
+    @app.callback(
+        [Output('similar-routes', 'data'),
+         Output('similar-routes-title', 'children')],
+        [Input('task-participant-dropdown', 'value'),
+         Input('task-category-dropdown', 'value'),
+         Input('task-number-dropdown', 'value'),
+         Input('track-radio', 'value'),
+         Input('similarity-metric', 'value'),
+         Input('data-revision', 'data')]
+    )
+    def update_similar_routes(session, category, number, track, metric, _):
+        if not data.ready.is_set():
+            raise PreventUpdate
+        key = data.tracks.key(session, category, number)
+        if key is None:
+            return [], 'Most Similar Routes'
+        keys, labels, _, _, _ = data.route_similarity(category, number, metric, track)
+        label = labels[keys.index(key)] if key in keys else key[0]
+        return data.most_similar(key, metric, track).to_dict('records'), f'Most Similar Routes to {label}'
+
+    @app.callback(
+        [Output('playback-controls', 'style'),
+         Output('playback-window', 'max'),
+         Output('playback-window', 'value')],
+        [Input('task-participant-dropdown', 'value'),
+         Input('task-category-dropdown', 'value'),
+         Input('task-number-dropdown', 'value'),
+         Input('map-view', 'value')]
+    )
+    def update_playback_controls(session, category, number, view):
+        # The slider spans the selected track and starts out showing all of it
+        if not data.ready.is_set():
+            raise PreventUpdate
+        if view != 'playback':
+            return {'display': 'none'}, dash.no_update, dash.no_update
+        duration = max(np.ceil(data.tracks.duration(data.tracks.key(session, category, number))), PLAYBACK_STEP)
+        return {'display': 'block'}, duration, [0, duration]
+
+    @app.callback(
+        [Output('playback-message', 'data'),
+         Output('playback-state', 'data')],
+        [Input('playback-window', 'value'),
+         Input('map-token', 'data')],
+        [State('task-participant-dropdown', 'value'),
+         State('task-category-dropdown', 'value'),
+         State('task-number-dropdown', 'value'),
+         State('track-radio', 'value'),
+         State('map-view', 'value'),
+         State('playback-state', 'data')]
+    )
+    def update_playback(window, token, session, category, number, track, view, state):
+        # Only the rows the map does not hold yet are sent; a new map, or new data
+        # for its track, starts over
+        if not data.ready.is_set() or view != 'playback' or not window:
+            raise PreventUpdate
+        key = data.tracks.key(session, category, number)
+        if key is None:
+            raise PreventUpdate
+        held = None
+        if state and (state['token'], state['revision'], tuple(state['key'])) == (token, data.revision, key):
+            held = state['held']
+        rows = data.tracks.track(key)
+        message, held = playback_update(smoothed_view(rows) if track == 'smoothed' else rows,
+                                        data.tracks.window(key, *window), held)
+        return message, {'token': token, 'revision': data.revision, 'key': key, 'held': held}
+
+    # Hands the update to the playback layer in the map's iframe (once the map has loaded)
+    app.clientside_callback(
+        """
+        function(message) {
+            const frame = document.getElementById('map');
+            if (message && frame) {
+                const post = () => frame.contentWindow.postMessage(message, '*');
+                if (frame.contentWindow && frame.contentWindow.wayfindingPlayback) {
+                    post();
+                } else {
+                    frame.addEventListener('load', post, {once: true});
+                }
+            }
+            return window.dash_clientside.no_update;
+        }
+        """,
+        Output('playback-sent', 'data'),
+        Input('playback-message', 'data')
+    )
+
+    data.start(load)
+    return app
+
+
+# `gunicorn wayfinding:server` serves this module-level app
+data = DashboardData()
+app = create_app(data)
+server = app.server
 
 # Run the Dash app
 if __name__ == "__main__":
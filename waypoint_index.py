@@ -0,0 +1,174 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from metrics import GEOD, GROUP_KEYS, local_xy
+from waypoint_table import concat_frames
+
+# Spatial index over the waypoints of all sessions.
+#
+# Waypoints are projected once to local metres around the study area and put
+# in a shapely STRtree. Viewport (bounding box), radius and nearest-waypoint
+# queries then visit only the tree nodes near the query instead of every row.
+# Radius and nearest results are re-measured on the WGS84 ellipsoid, so the
+# projection only has to be good enough to find candidates. Query results
+# are row positions into the indexed rows (e.g. TaskIndex.frame).
+#
+# An STRtree cannot be added to, so the rows of new sessions (a TaskIndex
+# block, see TaskIndex.extend) get a tree of their own and queries search
+# every part. Parts are merged as in a log-structured merge: whenever a part
+# is at least half the size of the one before it the two are rebuilt as one.
+# Part sizes then fall off geometrically, so there are O(log n) parts, every
+# waypoint is re-indexed O(log n) times, and adding a session costs about
+# its own size rather than the whole index's.
+
+# Candidate search margin over the requested radius, covering projection error
+RADIUS_MARGIN = 1.01
+
+
+class _Part:
+    # STRtree over valid waypoints at row positions `rows`
+
+    def __init__(self, lon, lat, rows, origin_lat):
+        self.lon, self.lat, self.rows = lon, lat, rows
+        self.tree = shapely.STRtree(shapely.points(*local_xy(lon, lat, origin_lat)))
+
+    @classmethod
+    def of_frame(cls, frame, offset, origin_lat):
+        # Part over the rows of `frame`, which start at row position `offset`
+        lon = frame['longitude'].to_numpy(dtype=np.float64)
+        lat = frame['latitude'].to_numpy(dtype=np.float64)
+        valid = ~(np.isnan(lon) | np.isnan(lat))
+        return cls(lon[valid], lat[valid], np.flatnonzero(valid) + offset, origin_lat)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _merged(parts, origin_lat):
+    # One part over the waypoints of `parts`
+    return _Part(np.concatenate([part.lon for part in parts]), np.concatenate([part.lat for part in parts]),
+                 np.concatenate([part.rows for part in parts]), origin_lat)
+
+
+class WaypointIndex:
+
+    def __init__(self, frame):
+        lat = frame['latitude'].to_numpy(dtype=np.float64)
+        self.origin_lat = float(np.nanmean(lat)) if np.isfinite(lat).any() else 0.0
+        self.frames, self.offsets = [frame], [0]
+        self.parts = [_Part.of_frame(frame, 0, self.origin_lat)]
+
+    def extend(self, frame):
+        """Index with the rows of `frame` (e.g. the block of new sessions TaskIndex.extend adds)
+        following the indexed ones."""
+        offset = self.offsets[-1] + len(self.frames[-1])
+        parts = self.parts + [_Part.of_frame(frame, offset, self.origin_lat)]
+        while len(parts) > 1 and len(parts[-2]) <= 2 * len(parts[-1]):
+            parts[-2:] = [_merged(parts[-2:], self.origin_lat)]
+        index = WaypointIndex.__new__(WaypointIndex)
+        index.origin_lat = self.origin_lat
+        index.frames, index.offsets = self.frames + [frame], self.offsets + [offset]
+        index.parts = parts
+        return index
+
+    def rows(self, positions, columns):
+        """`columns` of the indexed rows at `positions` (ascending row positions, e.g. a sorted query result)."""
+        frames = np.searchsorted(self.offsets, positions, side='right') - 1
+        return concat_frames([frame[columns].iloc[positions[frames == number] - self.offsets[number]]
+                              for number, frame in enumerate(self.frames)])
+
+    @property
+    def lon(self):
+        return np.concatenate([part.lon for part in self.parts])
+
+    @property
+    def lat(self):
+        return np.concatenate([part.lat for part in self.parts])
+
+    def _point(self, lon, lat):
+        return shapely.points(*local_xy(lon, lat, self.origin_lat))
+
+    def bbox(self, west, south, east, north):
+        """Row positions of the waypoints inside a lon/lat bounding box (e.g. the map viewport)."""
+        x0, y0 = local_xy(west, south, self.origin_lat)
+        x1, y1 = local_xy(east, north, self.origin_lat)
+        box = shapely.box(x0, y0, x1, y1)
+        return np.concatenate([part.rows[np.sort(part.tree.query(box, predicate='intersects'))]
+                               for part in self.parts])
+
+    def radius(self, lon, lat, metres):
+        """(row positions, geodesic distances in metres) of the waypoints within `metres` of a point."""
+        point = self._point(lon, lat)
+        rows, distances = [], []
+        for part in self.parts:
+            candidates = np.sort(part.tree.query(point, predicate='dwithin', distance=metres * RADIUS_MARGIN + 1))
+            distance = GEOD.inv(np.full(len(candidates), lon), np.full(len(candidates), lat),
+                                part.lon[candidates], part.lat[candidates])[2]
+            within = distance <= metres
+            rows.append(part.rows[candidates[within]])
+            distances.append(distance[within])
+        return np.concatenate(rows), np.concatenate(distances)
+
+    def nearest(self, lon, lat):
+        """(row position, geodesic distance in metres) of the waypoint closest to a point."""
+        best = (None, np.nan)
+        point = self._point(lon, lat)
+        for part in self.parts:
+            if not len(part.rows):
+                continue
+            candidate = int(part.tree.query_nearest(point)[0])
+            distance = float(GEOD.inv(lon, lat, part.lon[candidate], part.lat[candidate])[2])
+            if best[0] is None or distance < best[1]:
+                best = (int(part.rows[candidate]), distance)
+        return best
+
+    def passes(self, lon, lat, metres, keys=GROUP_KEYS):
+        """Which tracks passed within `metres` of a point: first/last time there and closest approach."""
+        rows, distance = self.radius(lon, lat, metres)
+        order = np.argsort(rows, kind='stable')
+        near = self.rows(rows[order], keys + ['timestamp']).assign(distance_m=distance[order])
+        return near.groupby(keys, observed=True, sort=True).agg(
+            first_seen=('timestamp', 'min'),
+            last_seen=('timestamp', 'max'),
+            points=('timestamp', 'size'),
+            closest_m=('distance_m', 'min'),
+        ).reset_index()
+
+    def __len__(self):
+        return sum(len(part.rows) for part in self.parts)
+
+
+def query_report(index, repeat=1000):
+    """Mean time per bbox, radius and nearest query around the data's centre."""
+    lon, lat = float(np.median(index.lon)), float(np.median(index.lat))
+    queries = {
+        'bbox (~500 m)': lambda: len(index.bbox(lon - 0.0036, lat - 0.00225, lon + 0.0036, lat + 0.00225)),
+        'radius (20 m)': lambda: len(index.radius(lon, lat, 20)[0]),
+        'nearest': lambda: int(index.nearest(lon, lat)[0] is not None),
+    }
+    rows = []
+    for name, query in queries.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            found = query()
+        elapsed = (time.perf_counter() - start) / repeat
+        rows.append({'query': name, 'results': found, 'ms': elapsed * 1000})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+
+    parser = argparse.ArgumentParser(description="Build the waypoint spatial index and time its queries")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    args = parser.parse_args()
+
+    waypoints = ingest(args.source).waypoint_frame()
+    start = time.perf_counter()
+    index = WaypointIndex(waypoints)
+    print(f"indexed {len(index)} waypoints in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(query_report(index).to_string(index=False))
@@ -0,0 +1,132 @@
+import argparse
+import gc
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from instrumentation import process_memory
+from metrics import GROUP_KEYS
+
+# Compact in-memory layout of the combined waypoint table.
+#
+# The extracted columns keep the loader's wide dtypes (float64 everywhere,
+# fixed-width unicode for text) because that is what the column cache stores.
+# Views take a narrower copy of only the columns they use: coordinates stay
+# float64 (float32 is ~0.4 m at these latitudes, too coarse for segment
+# lengths), sensor and interaction readings become float32, counters the
+# smallest signed int holding their range (-1 stays the missing value), and
+# repeated text a categorical. The -1 that sensors report for "no reading"
+# becomes NaN, so it cannot pass for a speed or heading.
+#
+# No per-row geometry is kept; `geodataframe` builds shapely points for the
+# rows of a view when something needs them.
+
+# Columns the dashboard uses: track keys and order, position and its accuracy,
+# heading colors and the speed and compass readings segmentation needs
+DASHBOARD_COLUMNS = GROUP_KEYS + ['timestamp', 'longitude', 'latitude', 'accuracy', 'heading', 'speed',
+                                  'compassHeading']
+
+FLOAT32_COLUMNS = ['altitude', 'speed', 'heading', 'accuracy', 'rotation', 'compassHeading', 'zoom',
+                   'viewport_west', 'viewport_south', 'viewport_east', 'viewport_north']
+
+INT_COLUMNS = ['taskNo', 'panCount', 'zoomCount']
+
+CATEGORY_COLUMNS = ['participant', 'taskCategory']
+
+# Readings where a negative value is the "not available" sentinel
+SENTINEL_COLUMNS = ['speed', 'heading', 'accuracy']
+
+
+def small_int(values):
+    """`values` as the smallest signed integer dtype (at least int8) that holds their range."""
+    values = np.asarray(values)
+    if not len(values):
+        return values.astype(np.int8)
+    dtype = np.result_type(np.min_scalar_type(int(values.min())), np.min_scalar_type(int(values.max())),
+                           np.int8)
+    return values.astype(dtype, copy=False)
+
+
+def compact_column(name, values):
+    """One extracted waypoint column in its compact dtype."""
+    if name in SENTINEL_COLUMNS:
+        values = np.asarray(values, dtype=np.float32)
+        return np.where(values < 0, np.float32(np.nan), values)
+    if name in FLOAT32_COLUMNS:
+        return np.asarray(values, dtype=np.float32)
+    if name in INT_COLUMNS:
+        return small_int(values)
+    if name in CATEGORY_COLUMNS:
+        return pd.Categorical(values)
+    return values
+
+
+def concat_frames(frames):
+    """Concatenate frames with the same columns, keeping categorical columns categorical."""
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    dtypes = {}
+    for name, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            categories = union_categoricals([frame[name].astype('category') for frame in frames],
+                                            sort_categories=True).categories
+            dtypes[name] = pd.CategoricalDtype(categories)
+    return pd.concat([frame.astype(dtypes) for frame in frames], ignore_index=True)
+
+
+def geodataframe(frame):
+    """GeoDataFrame (WGS84 points) over a view's rows, built on demand."""
+    import geopandas as gpd
+
+    return gpd.GeoDataFrame(frame, geometry=gpd.points_from_xy(frame['longitude'], frame['latitude']),
+                            crs="EPSG:4326")
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def geometry_bytes(frame):
+    """Process memory taken by one shapely point per row (GEOS allocations pandas cannot see)."""
+    import geopandas as gpd
+
+    gc.collect()
+    before = process_memory()['rss']
+    points = gpd.points_from_xy(frame['longitude'], frame['latitude'])
+    grown = process_memory()['rss'] - before if before is not None else np.nan
+    del points
+    return max(grown, frame_bytes(frame[['longitude']]))
+
+
+def memory_report(store, columns=DASHBOARD_COLUMNS):
+    """Memory per million waypoints of the full table with point geometry (the former GeoDataFrame)
+    against the compact frames."""
+    per_million = 1e6 / max(len(store), 1)
+    full = store.waypoint_frame()
+    sizes = {
+        'full + point geometry': (len(full.columns) + 1, frame_bytes(full) + geometry_bytes(full)),
+        'full': (len(full.columns), frame_bytes(full)),
+    }
+    del full
+    for name, frame in [('compact', store.waypoint_frame(compact=True)),
+                        ('compact dashboard view', store.waypoint_frame(columns, compact=True))]:
+        sizes[name] = (len(frame.columns), frame_bytes(frame))
+    report = pd.DataFrame([{'frame': name, 'columns': count, 'MB': size / 2 ** 20,
+                            'MB_per_million': size * per_million / 2 ** 20}
+                           for name, (count, size) in sizes.items()])
+    report['ratio'] = report['MB'] / report['MB'].iloc[0]
+    return report
+
+
+if __name__ == "__main__":
+    from ingest import DATA_SOURCE, ingest
+
+    parser = argparse.ArgumentParser(description="Report waypoint table memory per million waypoints")
+    parser.add_argument('source', nargs='?', default=DATA_SOURCE, help="directory or glob of session JSON files")
+    args = parser.parse_args()
+
+    store = ingest(args.source)
+    print(f"{len(store)} waypoints in {len(store.sessions)} sessions")
+    print(memory_report(store).to_string(index=False, float_format='{:.2f}'.format))